@@ -39,12 +39,32 @@ def create_app(config_name):
     # push an app context so we have access to current_app
     # when things like forms are created
     with app.app_context():
+        from .models import follow_graph, user_cache
+        follow_graph.init_app(app)
+        user_cache.init_app(app)
+        from .activity import last_seen_buffer
+        last_seen_buffer.init_app(app)
+        from .markup import comment_renderer
+        comment_renderer.init_app(app)
+        from .email import mail_queue
+        mail_queue.init_app(app)
+        from .images import image_pipeline, image_sweeper
+        image_pipeline.init_app(app)
+        image_sweeper.init_app(app)
+        from .fragments import fragment_cache
+        fragment_cache.init_app(app)
+        from .avatars import avatar_store
+        avatar_store.init_app(app)
+
         # register blueprints
         from .main import main as main_blueprint
         app.register_blueprint(main_blueprint)
         
         from .auth import auth as auth_blueprint
         app.register_blueprint(auth_blueprint, url_prefix='/auth')
+
+        from .api_v1 import api as api_v1_blueprint
+        app.register_blueprint(api_v1_blueprint, url_prefix='/api/v1')
         #####################
 
     return app
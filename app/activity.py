@@ -0,0 +1,117 @@
+"""
+Write-behind buffering for User.last_seen.
+
+User.ping runs on every authenticated request. Rather than turning each
+page view into an UPDATE on users, pings are coalesced in memory per user
+and written out together with a single executemany once the buffer is big
+or old enough, checked on every ping and after every commit, and once
+more when the process exits.
+"""
+import atexit
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+from sqlalchemy import bindparam, event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from . import db
+
+
+class LastSeenBuffer(object):
+    def __init__(self, app=None):
+        self.app = None
+        self._pending = {}
+        self._lock = Lock()
+        self._last_flush = time.time()
+        self._registered = False
+        if app is not None:
+            self.init_app(app)
+
+
+    def init_app(self, app):
+        self.flush()
+        self.app = app
+        self.granularity = timedelta(
+            seconds=app.config['STOCKPOT_LAST_SEEN_GRANULARITY'])
+        self.flush_interval = app.config['STOCKPOT_LAST_SEEN_FLUSH_INTERVAL']
+        self.flush_size = app.config['STOCKPOT_LAST_SEEN_FLUSH_SIZE']
+        if not self._registered:
+            atexit.register(self.flush)
+            self._registered = True
+
+
+    def __len__(self):
+        return len(self._pending)
+
+
+    def touch(self, user, now=None):
+        """Record that ``user`` was seen, at most once per granularity."""
+        now = now or datetime.utcnow()
+        with self._lock:
+            last_seen = self._pending.get(user.id, user.last_seen)
+            if last_seen is not None and now - last_seen < self.granularity:
+                return
+            self._pending[user.id] = now
+            due = len(self._pending) >= self.flush_size or \
+                time.time() - self._last_flush >= self.flush_interval
+        # keep the loaded object current without making it dirty
+        set_committed_value(user, 'last_seen', now)
+        if due:
+            self.flush()
+
+
+    def flush_if_due(self):
+        """
+        Flush once the interval has passed. Runs after every commit, the
+        one closing each request included, so the pings of users who went
+        quiet do not wait for the next one.
+        """
+        with self._lock:
+            due = self._pending and \
+                time.time() - self._last_flush >= self.flush_interval
+        if not due:
+            return
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception('Flushing last_seen failed')
+
+
+    def flush(self):
+        """
+        Write every buffered timestamp with one executemany. On failure
+        the batch goes back into the buffer for the next flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+        if not pending or self.app is None:
+            return
+        try:
+            self._write(pending)
+        except Exception:
+            with self._lock:
+                # pings taken since are newer, they win
+                for user_id, seen in pending.items():
+                    self._pending.setdefault(user_id, seen)
+            raise
+
+
+    def _write(self, pending):
+        from .models import User
+        users = User.__table__
+        db.get_engine(self.app).execute(
+            users.update().where(users.c.id == bindparam('user_id'))
+            .values(last_seen=bindparam('seen')),
+            [{'user_id': user_id, 'seen': seen}
+             for user_id, seen in pending.items()])
+
+
+last_seen_buffer = LastSeenBuffer()
+
+
+@event.listens_for(Session, 'after_commit')
+def _flush_after_commit(session):
+    # on its own connection, so only once the session let go of its
+    # transaction; SQLite would have the UPDATE wait on the session's lock
+    last_seen_buffer.flush_if_due()
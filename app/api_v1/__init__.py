@@ -0,0 +1,8 @@
+"""
+Initialize the JSON API blueprint, mounted at /api/v1.
+"""
+from flask import Blueprint
+
+api = Blueprint('api', __name__)
+
+from . import authentication, errors, recipes, users, comments, shopping
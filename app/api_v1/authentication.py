@@ -0,0 +1,57 @@
+"""
+Token authentication for the API.
+
+Clients trade an email and password, sent with HTTP Basic auth, for a
+signed token at POST /tokens and then send ``Authorization: Bearer
+<token>``. The session cookie of the website is ignored here, so API
+writes cannot be forged by other sites. Reads work without a token.
+"""
+from functools import wraps
+from flask import g, request, jsonify, current_app
+from ..models import User, AnonymousUser
+from . import api
+from .errors import unauthorized, forbidden
+
+
+@api.before_request
+def authenticate():
+    g.current_user = AnonymousUser()
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        user = User.verify_auth_token(header[len('Bearer '):])
+        if user is None:
+            return unauthorized('Invalid or expired token.')
+        g.current_user = user
+
+
+def permission_required(permission):
+    """Like app.decorators.permission_required, for token users."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not g.current_user.is_authenticated:
+                return unauthorized('A token is required.')
+            if not g.current_user.can(permission):
+                return forbidden('Insufficient permissions.')
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def login_required(f):
+    return permission_required(0)(f)
+
+
+@api.route('/tokens', methods=['POST'])
+def get_token():
+    credentials = request.authorization
+    user = None
+    if credentials is not None and credentials.username:
+        user = User.query.filter_by(email=credentials.username).first()
+    if user is None or not user.verify_password(credentials.password):
+        return unauthorized('Invalid credentials.')
+    if not user.confirmed:
+        return forbidden('Unconfirmed account.')
+    expiration = current_app.config['STOCKPOT_API_TOKEN_EXPIRATION']
+    return jsonify({'token': user.generate_auth_token(expiration),
+                    'expiration': expiration})
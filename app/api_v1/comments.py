@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from flask import g, request, url_for
+from ..models import Comment, Recipe, Permission
+from .. import db
+from . import api
+from .authentication import permission_required
+from .errors import not_found, bad_request
+from .resources import Resource, Field, column, isoformat, batch, page, one
+
+
+def _visible(comment, value):
+    # the website shows disabled comments to moderators only
+    if comment.disabled and \
+            not g.current_user.can(Permission.MODERATE_COMMENTS):
+        return None
+    return value
+
+
+comment_resource = Resource(Comment, OrderedDict([
+    ('id', column('id')),
+    ('url', Field((), lambda c: url_for('api.get_comment', id=c.id,
+                                        _external=True))),
+    ('body', Field(('body', 'disabled'), lambda c: _visible(c, c.body))),
+    ('body_html', Field(('body_html', 'disabled'),
+                        lambda c: _visible(c, c.body_html))),
+    ('timestamp', Field(('timestamp',), lambda c: isoformat(c.timestamp))),
+    ('disabled', Field(('disabled',), lambda c: bool(c.disabled))),
+    ('author_id', column('author_id')),
+    ('recipe_id', column('recipe_id')),
+]), default=('id', 'url', 'body_html', 'timestamp', 'disabled',
+             'author_id', 'recipe_id'))
+
+
+@api.route('/comments')
+def get_comments():
+    if 'ids' not in request.args:
+        return bad_request('Pass the comments wanted as ids=1,2,3.')
+    return batch(comment_resource, Comment.query, comment_resource.names())
+
+
+@api.route('/comments/<int:id>')
+def get_comment(id):
+    names = comment_resource.names()
+    comment = Comment.query.options(comment_resource.load_only(names)).get(id)
+    if comment is None:
+        return not_found('No such comment.')
+    return one(comment_resource, comment, names)
+
+
+@api.route('/recipes/<int:id>/comments')
+def get_recipe_comments(id):
+    """A recipe's comments, oldest first like on the website."""
+    return page(comment_resource, Comment.query.filter_by(recipe_id=id),
+                (Comment.timestamp, Comment.id), comment_resource.names(),
+                descending=False)
+
+
+@api.route('/recipes/<int:id>/comments', methods=['POST'])
+@permission_required(Permission.COMMENT)
+def new_recipe_comment(id):
+    recipe = Recipe.query.get(id)
+    if recipe is None:
+        return not_found('No such recipe.')
+    body = (request.get_json(silent=True) or {}).get('body')
+    if not body or not body.strip():
+        return bad_request('A comment needs a body.')
+    comment = Comment(body=body, recipe=recipe, author=g.current_user)
+    db.session.add(comment)
+    db.session.commit()
+    response = one(comment_resource, comment, list(comment_resource.default))
+    response.status_code = 201
+    response.headers['Location'] = url_for('api.get_comment', id=comment.id,
+                                           _external=True)
+    return response
@@ -0,0 +1,38 @@
+"""
+Error responses of the API, always JSON.
+"""
+from flask import jsonify
+from . import api
+
+
+class ValidationError(ValueError):
+    pass
+
+
+def error(status, name, message):
+    response = jsonify({'error': name, 'message': message})
+    response.status_code = status
+    return response
+
+
+def bad_request(message):
+    return error(400, 'bad request', message)
+
+
+def unauthorized(message):
+    response = error(401, 'unauthorized', message)
+    response.headers['WWW-Authenticate'] = 'Bearer realm="api"'
+    return response
+
+
+def forbidden(message):
+    return error(403, 'forbidden', message)
+
+
+def not_found(message):
+    return error(404, 'not found', message)
+
+
+@api.errorhandler(ValidationError)
+def validation_error(e):
+    return bad_request(e.args[0])
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+from urllib.parse import urljoin
+from flask import g, request, url_for
+from ..models import Recipe
+from ..queries import followed_feed, recipe_key, ingredient_lines, \
+    step_bodies
+from ..storage import image_url
+from . import api
+from .authentication import login_required
+from .errors import not_found
+from .resources import Resource, Field, column, isoformat, batch, page, one
+
+
+def _ingredients(recipes):
+    lines = OrderedDict((recipe.id, []) for recipe in recipes)
+    for recipe_id, amount, units, name in ingredient_lines(lines):
+        lines[recipe_id].append(
+            {'amount': amount, 'units': units, 'name': name})
+    return lines
+
+
+def _steps(recipes):
+    steps = OrderedDict((recipe.id, []) for recipe in recipes)
+    for recipe_id, body in step_bodies(steps):
+        steps[recipe_id].append(body)
+    return steps
+
+
+def _absolute(url):
+    return urljoin(request.url_root, url)
+
+
+def _variants(recipe):
+    return dict((ext, OrderedDict((str(width), _absolute(image_url(name)))
+                                  for width, name in
+                                  recipe._img_variants(ext)))
+                for ext in ('webp', 'jpeg'))
+
+
+recipe_resource = Resource(Recipe, OrderedDict([
+    ('id', column('id')),
+    ('url', Field((), lambda r: url_for('api.get_recipe', id=r.id,
+                                        _external=True))),
+    ('title', column('title')),
+    ('description', column('description')),
+    ('timestamp', Field(('timestamp',), lambda r: isoformat(r.timestamp))),
+    ('updated_at', Field(('updated_at',),
+                         lambda r: isoformat(r.updated_at))),
+    # in seconds
+    ('prep_time', column('prep_seconds')),
+    ('cook_time', column('cook_seconds')),
+    ('total_time', column('total_seconds')),
+    ('author_id', column('author_id')),
+    ('comments_count', column('comments_count')),
+    ('image', Field(('img_filename',), lambda r: _absolute(r.img_src))),
+    ('image_variants', Field(('img_filename', 'img_variants'), _variants)),
+    ('ingredients', Field(fetch=_ingredients)),
+    ('steps', Field(fetch=_steps)),
+]), default=('id', 'url', 'title', 'timestamp', 'author_id',
+             'comments_count', 'image'))
+
+
+@api.route('/recipes')
+def get_recipes():
+    names = recipe_resource.names()
+    if 'ids' in request.args:
+        return batch(recipe_resource, Recipe.query, names)
+    return page(recipe_resource, Recipe.query, (Recipe.timestamp, Recipe.id),
+                names)
+
+
+@api.route('/recipes/<int:id>')
+def get_recipe(id):
+    names = recipe_resource.names()
+    recipe = Recipe.query.options(recipe_resource.load_only(names)).get(id)
+    if recipe is None:
+        return not_found('No such recipe.')
+    return one(recipe_resource, recipe, names)
+
+
+@api.route('/users/<int:id>/recipes')
+def get_user_recipes(id):
+    return page(recipe_resource, Recipe.query.filter_by(author_id=id),
+                (Recipe.timestamp, Recipe.id), recipe_resource.names())
+
+
+@api.route('/feed')
+@login_required
+def get_feed():
+    """Recipes by the users the token's owner follows, newest first."""
+    query, columns = followed_feed(g.current_user)
+    return page(recipe_resource, query, columns, recipe_resource.names(),
+                key=recipe_key)
@@ -0,0 +1,184 @@
+"""
+How models are turned into JSON.
+
+A Resource lists the fields a client may pick with ``fields=a,b`` and the
+columns behind each one, so a narrow request also loads narrowly. Fields
+kept in other tables, like the steps of a recipe, are fetched for a whole
+chunk of items with one query.
+
+Lists are written out as the rows arrive instead of being built in
+memory first: ``{"items": [...], "next": cursor}``, with ``next`` only
+present when there is another page, fetched with ``after=cursor``.
+"""
+import json
+from collections import OrderedDict
+from flask import request, current_app, url_for, Response, \
+    stream_with_context
+from sqlalchemy.orm import load_only
+from ..pagination import seek, encode_cursor, decode_cursor
+from .errors import ValidationError
+
+
+# items serialized between fetches of their related rows
+CHUNK_SIZE = 100
+
+
+def isoformat(value):
+    return value.isoformat() + 'Z' if value is not None else None
+
+
+class Field(object):
+    def __init__(self, columns=(), get=None, fetch=None):
+        # attributes to load, a getter, or for related rows a function
+        # from a list of items to {item id: value}
+        self.columns = columns
+        self.get = get
+        self.fetch = fetch
+
+
+def column(name):
+    return Field((name,), lambda item: getattr(item, name))
+
+
+class Resource(object):
+    def __init__(self, model, fields, default, identity=('id',)):
+        self.model = model
+        self.fields = fields
+        self.default = default
+        # primary key columns, always loaded
+        self.identity = identity
+
+
+    def names(self):
+        """The fields asked for with ``fields=``, or the default ones."""
+        requested = request.args.get('fields')
+        if not requested:
+            return list(self.default)
+        names = [name.strip() for name in requested.split(',')
+                 if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValidationError('Unknown fields: {}. Known: {}.'.format(
+                ', '.join(unknown), ', '.join(self.fields)))
+        return names
+
+
+    def load_only(self, names, extra=()):
+        columns = set(self.identity)
+        columns.update(extra)
+        for name in names:
+            columns.update(self.fields[name].columns)
+        return load_only(*sorted(columns))
+
+
+    def dump(self, items, names):
+        fetched = dict((name, self.fields[name].fetch(items))
+                       for name in names if self.fields[name].fetch)
+        for item in items:
+            obj = OrderedDict()
+            for name in names:
+                if name in fetched:
+                    obj[name] = fetched[name].get(item.id)
+                else:
+                    obj[name] = self.fields[name].get(item)
+            yield obj
+
+
+def stream(resource, items, names, tail=None):
+    """
+    A JSON response listing ``items``, written as they are produced;
+    ``tail()`` is called afterwards for more keys, e.g. the cursor.
+    """
+    def generate():
+        yield '{"items": ['
+        separator = ''
+        for chunk in _chunks(items):
+            for obj in resource.dump(chunk, names):
+                yield separator + json.dumps(obj)
+                separator = ','
+        yield ']'
+        for key, value in (tail() if tail else {}).items():
+            yield ', {}: {}'.format(json.dumps(key), json.dumps(value))
+        yield '}'
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
+
+
+def _chunks(items):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def requested_ids(limit):
+    """The request's ``ids=1,2,3``, at most ``limit`` of them."""
+    try:
+        ids = [int(i) for i in request.args['ids'].split(',') if i.strip()]
+    except ValueError:
+        raise ValidationError('ids must be a comma separated list of '
+                              'integers.')
+    if len(ids) > limit:
+        raise ValidationError('At most {} ids at a time.'.format(limit))
+    return ids
+
+
+def batch(resource, query, names):
+    """Items with the ``ids=1,2,3`` of the request, in that order."""
+    ids = requested_ids(current_app.config['STOCKPOT_API_MAX_IDS'])
+    found = {}
+    if ids:
+        found = dict((item.id, item) for item in query.options(
+            resource.load_only(names)).filter(resource.model.id.in_(ids)))
+    return stream(resource, [found[i] for i in ids if i in found], names)
+
+
+def page(resource, query, columns, names, descending=True, key=None):
+    """
+    One page of ``query`` ordered by ``columns``, starting after the
+    request's ``after`` cursor, ``limit`` items long.
+    """
+    limit = min(max(1, request.args.get(
+        'limit', current_app.config['STOCKPOT_API_PER_PAGE'], type=int)),
+        current_app.config['STOCKPOT_API_MAX_PER_PAGE'])
+    cursor = None
+    if request.args.get('after'):
+        cursor = decode_cursor(request.args['after'], columns)
+        if cursor is None:
+            raise ValidationError('Invalid cursor.')
+    key = key or (lambda item: tuple(getattr(item, c.key) for c in columns))
+    query = seek(query.options(resource.load_only(
+        names, [c.key for c in columns
+                if c.class_ is resource.model])),
+        columns, cursor, descending).limit(limit + 1)
+    state = {'count': 0, 'last': None, 'more': False}
+
+    def items():
+        for item in query:
+            if state['count'] == limit:
+                state['more'] = True
+                break
+            state['count'] += 1
+            state['last'] = item
+            yield item
+
+    def tail():
+        if not state['more']:
+            return {}
+        after = encode_cursor(key(state['last']))
+        args = dict(request.view_args)
+        args.update((k, v) for k, v in request.args.items() if k != 'after')
+        return OrderedDict([
+            ('next', after),
+            ('next_url', url_for(request.endpoint, after=after,
+                                 _external=True, **args))])
+    return stream(resource, items(), names, tail)
+
+
+def one(resource, item, names):
+    return Response(json.dumps(next(resource.dump([item], names))),
+                    mimetype='application/json')
@@ -0,0 +1,27 @@
+from flask import g, request, current_app, jsonify
+from ..shopping import shopping_list, followed_recipes
+from . import api
+from .errors import bad_request, unauthorized
+from .resources import requested_ids
+
+
+@api.route('/shopping-list')
+def get_shopping_list():
+    """
+    The ingredients of the recipes in ``ids=1,2,3`` added up or, with
+    ``followed=1`` and a token, of the ones posted by the users the
+    token's owner follows in the last ``days=7`` days.
+    """
+    if 'ids' in request.args:
+        items = shopping_list(requested_ids(
+            current_app.config['STOCKPOT_SHOPPING_MAX_RECIPES']))
+    elif request.args.get('followed'):
+        if not g.current_user.is_authenticated:
+            return unauthorized('A token is required.')
+        days = request.args.get('days', 7, type=int)
+        if not 1 <= days <= 31:
+            return bad_request('days must be between 1 and 31.')
+        items = shopping_list(followed_recipes(g.current_user, days))
+    else:
+        return bad_request('Pass the recipes as ids=1,2,3 or followed=1.')
+    return jsonify({'items': [item._asdict() for item in items]})
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from urllib.parse import urljoin
+from flask import g, request, url_for
+from ..models import User, Follow, Permission
+from .. import db
+from . import api
+from .authentication import permission_required
+from .errors import not_found, bad_request
+from .resources import Resource, Field, column, isoformat, batch, page, one
+
+
+user_resource = Resource(User, OrderedDict([
+    ('id', column('id')),
+    ('url', Field((), lambda u: url_for('api.get_user', id=u.id,
+                                        _external=True))),
+    ('username', column('username')),
+    ('name', column('name')),
+    ('location', column('location')),
+    ('about_me', column('about_me')),
+    ('member_since', Field(('member_since',),
+                           lambda u: isoformat(u.member_since))),
+    ('last_seen', Field(('last_seen',), lambda u: isoformat(u.last_seen))),
+    ('avatar', Field(('avatar_hash', 'email'), lambda u: urljoin(
+        request.url_root, u.avatar(size=request.args.get(
+            'avatar_size', 100, type=int))))),
+    # the counters include the follow every user has of themselves
+    ('followers_count', Field(('followers_count',),
+                              lambda u: u.followers_count - 1)),
+    ('followed_count', Field(('followed_count',),
+                             lambda u: u.followed_count - 1)),
+    ('recipes_count', column('recipes_count')),
+]), default=('id', 'url', 'username', 'avatar', 'recipes_count'))
+
+
+follow_resource = Resource(Follow, OrderedDict([
+    ('follower_id', column('follower_id')),
+    ('followed_id', column('followed_id')),
+    ('timestamp', Field(('timestamp',), lambda f: isoformat(f.timestamp))),
+]), default=('follower_id', 'followed_id', 'timestamp'),
+    identity=('follower_id', 'followed_id'))
+
+
+@api.route('/users')
+def get_users():
+    if 'ids' not in request.args:
+        return bad_request('Pass the users wanted as ids=1,2,3.')
+    return batch(user_resource, User.query, user_resource.names())
+
+
+@api.route('/users/<int:id>')
+def get_user(id):
+    names = user_resource.names()
+    user = User.query.options(user_resource.load_only(names)).get(id)
+    if user is None:
+        return not_found('No such user.')
+    return one(user_resource, user, names)
+
+
+@api.route('/users/<int:id>/followers')
+def get_followers(id):
+    query = Follow.query.filter(Follow.followed_id == id,
+                                Follow.follower_id != id)
+    return page(follow_resource, query, (Follow.timestamp, Follow.follower_id),
+                follow_resource.names())
+
+
+@api.route('/users/<int:id>/followed')
+def get_followed(id):
+    query = Follow.query.filter(Follow.follower_id == id,
+                                Follow.followed_id != id)
+    return page(follow_resource, query, (Follow.timestamp, Follow.followed_id),
+                follow_resource.names())
+
+
+@api.route('/users/<int:id>/follow', methods=['PUT', 'DELETE'])
+@permission_required(Permission.FOLLOW)
+def follow(id):
+    """PUT follows the user, DELETE unfollows; both can be repeated."""
+    user = User.query.get(id)
+    if user is None:
+        return not_found('No such user.')
+    if user.id == g.current_user.id:
+        return bad_request('Users always follow themselves.')
+    if request.method == 'PUT':
+        g.current_user.follow(user)
+    else:
+        g.current_user.unfollow(user)
+    db.session.commit()
+    return '', 204
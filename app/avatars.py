@@ -0,0 +1,140 @@
+"""
+Avatars served by the app itself.
+
+Pages link to /avatar/<hash>/<size> (User.avatar) instead of gravatar.com,
+so rendering never waits on, or leaks visitors to, another site. The
+endpoint draws an identicon from the user's avatar_hash the first time a
+size is asked for and keeps it under STOCKPOT_AVATAR_DIR; a hash and size
+always give the same picture, so the response is cached for good. Only
+the hashes of existing users and the SIZES below are served.
+
+With STOCKPOT_AVATAR_MODE = 'gravatar' the pictures are fetched from
+Gravatar instead, falling back to the identicon, and kept for
+STOCKPOT_AVATAR_MAX_AGE seconds since people change them there.
+"""
+import os
+import re
+import tempfile
+import time
+from io import BytesIO
+from urllib.request import urlopen
+
+try:
+    from PIL import Image
+except ImportError:  # pages link to Gravatar directly, see User.avatar
+    Image = None
+
+
+HASH_REGEX = re.compile(r'^[0-9a-f]{32}$')
+# the sizes pages ask for; others are rounded up to one of these so a
+# client cannot have a file written for every size it can think of
+SIZES = (18, 32, 40, 50, 80, 100, 256)
+BACKGROUND = (240, 240, 240)
+GRAVATAR_URL = 'https://secure.gravatar.com/avatar/{}?s={}&d=404&r=g'
+
+
+def nearest_size(size):
+    """The smallest of SIZES at least ``size`` pixels, or the largest."""
+    for allowed in SIZES:
+        if allowed >= size:
+            return allowed
+    return SIZES[-1]
+
+
+def identicon(digest, size):
+    """
+    A 5x5 pattern, mirrored left to right, in a colour taken from the hex
+    ``digest``, scaled to ``size`` pixels square.
+    """
+    colour = tuple(int(digest[i:i + 2], 16) // 2 + 64 for i in (0, 2, 4))
+    # one cell of margin all around
+    grid = Image.new('RGB', (7, 7), BACKGROUND)
+    for row in range(5):
+        for column in range(3):
+            if int(digest[6 + row * 3 + column], 16) % 2 == 0:
+                grid.putpixel((1 + column, 1 + row), colour)
+                grid.putpixel((5 - column, 1 + row), colour)
+    return grid.resize((size, size), Image.NEAREST)
+
+
+class AvatarStore(object):
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config['STOCKPOT_AVATAR_DIR']
+        self.mode = app.config['STOCKPOT_AVATAR_MODE']
+        self.max_age = app.config['STOCKPOT_AVATAR_MAX_AGE']
+        self.timeout = app.config['STOCKPOT_AVATAR_FETCH_TIMEOUT']
+
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+
+    def path(self, digest, size):
+        return os.path.join(self.directory, self.mode, digest[:2],
+                            '{}.{}.png'.format(digest, size))
+
+
+    def fetch(self, digest, size):
+        """
+        The file of an avatar and how long it may be cached for, None for
+        ever, creating it when needed.
+        """
+        path = self.path(digest, size)
+        max_age = self.max_age if self.mode == 'gravatar' else None
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            age = None
+        if age is not None and (max_age is None or age < max_age):
+            return path, max_age
+        image = None
+        if self.mode == 'gravatar':
+            image = self._download(digest, size)
+        if image is None:
+            image = identicon(digest, size)
+        self._write(path, lambda f: image.save(f, 'PNG'))
+        return path, max_age
+
+
+    def _download(self, digest, size):
+        try:
+            response = urlopen(GRAVATAR_URL.format(digest, size),
+                               timeout=self.timeout)
+            try:
+                data = response.read()
+            finally:
+                response.close()
+            # whatever they send, it is stored and served as PNG
+            image = Image.open(BytesIO(data))
+            image.load()
+            return image
+        except (IOError, OSError):
+            # 404 when they have none, Gravatar is unreachable, or the
+            # reply is not a picture
+            return None
+
+
+    def _write(self, path, write):
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        # write then rename, so a reader never sees half a file
+        fd, partial = tempfile.mkstemp(suffix='.part', dir=folder)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.rename(partial, path)
+        except Exception:
+            os.remove(partial)
+            raise
+
+
+avatar_store = AvatarStore()
@@ -0,0 +1,86 @@
+"""
+In-process caches.
+
+LRUCache is a small thread safe mapping with bounded size and an optional
+time to live. Entries that mirror database rows should be dropped with
+invalidate_after_commit so a concurrent reader cannot repopulate them with
+data from before the writing transaction ended.
+"""
+from collections import OrderedDict
+from threading import RLock
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+
+    def __len__(self):
+        return len(self._data)
+
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_missing = object()
+_PENDING_KEY = 'stockpot.invalidate'
+
+
+def invalidate_after_commit(session, cache, key=None):
+    """Drop ``key`` from ``cache`` now and again when ``session`` commits
+    or rolls back. A key of None empties the whole cache."""
+    _invalidate(cache, key)
+    session.info.setdefault(_PENDING_KEY, set()).add((cache, key))
+
+
+def _invalidate(cache, key):
+    if key is None:
+        cache.clear()
+    else:
+        cache.pop(key)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_pending(session):
+    for cache, key in session.info.pop(_PENDING_KEY, ()):
+        _invalidate(cache, key)
@@ -0,0 +1,67 @@
+"""
+Conditional GET for pages.
+
+A view that can tell cheaply whether a page changed hands conditional()
+the newest relevant updated_at values and anything else the page depends
+on, together with a function that does the real work. When the client's
+copy still matches, by ETag or else by Last-Modified, the answer is an
+empty 304 and nothing is queried or rendered.
+
+The ETag also covers the viewer: who is logged in, their name, avatar and
+role, the show_followed cookie and, for logged in viewers, how old the
+CSRF token in any form on the page is allowed to get.
+"""
+import hashlib
+import time
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+
+
+def conditional(render, last_modified, *parts):
+    """
+    ``render()`` as a response carrying validators made of
+    ``last_modified``, a list of datetimes, and ``parts``, or a 304 when
+    the client's copy matches them.
+    """
+    last_modified = max([dt for dt in last_modified if dt is not None] or
+                        [None])
+    etag = _etag(last_modified, parts)
+    if _fresh(etag, last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # always ask, a revisit costs a 304
+    response.cache_control.no_cache = True
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+    return response
+
+
+def _etag(last_modified, parts):
+    viewer = None
+    if current_user.is_authenticated:
+        # tokens are good for WTF_CSRF_TIME_LIMIT, the copy for half that
+        window = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600) // 2
+        viewer = (current_user.id, current_user.username,
+                  current_user.avatar_hash, current_user.role_id,
+                  int(time.time()) // window)
+    key = (last_modified, parts, viewer, request.cookies.get('show_followed'))
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def _fresh(etag, last_modified):
+    if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    # a date says nothing about who is asking
+    if since is None or last_modified is None or \
+            current_user.is_authenticated:
+        return False
+    # HTTP dates have whole seconds
+    return last_modified.replace(microsecond=0) <= \
+        since.replace(tzinfo=None)
@@ -1,20 +1,198 @@
-from threading import Thread
+"""
+Outgoing email.
+
+send_email renders a message into the outbox table, so it survives a
+crash or an unreachable SMTP server, and wakes the mail queue once the
+message is committed.
+MailQueue runs a fixed number of worker threads that claim due messages a
+batch at a time and send each batch over a single SMTP connection. Failed
+messages are rescheduled with exponential backoff.
+"""
+import smtplib
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
 from flask import current_app, render_template
 from flask_mail import Message
-from . import mail
+from sqlalchemy import event, select, and_, bindparam
+from sqlalchemy.orm import Session
+from . import db, mail
+from .models import OutboxMessage
+
+
+# how long a worker may hold claimed messages before others retry them
+LEASE = timedelta(minutes=5)
+_NOTIFY_KEY = 'stockpot.mail_notify'
+
+
+class MailQueue(object):
+    def __init__(self, app=None):
+        self.app = None
+        self._wake = Event()
+        self._lock = Lock()
+        self._workers = []
+        if app is not None:
+            self.init_app(app)
+
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config['STOCKPOT_MAIL_WORKERS']
+        self.batch_size = app.config['STOCKPOT_MAIL_BATCH_SIZE']
+        self.max_attempts = app.config['STOCKPOT_MAIL_MAX_ATTEMPTS']
+        self.retry_delay = app.config['STOCKPOT_MAIL_RETRY_DELAY']
+        self.poll_interval = app.config['STOCKPOT_MAIL_POLL_INTERVAL']
+        if self.workers:
+            # web processes only, not every flask command
+            app.before_first_request(self.start)
+
+
+    def start(self):
+        with self._lock:
+            while len(self._workers) < self.workers:
+                worker = Thread(target=self._run, name='mail-queue')
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+
+    def notify(self):
+        """Tell an idle worker there is mail to send."""
+        self._wake.set()
+
+
+    def depth(self):
+        """Messages still waiting to be delivered."""
+        outbox = OutboxMessage.__table__
+        return self._engine().execute(
+            select([db.func.count()]).select_from(outbox)
+            .where(outbox.c.attempts < self.max_attempts)).scalar()
+
 
+    def deliver(self, now=None):
+        """
+        Claim one batch of due messages and send it over one connection.
+        Returns how many messages were attempted.
+        """
+        now = now or datetime.utcnow()
+        rows = self._claim(now)
+        if not rows:
+            return 0
+        sent, failed = [], {}
+        error = None
+        try:
+            with mail.connect() as connection:
+                for row in rows:
+                    try:
+                        connection.send(Message(
+                            row.subject, sender=row.sender,
+                            recipients=[row.recipient],
+                            body=row.body, html=row.html))
+                        sent.append(row.id)
+                    except Exception as e:
+                        # a bad header or address fails its message only
+                        failed[row.id] = e
+        except (smtplib.SMTPException, OSError) as e:
+            # could not connect, or the connection dropped mid batch
+            error = e
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # whatever went wrong, every claimed message counts an attempt
+            for row in rows:
+                if row.id not in sent:
+                    failed.setdefault(row.id, error)
+            self._finish(now, rows, sent, failed)
+        return len(rows)
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+
+    def _claim(self, now):
+        outbox = OutboxMessage.__table__
+        with self._engine().begin() as connection:
+            due = connection.execute(
+                select([outbox]).where(and_(
+                    outbox.c.next_attempt_at <= now,
+                    outbox.c.attempts < self.max_attempts))
+                .order_by(outbox.c.next_attempt_at, outbox.c.id)
+                .limit(self.batch_size)).fetchall()
+            claimed = []
+            for row in due:
+                # only one worker gets to move next_attempt_at forward
+                result = connection.execute(
+                    outbox.update().where(and_(
+                        outbox.c.id == row.id,
+                        outbox.c.next_attempt_at == row.next_attempt_at))
+                    .values(next_attempt_at=now + LEASE))
+                if result.rowcount == 1:
+                    claimed.append(row)
+        return claimed
+
+
+    def _finish(self, now, rows, sent, failed):
+        outbox = OutboxMessage.__table__
+        with self._engine().begin() as connection:
+            if sent:
+                connection.execute(outbox.delete().where(
+                    outbox.c.id.in_(sent)))
+            if failed:
+                connection.execute(
+                    outbox.update()
+                    .where(outbox.c.id == bindparam('message_id'))
+                    .values(attempts=outbox.c.attempts + 1,
+                            next_attempt_at=bindparam('retry_at'),
+                            last_error=bindparam('error')),
+                    [{'message_id': row.id,
+                      'retry_at': now + timedelta(
+                          seconds=self.retry_delay * 2 ** row.attempts),
+                      'error': repr(failed[row.id])}
+                     for row in rows if row.id in failed])
+
+
+    def _engine(self):
+        return db.get_engine(self.app)
+
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    busy = self.deliver()
+                except Exception:
+                    self.app.logger.exception('Mail delivery failed')
+                    busy = 0
+                if not busy:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+
+
+mail_queue = MailQueue()
 
 
 def send_email(to, subject, template, **kwargs):
+    """
+    Queue an email built from ``template``.txt and ``template``.html.
+
+    The message is added to the session and committed along with the
+    caller's changes, by the caller or at the end of the request; the
+    queue is woken once it is.
+    """
     app = current_app._get_current_object()
-    msg = Message(app.config['STOCKPOT_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
-                  sender=app.config['STOCKPOT_MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    message = OutboxMessage(
+        sender=app.config['STOCKPOT_MAIL_SENDER'], recipient=to,
+        subject=app.config['STOCKPOT_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
+        body=render_template(template + '.txt', **kwargs),
+        html=render_template(template + '.html', **kwargs))
+    db.session.add(message)
+    db.session.info[_NOTIFY_KEY] = True
+    return message
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_queue(session):
+    if session.info.pop(_NOTIFY_KEY, False):
+        mail_queue.notify()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_notify(session):
+    session.info.pop(_NOTIFY_KEY, None)
@@ -0,0 +1,93 @@
+"""
+Query plans for the queries behind the main views.
+
+view_queries builds the same queries the views page through, positioned
+past a cursor so the keyset seek condition is part of the plan. The
+``flask explain`` command prints their plans and flags every full scan of
+a table or index, which is how a dropped or unusable index shows up.
+"""
+from datetime import datetime
+from . import db
+from .models import User, Recipe, Comment, Follow
+from .pagination import seek
+from .queries import (recipe_listing, followed_feed, pantry_search,
+                      ingredient_lines, step_bodies, within_time)
+
+
+def view_queries(user, recipe):
+    """(name, query) pairs for the views as seen by ``user`` on ``recipe``."""
+    feed, feed_columns = followed_feed(user)
+    names = [line.ingredient.name for line in recipe.ingredients.limit(3)
+             if line.ingredient is not None]
+    pantry, pantry_columns = pantry_search(names or ['egg'])
+    pages = [
+        ('index', recipe_listing(), (Recipe.timestamp, Recipe.id), True),
+        ('index (followed)', feed, feed_columns, True),
+        ('index (under 30 minutes)',
+         within_time(recipe_listing(), None, 30 * 60),
+         (Recipe.timestamp, Recipe.id), True),
+        ('user', recipe_listing(user.recipes),
+         (Recipe.timestamp, Recipe.id), True),
+        ('followers', user.followers,
+         (Follow.timestamp, Follow.follower_id), True),
+        ('followed_by', user.followed,
+         (Follow.timestamp, Follow.followed_id), True),
+        ('show_recipe (comments)', recipe.comments,
+         (Comment.timestamp, Comment.id), False),
+        ('moderate', Comment.query, (Comment.timestamp, Comment.id), True),
+        ('pantry', pantry, pantry_columns, True),
+    ]
+    if db.engine.dialect.name == 'sqlite':
+        from .search import search
+        hits, hit_columns = search(recipe.title or 'recipe')
+        pages.append(('search', hits, hit_columns, False))
+    for name, query, columns, descending in pages:
+        cursor = [datetime.utcnow() if isinstance(column.type, db.DateTime)
+                  else 0 for column in columns]
+        yield name, seek(query, columns, cursor, descending).limit(25)
+    yield 'show_recipe (ingredients)', ingredient_lines([recipe.id])
+    yield 'show_recipe (steps)', step_bodies([recipe.id])
+
+
+def explain(query):
+    """
+    The plan of ``query`` as (line, full_scan) pairs, where ``full_scan``
+    is set on lines that read a whole table.
+    """
+    connection = db.session.connection()
+    compiled = query.statement.compile(dialect=connection.dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    if connection.dialect.name == 'sqlite':
+        rows = connection.execute('EXPLAIN QUERY PLAN ' + str(compiled),
+                                  params)
+        lines = [row[-1] for row in rows]
+    else:
+        lines = [row[0] for row in
+                 connection.execute('EXPLAIN ' + str(compiled), params)]
+    return [(line, _full_scan(line)) for line in lines]
+
+
+def _full_scan(line):
+    if 'Seq Scan on' in line:
+        # postgres
+        return True
+    words = line.split()
+    if not words or words[0] != 'SCAN':
+        return False
+    # "SCAN TABLE recipes" before sqlite 3.36, "SCAN recipes" since, both
+    # with or without "USING [COVERING] INDEX"; only SEARCH narrows the
+    # rows down, scans of subqueries and virtual tables don't count
+    table = words[2] if words[1] == 'TABLE' and len(words) > 2 else words[1]
+    return table in db.metadata.tables and 'VIRTUAL' not in words
+
+
+def view_plans():
+    """Plans of view_queries for the busiest user and recipe."""
+    user = User.query.order_by(User.followers_count.desc()).first()
+    recipe = Recipe.query.order_by(Recipe.comments_count.desc()).first()
+    if user is None or recipe is None:
+        return
+    for name, query in view_queries(user, recipe):
+        yield name, explain(query)
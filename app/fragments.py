@@ -0,0 +1,213 @@
+"""
+Rendered template fragments.
+
+The parts of a page that look the same to every viewer can be wrapped in
+
+    {% cache 'recipe-thumbnail', recipe, ('users', recipe.author_id) %}
+        ...
+    {% endcache %}
+
+and are then rendered once and served from FragmentCache. The key is made
+of the names and values after ``cache``; a model instance, or a
+(tablename, id) tuple for a row only the id is at hand of, stands for
+that row's current version. Versions are random stamps kept next to the
+fragments, and SQLAlchemy change events drop them when a row is updated
+or deleted, so the next render gets a fresh stamp and older fragments are
+never looked up again; the backend evicts them in time.
+
+Anything that depends on the viewer, like the edit menu of a recipe's
+author, belongs outside the block.
+
+Two backends are provided: an in-process LRUCache, the default, and
+FileBackend, a directory shared by the worker processes of one host. The
+in-process one only sees the writes of its own process, so with more than
+one worker STOCKPOT_FRAGMENT_CACHE_TTL bounds how stale a fragment gets.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import uuid
+from flask import request
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from . import db
+from .cache import LRUCache, invalidate_after_commit
+from .models import User, Recipe, Comment
+
+
+class FileBackend(object):
+    """One file per entry, written atomically, the oldest pruned."""
+    def __init__(self, directory, maxsize=10000):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._writes = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+
+    def get(self, key, default=None):
+        try:
+            with io.open(self._path(key), encoding='utf-8') as f:
+                return f.read()
+        except (IOError, OSError):
+            return default
+
+
+    def set(self, key, value):
+        fd, partial = tempfile.mkstemp(suffix='.part', dir=self.directory)
+        with io.open(fd, 'w', encoding='utf-8') as f:
+            f.write(value)
+        os.rename(partial, self._path(key))
+        # counting the files on every write would cost more than a render
+        self._writes += 1
+        if self._writes % max(1, self.maxsize // 10) == 0:
+            self.prune()
+
+
+    def pop(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            self._remove(name)
+
+
+    def prune(self):
+        """Delete the least recently written entries beyond maxsize."""
+        names = os.listdir(self.directory)
+        if len(names) <= self.maxsize:
+            return
+        aged = []
+        for name in names:
+            try:
+                aged.append((os.path.getmtime(
+                    os.path.join(self.directory, name)), name))
+            except OSError:
+                pass
+        aged.sort()
+        for _, name in aged[:len(aged) - self.maxsize]:
+            self._remove(name)
+
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                            hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+class FragmentCache(object):
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+
+    def init_app(self, app):
+        kind = app.config['STOCKPOT_FRAGMENT_CACHE']
+        size = app.config['STOCKPOT_FRAGMENT_CACHE_SIZE']
+        if kind == 'memory':
+            self.backend = LRUCache(
+                size, ttl=app.config['STOCKPOT_FRAGMENT_CACHE_TTL'])
+        elif kind == 'filesystem':
+            self.backend = FileBackend(
+                app.config['STOCKPOT_FRAGMENT_CACHE_DIR'], size)
+        else:
+            # anything with get, set, pop and clear
+            self.backend = kind
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+
+
+    def fetch(self, parts, render):
+        """The fragment keyed by ``parts``, rendered when missing."""
+        key = self.key(parts)
+        html = self.backend.get(key)
+        if html is None:
+            html = render()
+            self.backend.set(key, html)
+        return Markup(html)
+
+
+    def key(self, parts):
+        # absolute links, like avatars, follow the scheme of the request
+        digest = hashlib.sha1(request.scheme.encode('utf-8'))
+        for part in parts:
+            if isinstance(part, db.Model):
+                part = self.version((part.__tablename__,) +
+                                    inspect(part).identity)
+            elif isinstance(part, tuple):
+                part = self.version(part)
+            digest.update(b'\0' + repr(part).encode('utf-8'))
+        return 'fragment:' + digest.hexdigest()
+
+
+    def version(self, row):
+        """The version stamp of ``row``, a (tablename, id) tuple."""
+        key = self._version_key(row)
+        stamp = self.backend.get(key)
+        if stamp is None:
+            stamp = uuid.uuid4().hex
+            self.backend.set(key, stamp)
+        return stamp
+
+
+    def pop(self, row):
+        """Retire the fragments of ``row``, see invalidate_after_commit."""
+        self.backend.pop(self._version_key(row))
+
+
+    def clear(self):
+        self.backend.clear()
+
+
+    @staticmethod
+    def _version_key(row):
+        return 'version:' + ':'.join(str(part) for part in row)
+
+
+fragment_cache = FragmentCache()
+
+
+class FragmentCacheExtension(Extension):
+    """Adds {% cache part, ... %}...{% endcache %}, see FragmentCache."""
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_fetch', [nodes.List(parts)]),
+            [], [], body).set_lineno(lineno)
+
+
+    def _fetch(self, parts, caller):
+        return self.environment.fragment_cache.fetch(parts, caller)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+@event.listens_for(Recipe, 'after_update')
+@event.listens_for(Recipe, 'after_delete')
+@event.listens_for(Comment, 'after_update')
+@event.listens_for(Comment, 'after_delete')
+def _row_changed(mapper, connection, target):
+    invalidate_after_commit(
+        object_session(target), fragment_cache,
+        (target.__tablename__,) + inspect(target).identity)
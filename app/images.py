@@ -0,0 +1,357 @@
+"""
+Resized variants of recipe images.
+
+Uploads are stored as they came, often several megabytes each. Once the
+transaction that sets a recipe's img_filename commits, ImagePipeline
+resizes the image to each of STOCKPOT_IMG_WIDTHS in a thread pool, off the
+request, writing a JPEG and, when Pillow was built with it, a WebP under
+``variants/`` next to the original. The files are recorded in
+Recipe.img_variants; until they are, pages fall back to the original.
+
+Files are never deleted inside a flush, where a rollback would leave rows
+pointing at nothing. ImageSweeper removes an image once the transaction
+that released its last reference commits, and periodically walks the
+upload folder for files nothing refers to, e.g. uploads whose recipe was
+never saved, deleting them a batch at a time.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+from sqlalchemy import event, and_, select, union
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import get_history
+from . import db, recipe_imgs
+from .models import Recipe, StoredImage
+from .storage import VARIANT_FOLDER, variant_name, remove_image_files, \
+    is_content_addressed
+
+try:
+    from PIL import Image
+except ImportError:  # no variants, every page gets the original
+    Image = None
+
+
+# extension, Pillow format, save options; browsers that understand WebP
+# are offered it first, see the recipe_img macro
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+_PENDING_KEY = 'stockpot.img_pending'
+
+
+def generate(filename, widths):
+    """
+    Write the variants of upload ``filename`` narrower than the original,
+    reusing files that already exist, and return them as
+    ``{ext: {width: name}}``.
+    """
+    if Image is None:
+        return {}
+    Image.init()
+    formats = [f for f in FORMATS if f[1] in Image.SAVE]
+    variants = {}
+    original = Image.open(recipe_imgs.path(filename))
+    try:
+        width, height = original.size
+        widths = sorted(w for w in widths if w < width)
+        if not widths:
+            return {}
+        # let the JPEG decoder scale down while decoding
+        original.draft('RGB', (widths[-1], height * widths[-1] // width))
+        source = None
+        for w in widths:
+            for ext, fmt, options in formats:
+                name = variant_name(filename, w, ext)
+                path = recipe_imgs.path(name)
+                if not os.path.exists(path):
+                    if source is None:
+                        source = original.convert('RGB')
+                    resized = source.resize(
+                        (w, max(1, int(round(height * w / float(width))))),
+                        Image.LANCZOS)
+                    _save(resized, path, fmt, options)
+                variants.setdefault(ext, {})[str(w)] = name
+    finally:
+        original.close()
+    return variants
+
+
+def _save(image, path, fmt, options):
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    # write then rename, so a reader never sees half a file
+    partial = '{}.{}.part'.format(path, os.getpid())
+    image.save(partial, fmt, **options)
+    os.rename(partial, path)
+
+
+class ImagePipeline(object):
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        if app is not None:
+            self.init_app(app)
+
+
+    def init_app(self, app):
+        self.app = app
+        self.widths = app.config['STOCKPOT_IMG_WIDTHS']
+        workers = app.config['STOCKPOT_IMG_WORKERS']
+        self.executor = ThreadPoolExecutor(workers) if workers else None
+
+
+    def submit(self, filename):
+        """Generate the variants of ``filename`` in the background."""
+        if self.executor is None:
+            return self.process(filename)
+        return self.executor.submit(self._work, filename)
+
+
+    def process(self, filename):
+        """Generate and record the variants of ``filename``."""
+        try:
+            variants = generate(filename, self.widths)
+        except (IOError, OSError):
+            self.app.logger.exception('Could not resize {}'.format(filename))
+            return
+        recipes = Recipe.__table__
+        db.get_engine(self.app).execute(
+            recipes.update().where(and_(
+                recipes.c.img_filename == filename,
+                recipes.c.img_variants.is_(None)))
+            .values(img_variants=json.dumps(variants, sort_keys=True)))
+        return variants
+
+
+    def _work(self, filename):
+        # pool threads have no app context of their own
+        with self.app.app_context():
+            return self.process(filename)
+
+
+    def backfill(self):
+        """
+        Generate the variants of every image that has none recorded,
+        waiting for the pool to finish. Returns how many images.
+        """
+        filenames = [filename for (filename,) in
+                     db.session.query(Recipe.img_filename).filter(
+                         Recipe.img_variants.is_(None),
+                         Recipe.img_filename.isnot(None)).distinct()]
+        if self.executor is None:
+            for filename in filenames:
+                self.process(filename)
+        else:
+            list(self.executor.map(self._work, filenames))
+        return len(filenames)
+
+
+image_pipeline = ImagePipeline()
+
+
+class ImageSweeper(object):
+    # names per IN (...) when checking files against the database
+    CHUNK_SIZE = 500
+
+    def __init__(self, app=None):
+        self.app = None
+        self._released = []
+        self._wake = Event()
+        self._lock = Lock()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config['STOCKPOT_IMG_SWEEP_INTERVAL']
+        self.grace = app.config['STOCKPOT_IMG_SWEEP_GRACE']
+        self.batch_size = app.config['STOCKPOT_IMG_SWEEP_BATCH_SIZE']
+        self.pause = app.config['STOCKPOT_IMG_SWEEP_PAUSE']
+        self.min_age = app.config['STOCKPOT_IMG_REMOVE_MIN_AGE']
+        if self.interval:
+            # web processes only, not every flask command
+            app.before_first_request(self.start)
+
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='image-sweeper')
+                self._thread.daemon = True
+                self._thread.start()
+
+
+    def release(self, filenames):
+        """Remove images whose last reference was just committed."""
+        if self._thread is None:
+            return self.remove(filenames)
+        with self._lock:
+            self._released.extend(filenames)
+        self._wake.set()
+
+
+    def remove(self, filenames, now=None):
+        """
+        Delete the files and variants of those ``filenames`` nothing
+        refers to any more, returning their names.
+
+        store_upload touches a file it is about to reuse before the new
+        reference commits, so files touched within min_age are skipped
+        and left for the sweep, which waits out the grace period.
+        """
+        cutoff = (now or time.time()) - self.min_age
+        removed = []
+        for batch in self._batches(sorted(set(filenames))):
+            for filename in self._unreferenced(batch):
+                path = recipe_imgs.path(filename)
+                if os.path.exists(path) and os.path.getmtime(path) > cutoff:
+                    continue
+                remove_image_files(filename)
+                removed.append(filename)
+        return removed
+
+
+    def sweep(self, now=None, dry_run=False):
+        """
+        Delete upload files older than the grace period that no recipe
+        refers to, returning their names.
+        """
+        orphans = self.orphans(now)
+        if dry_run:
+            return orphans
+        removed = []
+        for batch in self._batches(orphans):
+            # a recipe may have picked a file up since the walk
+            originals = [name for name in batch if not self._is_derived(name)]
+            keep = set(originals) - set(self._unreferenced(originals))
+            for name in batch:
+                if name not in keep:
+                    path = recipe_imgs.path(name)
+                    if os.path.exists(path):
+                        os.remove(path)
+                    removed.append(name)
+        return removed
+
+
+    def orphans(self, now=None):
+        """
+        Files in the upload folder no recipe refers to, compared against
+        every distinct img_filename loaded with a single query. Only the
+        files the app writes are candidates: content addressed uploads,
+        resized variants and the temporary files of interrupted uploads.
+        """
+        cutoff = (now or time.time()) - self.grace
+        referenced = set(name for (name,) in db.get_engine(self.app).execute(
+            select([Recipe.__table__.c.img_filename]).distinct()))
+        referenced.add(self.app.config['STOCKPOT_DEFAULT_IMG'])
+        stems = set(os.path.splitext(name)[0] for name in referenced
+                    if name is not None)
+        destination = recipe_imgs.config.destination
+        orphans = []
+        for folder, _, files in os.walk(destination):
+            for f in files:
+                path = os.path.join(folder, f)
+                name = os.path.relpath(path, destination).replace(os.sep, '/')
+                if not self._sweepable(name):
+                    continue
+                if name in referenced or os.path.getmtime(path) > cutoff:
+                    continue
+                if name.startswith(VARIANT_FOLDER + '/') and \
+                        self._variant_stem(name) in stems:
+                    continue
+                orphans.append(name)
+        return sorted(orphans)
+
+
+    def _unreferenced(self, filenames):
+        if not filenames:
+            return []
+        recipes, images = Recipe.__table__, StoredImage.__table__
+        used = db.get_engine(self.app).execute(union(
+            select([recipes.c.img_filename])
+            .where(recipes.c.img_filename.in_(filenames)),
+            select([images.c.filename])
+            .where(images.c.filename.in_(filenames))))
+        used = set(name for (name,) in used)
+        return [name for name in filenames if name not in used]
+
+
+    def _batches(self, names):
+        """Split ``names`` into batches, pausing between them."""
+        for start in range(0, len(names), self.batch_size):
+            if start and self.pause:
+                time.sleep(self.pause)
+            yield names[start:start + self.batch_size]
+
+
+    @staticmethod
+    def _sweepable(name):
+        # not e.g. the .gitignore of the folder or legacy uploads, those
+        # are released through StoredImage like any other
+        return is_content_addressed(name) or \
+            ImageSweeper._is_derived(name)
+
+
+    @staticmethod
+    def _is_derived(name):
+        return name.startswith(VARIANT_FOLDER + '/') or name.endswith('.part')
+
+
+    @staticmethod
+    def _variant_stem(name):
+        # 'variants/<stem>.<width>w.<ext>'
+        return name[len(VARIANT_FOLDER) + 1:].rsplit('.', 2)[0]
+
+
+    def _run(self):
+        with self.app.app_context():
+            next_sweep = time.time() + self.interval
+            while True:
+                with self._lock:
+                    released, self._released = self._released, []
+                try:
+                    if released:
+                        self.remove(released)
+                    if time.time() >= next_sweep:
+                        next_sweep = time.time() + self.interval
+                        removed = self.sweep()
+                        self.app.logger.info(
+                            'Swept {} image files'.format(len(removed)))
+                except Exception:
+                    self.app.logger.exception('Image sweep failed')
+                self._wake.wait(max(0, next_sweep - time.time()))
+                self._wake.clear()
+
+
+image_sweeper = ImageSweeper()
+
+
+@event.listens_for(Recipe, 'after_insert')
+@event.listens_for(Recipe, 'after_update')
+def _mark_img(mapper, connection, target):
+    session = object_session(target)
+    if target.img_filename and \
+            get_history(target, 'img_filename').has_changes():
+        session.info.setdefault(_PENDING_KEY, set()).add(target.img_filename)
+
+
+@event.listens_for(Session, 'after_commit')
+def _submit_pending(session):
+    for filename in session.info.pop(_PENDING_KEY, ()):
+        image_pipeline.submit(filename)
+    released = session.info.pop(StoredImage.RELEASED_KEY, None)
+    if released:
+        image_sweeper.release(released)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
+    # the references are back, so are the files
+    session.info.pop(StoredImage.RELEASED_KEY, None)
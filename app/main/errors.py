@@ -1,20 +1,38 @@
 """
 Custom error handlers for the main blueprint
 """
-from flask import render_template
+from flask import render_template, request, jsonify
 from . import main
 
 
+def wants_json():
+    return request.path.startswith('/api/') or (
+        request.accept_mimetypes.accept_json and
+        not request.accept_mimetypes.accept_html)
+
+
+def json_error(status, name):
+    response = jsonify({'error': name})
+    response.status_code = status
+    return response
+
+
 @main.app_errorhandler(404)
 def page_not_found(e):
+    if wants_json():
+        return json_error(404, 'not found')
     return render_template('404.html'), 404
 
 
 @main.app_errorhandler(403)
 def page_not_found(e):
+    if wants_json():
+        return json_error(403, 'forbidden')
     return render_template('403.html'), 403
 
 
 @main.app_errorhandler(500)
 def internal_server_error(e):
+    if wants_json():
+        return json_error(500, 'internal server error')
     return render_template('500.html'), 500
@@ -20,18 +20,41 @@ TIME_FORMAT = r'(?:{weeks})?\s*(?:{days})?\s*(?:{hours})?\s*(?:{mins})?\s*(?:{se
 
 TIME_REGEX = re.compile(TIME_FORMAT)
 
+# whole numbers with one letter units, e.g. "1h 30m" or the
+# "0d 1h 30m 0s" DurationField renders, which is what gets posted back
+# on every edit; read positionally without building a timedelta per unit
+FAST_REGEX = re.compile(
+    r'(?:(\d+)\s*d)?\s*(?:(\d+)\s*h)?\s*(?:(\d+)\s*m)?\s*(?:(\d+)\s*s)?')
+FAST_UNITS = (24 * 60 * 60, 60 * 60, 60, 1)
+
+
 def parse_duration(time_str, time_regex=TIME_REGEX):
-    parts = time_regex.fullmatch(time_str)
-    if not parts:
+    """
+    The timedelta spelled by ``time_str``, e.g. "1h 30m", "2 hrs" or
+    "1.5 hours", None when it isn't a duration.
+    """
+    time_str = time_str.strip()
+    try:
+        if time_regex is TIME_REGEX:
+            parts = FAST_REGEX.fullmatch(time_str)
+            if parts:
+                return timedelta(seconds=sum(
+                    int(value) * unit for value, unit in
+                    zip(parts.groups(), FAST_UNITS) if value))
+        parts = time_regex.fullmatch(time_str)
+        if not parts:
+            return
+        time_params = {}
+        for (name, param) in parts.groupdict().items():
+            if param:
+                time_params[name] = float(param)
+        return timedelta(**time_params)
+    except ValueError:
+        # e.g. "1.2.3", the pattern lets any run of digits and dots in
+        return
+    except OverflowError:
+        # more than timedelta holds, e.g. "99999999999d"
         return
-    grouped = parts.groupdict()
-    print(grouped)
-    time_params = {}
-    for (name, param) in grouped.items():
-        if param:
-            time_params[name] = int(param)
-    print(time_params)
-    return timedelta(**time_params)
 
 
 class DurationField(Field):
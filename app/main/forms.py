@@ -1,6 +1,7 @@
 from flask_wtf import Form
 from wtforms import StringField, TextAreaField, BooleanField, SelectField,\
-    SubmitField, FormField, FieldList, IntegerField, FloatField, FileField
+    SubmitField, FormField, FieldList, IntegerField, FloatField, FileField, \
+    HiddenField
 from wtforms.validators import Required, Length, Email, Regexp
 from wtforms import ValidationError
 from ..models import Role, User, RecipeStep, RecipeIngredient, Ingredient
@@ -58,10 +59,13 @@ class RecipeIngredientForm(Form):
         choices=[(unit, unit) for unit in current_app.config['RECIPE_UNITS']]
     )
     ingredient = FormField(IngredientForm)
+    # the row being edited, so unchanged lines are left alone
+    line_id = HiddenField()
 
 
 class StepForm(Form):
     body = TextAreaField('Step')
+    line_id = HiddenField()
 
 
 class RecipeForm(Form):
@@ -81,6 +85,36 @@ class RecipeForm(Form):
     submit = SubmitField('Submit')
 
 
+    def __init__(self, *args, **kwargs):
+        super(RecipeForm, self).__init__(*args, **kwargs)
+        # lines of a recipe being edited carry their row ids
+        for entry in list(self.ingredients) + list(self.steps):
+            if not entry.line_id.data:
+                entry.line_id.data = getattr(entry.object_data, 'id', None)
+
+
+    def ingredient_lines(self):
+        """The submitted ingredients as (amount, units, name) tuples."""
+        return [(ing.amount.data, ing.units.data, ing.ingredient.data['name'])
+                for ing in self.ingredients]
+
+
+    def step_bodies(self):
+        return [step.body.data for step in self.steps]
+
+
+    @staticmethod
+    def line_ids(entries):
+        """The row ids posted back with ``entries``, None for new lines."""
+        ids = []
+        for entry in entries:
+            try:
+                ids.append(int(entry.line_id.data))
+            except (TypeError, ValueError):
+                ids.append(None)
+        return ids
+
+
     def validate_cook_time(self, field):
         # if field data is none then field's process_formdata
         # time regex did not match meaning the field has invalid input
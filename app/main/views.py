@@ -2,35 +2,81 @@
 Routes and views for the main blueprint.
 """
 from flask import (render_template, session, redirect, url_for, flash, request, 
-                   current_app, abort, make_response)
+                   current_app, abort, make_response, send_from_directory,
+                   send_file)
 from . import main
 from ..models import (User, Permission, Recipe, Role, RecipeIngredient, Ingredient, 
-                      RecipeStep, Comment)
+                      RecipeStep, Comment, Follow)
 from .. import db, recipe_imgs
+from ..queries import (recipe_listing, recipe_key, followed_feed, pantry_search,
+                       pantry_key, RecipeDetail, within_time)
+from ..pagination import paginate
+from ..search import search as search_recipes, search_key, match_expression
+from ..shopping import shopping_list as shopping_items, followed_recipes
+from ..storage import store_upload, is_content_addressed
+from ..conditional import conditional
+from ..avatars import avatar_store, HASH_REGEX, SIZES
 from .forms import EditProfileForm, EditProfileAdminForm, RecipeForm, CommentForm
+from .fields import parse_duration
 from flask_login import login_required, current_user
 from flask_uploads import UploadNotAllowed
 from ..decorators import admin_required, permission_required
 from datetime import timedelta
-from math import ceil
+from sqlalchemy.orm import joinedload
+
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def time_range():
+    """
+    The request's min_time and max_time, e.g. ?max_time=30m, as
+    ``within_time`` arguments in seconds. Unreadable ones are ignored.
+    """
+    seconds = []
+    for name in ('min_time', 'max_time'):
+        duration = parse_duration(request.args.get(name, ''))
+        seconds.append(int(duration.total_seconds())
+                       if duration else None)
+    return seconds
 
 
 @main.route('/', methods=['GET', 'POST'])
 def index():
-    page = request.args.get('page', 1, type=int)
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
+
+    def render():
+        if show_followed:
+            query, columns = followed_feed(current_user)
+        else:
+            query, columns = recipe_listing(), (Recipe.timestamp, Recipe.id)
+        pagination = paginate(
+            within_time(query, *time_range()), columns, key=recipe_key,
+            per_page=current_app.config['STOCKPOT_RECIPES_PER_PAGE'])
+        recipes = pagination.items
+        return render_template('index.html', recipes=recipes,
+                               show_followed=show_followed,
+                               pagination=pagination)
+
+    # newest change to any recipe, read off ix_recipes_updated_at, and
+    # how many there are, which is what a deletion moves; authors renamed
+    # or given a new avatar touch their recipes. The followed feed also
+    # changes with the viewer's follows: their number and the newest one,
+    # not the viewer's updated_at, which every last_seen ping moves. A
+    # deletion leaves no date behind, so the page is validated by its
+    # ETag alone
+    validators = [
+        db.session.query(db.func.max(Recipe.updated_at)).as_scalar(),
+        db.session.query(db.func.count(Recipe.id)).as_scalar()]
     if show_followed:
-        query = current_user.followed_recipes
-    else:
-        query = Recipe.query
-    pagination = query.order_by(Recipe.timestamp.desc()).paginate(
-        page, per_page=current_app.config['STOCKPOT_RECIPES_PER_PAGE'], 
-        error_out=False)
-    recipes = pagination.items
-    return render_template('index.html', recipes=recipes,
-                          show_followed=show_followed, pagination=pagination)
+        follows = db.session.query(Follow).filter(
+            Follow.follower_id == current_user.id)
+        validators += [
+            follows.with_entities(db.func.count()).as_scalar(),
+            follows.with_entities(db.func.max(Follow.timestamp)).as_scalar()]
+    return conditional(render, [], *db.session.query(*validators).one())
 
 
 @main.route('/all')
@@ -51,16 +97,24 @@ def show_followed():
 
 @main.route('/user/<username>')
 def user(username):
-    user = User.query.filter_by(username=username).first()
-    if user is None:
+    latest = db.session.query(db.func.max(Recipe.updated_at)).filter(
+        Recipe.author_id == User.id).correlate(User).as_scalar()
+    row = db.session.query(User, latest).filter(
+        User.username == username).first()
+    if row is None:
         abort(404)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.recipes.order_by(Recipe.timestamp.desc()).paginate(
-        page, per_page=current_app.config['STOCKPOT_RECIPES_PER_PAGE'], 
-        error_out=False)
-    recipes = pagination.items
-    return render_template('user.html', user=user, recipes=recipes,
-                           pagination=pagination)
+    user, latest = row
+
+    def render():
+        pagination = paginate(
+            recipe_listing(user.recipes), (Recipe.timestamp, Recipe.id),
+            per_page=current_app.config['STOCKPOT_RECIPES_PER_PAGE'])
+        recipes = pagination.items
+        return render_template('user.html', user=user, recipes=recipes,
+                               pagination=pagination)
+
+    # follows and new or deleted recipes move the user's counters
+    return conditional(render, [user.updated_at, latest])
 
 
 @main.route('/user/<username>/follow')
@@ -71,10 +125,9 @@ def follow(username):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    if current_user.is_following(user):
+    if not current_user.follow(user):
         flash('You are already following this user.')
         return redirect(url_for('.user', username=username))
-    current_user.follow(user)
     flash('You are now following %s' % username)
     return redirect(url_for('.user', username=username))
 
@@ -88,10 +141,9 @@ def unfollow(username):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    if not current_user.is_following(user):
+    if not current_user.unfollow(user):
         flash('You are not following this user.')
         return redirect(url_for('.user', username=username))
-    current_user.unfollow(user)
     flash('You are not following %s anymore.' % username)
     return redirect(url_for('.user', username=username))
 
@@ -103,10 +155,10 @@ def followers(username):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followers.paginate(
-        page, per_page=current_app.config['STOCKPOT_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(
+        user.followers, (Follow.timestamp, Follow.follower_id),
+        per_page=current_app.config['STOCKPOT_FOLLOWERS_PER_PAGE'],
+        total=user.followers_count - 1)
     follows = [{'user': item.follower, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('followers.html', user=user, title="Followers of",
@@ -120,10 +172,10 @@ def followed_by(username):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed.paginate(
-        page, per_page=current_app.config['STOCKPOT_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(
+        user.followed, (Follow.timestamp, Follow.followed_id),
+        per_page=current_app.config['STOCKPOT_FOLLOWERS_PER_PAGE'],
+        total=user.followed_count - 1)
     follows = [{'user': item.followed, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('followers.html', user=user, title="Followed by",
@@ -183,28 +235,18 @@ def create_recipe():
     if request.method == 'POST':
         if current_user.can(Permission.WRITE_RECIPES) and \
             form.validate_on_submit():
-            amounts = [ing.amount.data for ing in form.ingredients] 
-            units = [ing.units.data for ing in form.ingredients] 
-            names = [Ingredient(name=ing.ingredient.data['name']) for ing in form.ingredients]
-            recipe_ings = []
-            for item in zip(amounts, units, names):
-                recipe_ings.append(RecipeIngredient(
-                    amount=item[0],
-                    units=item[1],
-                    ingredient=item[2]
-                ))
-            steps = [RecipeStep(body=step.body.data) for step in form.steps]
+            recipe_ings = Recipe.build_ingredients(form.ingredient_lines())
+            steps = [RecipeStep(body=body) for body in form.step_bodies()]
             img = form.image.data
             filename = default_img
             # if the user didn't upload a file, use default filename
             # otherwise try to upload image
             if img.filename != '':
                 try:
-                    filename = recipe_imgs.save(img)
+                    filename = store_upload(img)
                 except UploadNotAllowed:
                     flash('The upload was not allowed') 
                     return render_template('create_recipe.html', form=form)
-            print(form.prep_time.data)
             recipe = Recipe(
                 title=form.title.data,
                 ingredients=recipe_ings,
@@ -221,9 +263,61 @@ def create_recipe():
                           default_img=recipe_imgs.url(default_img))
 
 
+@main.route('/recipes/pantry')
+def pantry():
+    ingredients = request.args.get('ingredients', '')
+    limit = current_app.config['STOCKPOT_PANTRY_MAX_INGREDIENTS']
+    names = [name for name in ingredients.split(',')
+             if name.strip()][:limit]
+    recipes, pagination = [], None
+    if names:
+        query, columns = pantry_search(names)
+        pagination = paginate(
+            query, columns, key=pantry_key,
+            per_page=current_app.config['STOCKPOT_RECIPES_PER_PAGE'])
+        recipes = [recipe for recipe, matches in pagination.items]
+    return render_template('pantry.html', recipes=recipes,
+                           pagination=pagination, ingredients=ingredients)
+
+
+@main.route('/recipes/shopping-list')
+def shopping_list():
+    """
+    One list for the recipes in ?recipes=1,2,3 or, without any, for the
+    ones the viewer's followed users posted in the last ?days=7.
+    """
+    limit = current_app.config['STOCKPOT_SHOPPING_MAX_RECIPES']
+    ids = [int(i) for i in request.args.get('recipes', '').split(',')
+           if i.strip().isdigit()][:limit]
+    days = min(max(1, request.args.get('days', 7, type=int)), 31)
+    items = []
+    if ids:
+        items = shopping_items(ids)
+    elif current_user.is_authenticated:
+        items = shopping_items(followed_recipes(current_user, days))
+    return render_template('shopping_list.html', items=items, ids=ids,
+                           days=days)
+
+
+@main.route('/search')
+def search():
+    q = request.args.get('q', '')
+    recipes, pagination = [], None
+    # nothing to look up in "???", see search()
+    if match_expression(q):
+        query, columns = search_recipes(q)
+        pagination = paginate(
+            within_time(query, *time_range()), columns, key=search_key,
+            descending=False,
+            per_page=current_app.config['STOCKPOT_RECIPES_PER_PAGE'])
+        recipes = [recipe for recipe, rank in pagination.items]
+    return render_template('search.html', recipes=recipes,
+                           pagination=pagination, q=q)
+
+
 @main.route('/recipes/<int:id>', methods=['GET', 'POST'])
 def show_recipe(id):
-    recipe = Recipe.query.get_or_404(id)
+    recipe = Recipe.query.options(joinedload(Recipe.author)).get_or_404(id)
     form = CommentForm()
     
     if form.validate_on_submit():
@@ -234,15 +328,22 @@ def show_recipe(id):
         flash('Your comment has been published.')
         return redirect(url_for('.show_recipe', id=recipe.id, page=-1))
 
-    page = request.args.get('page', 1, type=int)
-    if page == -1:
-        page = ceil(recipe.comments.count() / current_app.config['STOCKPOT_COMMENTS_PER_PAGE'])
-    pagination = recipe.comments.order_by(Comment.timestamp.asc()).paginate(
-        page, per_page=current_app.config['STOCKPOT_COMMENTS_PER_PAGE'],
-        error_out=False)
-    comments = pagination.items
-    return render_template('show_recipe.html', recipe=recipe, form=form,
-                          comments=comments, pagination=pagination)
+    def render():
+        # page=-1 jumps to the newest comments by walking the
+        # (timestamp, id) index backwards, nothing has to be counted
+        pagination = paginate(
+            recipe.comments, (Comment.timestamp, Comment.id),
+            per_page=current_app.config['STOCKPOT_COMMENTS_PER_PAGE'],
+            descending=False, total=recipe.comments_count)
+        comments = pagination.items
+        return render_template('show_recipe.html',
+                               recipe=RecipeDetail.load(recipe), form=form,
+                               comments=comments, pagination=pagination)
+
+    # new, deleted and moderated comments move the recipe's updated_at
+    author = recipe.author
+    return conditional(render, [recipe.updated_at,
+                                author.updated_at if author else None])
 
 
 @main.route('/recipes/<int:id>/edit', methods=['GET', 'POST'])
@@ -253,16 +354,27 @@ def edit_recipe(id):
        not current_user.can(Permission.ADMINISTER):
         abort(403)
 
-    form = RecipeForm(obj=recipe)
+    # a submitted form is read from the request alone, loading the lines
+    # for it would only be thrown away
+    form = RecipeForm(obj=recipe if request.method == 'GET' else None)
     if form.validate_on_submit():
-        form.populate_obj(recipe)
+        recipe.title = form.title.data
+        recipe.prep_time = form.prep_time.data
+        recipe.cook_time = form.cook_time.data
+        recipe.description = form.description.data
+        # ingredients are shared between recipes, populate_obj would rename
+        # them in place; lines are matched to their rows and only the ones
+        # that changed are written
+        recipe.update_lines(
+            zip(form.line_ids(form.ingredients), form.ingredient_lines()),
+            zip(form.line_ids(form.steps), form.step_bodies()))
         img = form.image.data
         filename = recipe.img_filename
         # if the user didn't upload a file, default to old filename
         # otherwise try to upload image
         if img.filename != '':
             try:
-                filename = recipe_imgs.save(img)
+                filename = store_upload(img)
             except UploadNotAllowed:
                 flash('The upload was not allowed') 
                 return render_template('edit_recipe.html', form=form, recipe=recipe)
@@ -282,17 +394,43 @@ def delete_recipe(id):
     return redirect(request.referrer)
 
 
+@main.route('/img/<path:filename>')
+def image(filename):
+    # a content addressed name always means the same bytes, so browsers
+    # and proxies may keep it for a year without revalidating
+    if not is_content_addressed(filename):
+        abort(404)
+    response = send_from_directory(recipe_imgs.config.destination, filename,
+                                   cache_timeout=IMMUTABLE_MAX_AGE)
+    response.headers['Cache-Control'] = \
+        'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE)
+    return response
+
+
+@main.route('/avatar/<digest>/<int:size>')
+def avatar(digest, size):
+    if not avatar_store.enabled or not HASH_REGEX.match(digest) or \
+            size not in SIZES or not User.has_avatar(digest):
+        abort(404)
+    path, max_age = avatar_store.fetch(digest, size)
+    response = send_file(path, mimetype='image/png',
+                         cache_timeout=max_age or IMMUTABLE_MAX_AGE)
+    if max_age is None:
+        response.headers['Cache-Control'] = \
+            'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE)
+    return response
+
+
 @main.route('/moderate')
 @login_required
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['STOCKPOT_COMMENTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(
+        Comment.query, (Comment.timestamp, Comment.id),
+        per_page=current_app.config['STOCKPOT_COMMENTS_PER_PAGE'])
     comments = pagination.items
     return render_template('moderate.html', comments=comments,
-                          pagination=pagination, page=page)
+                          pagination=pagination)
 
 
 @main.route('/moderate/comment/<int:id>/enable')
@@ -303,7 +441,9 @@ def moderate_enable(id):
     comment.disabled = False
     db.session.add(comment)
     return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+                            after=request.args.get('after'),
+                            before=request.args.get('before'),
+                            last=request.args.get('last')))
 
 
 @main.route('/moderate/comment/<int:id>/disable')
@@ -314,4 +454,6 @@ def moderate_disable(id):
     comment.disabled = True
     db.session.add(comment)
     return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+                            after=request.args.get('after'),
+                            before=request.args.get('before'),
+                            last=request.args.get('last')))
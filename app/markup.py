@@ -0,0 +1,79 @@
+"""
+Markdown rendering for user submitted text.
+
+Renderer turns Markdown into sanitized HTML. Building a Markdown converter
+or a bleach Cleaner is far more expensive than running one, and neither is
+safe to share between threads, so every thread keeps its own pair and
+reuses it. Identical bodies ("Looks great!") are common among comments,
+so results are memoized in a bounded LRU keyed by a digest of the source.
+"""
+import hashlib
+import threading
+import bleach
+from markdown import Markdown
+from .cache import LRUCache
+
+try:
+    from bleach.sanitizer import Cleaner
+    from bleach.linkifier import LinkifyFilter
+except ImportError:  # bleach < 2.0, fall back to bleach.clean/linkify
+    Cleaner = None
+
+
+COMMENT_TAGS = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']
+
+
+class Renderer(object):
+    def __init__(self, tags, maxsize=4096):
+        self.tags = tags
+        self.cache = LRUCache(maxsize)
+        self._local = threading.local()
+
+
+    def init_app(self, app):
+        self.cache = LRUCache(app.config['STOCKPOT_MARKUP_CACHE_SIZE'])
+
+
+    def render(self, source):
+        if source is None:
+            return None
+        key = hashlib.sha1(source.encode('utf-8')).digest()
+        html = self.cache.get(key)
+        if html is None:
+            html = self._clean(self._markdown().convert(source))
+            self.cache.set(key, html)
+        return html
+
+
+    def _markdown(self):
+        md = getattr(self._local, 'markdown', None)
+        if md is None:
+            md = self._local.markdown = Markdown(output_format='html')
+        # converters keep state (footnotes, references) between documents
+        md.reset()
+        return md
+
+
+    def _clean(self, html):
+        if Cleaner is None:
+            return bleach.linkify(bleach.clean(html, tags=self.tags,
+                                               strip=True))
+        cleaner = getattr(self._local, 'cleaner', None)
+        if cleaner is None:
+            cleaner = self._local.cleaner = Cleaner(
+                tags=self.tags, strip=True, filters=[LinkifyFilter])
+        return cleaner.clean(html)
+
+
+comment_renderer = Renderer(COMMENT_TAGS)
+
+
+def rerender_comment(row):
+    """
+    (id, body, body_html) -> (id, new body_html), or None when unchanged.
+    Runs in the worker processes of Comment.rerender.
+    """
+    comment_id, body, body_html = row
+    html = comment_renderer.render(body)
+    if html != body_html:
+        return comment_id, html
@@ -1,20 +1,30 @@
 """
 Contains the SQLAlchemy classes for the Role and User models
 """
-from sqlalchemy import event
+from sqlalchemy import event, select, literal, exists, and_, or_, bindparam
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session, joinedload
+from sqlalchemy.orm.attributes import set_committed_value, get_history
+from sqlalchemy.orm.session import make_transient_to_detached
 from . import db, login_manager, recipe_imgs
+from .cache import LRUCache, invalidate_after_commit
+from .activity import last_seen_buffer
+from .markup import comment_renderer, rerender_comment
+from .storage import image_url
+from .avatars import avatar_store, nearest_size
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from flask import current_app, request
+from itsdangerous import BadSignature
+from flask import current_app, request, url_for
 from datetime import datetime
 import hashlib
+import json
+from collections import OrderedDict
 import os
 from faker import Faker
 from random import randint, choice
-from markdown import markdown
-import bleach
+from multiprocessing import Pool, cpu_count
 
 class Permission:
     FOLLOW = 0x01
@@ -68,50 +78,187 @@ class Recipe(db.Model):
     title = db.Column(db.String(64))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     img_filename = db.Column(db.String(256))
+    # resized copies of the image as JSON {ext: {width: filename}},
+    # written by app/images.py once they exist
+    img_variants = db.Column(db.Text)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    ingredients = db.relationship('RecipeIngredient', backref='recipe', lazy='dynamic')
-    steps = db.relationship('RecipeStep', backref='recipe', lazy='dynamic')
+    # lines belong to their recipe, edits go through update_lines
+    ingredients = db.relationship('RecipeIngredient', backref='recipe',
+                                  lazy='dynamic',
+                                  cascade='all, delete-orphan')
+    steps = db.relationship('RecipeStep', backref='recipe', lazy='dynamic',
+                            cascade='all, delete-orphan')
     prep_time = db.Column(db.Interval)
     cook_time = db.Column(db.Interval)
+    # the times in whole seconds, kept in step with the intervals, which
+    # SQLite stores as dates; "under 30 minutes" is a range over an index
+    prep_seconds = db.Column(db.Integer, index=True)
+    cook_seconds = db.Column(db.Integer, index=True)
+    total_seconds = db.Column(db.Integer, index=True)
     description = db.Column(db.Text)
     comments = db.relationship('Comment', backref='recipe', lazy='dynamic')
+    comments_count = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
+    # moved by every UPDATE, Core ones included, and by changes to the
+    # steps, ingredients and comments; the validator of conditional GETs
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
+    # a user's recipes newest first, and the follows -> recipes join that
+    # rebuilds timelines
+    __table_args__ = (
+        db.Index('ix_recipes_author_timestamp', 'author_id', 'timestamp'),
+    )
 
 
     @property
     def img_src(self):
-        return recipe_imgs.url(self.img_filename)
-    
+        return image_url(self.img_filename)
+
 
     @property
     def img_path(self):
         return recipe_imgs.path(self.img_filename)
 
 
-    def delete_img(self):
-        if self.img_filename != current_app.config['STOCKPOT_DEFAULT_IMG']:
-            os.remove(self.img_path)
+    def _img_variants(self, ext):
+        if not self.img_variants:
+            return []
+        sizes = json.loads(self.img_variants).get(ext, {})
+        return sorted((int(width), name) for width, name in sizes.items())
+
+
+    def img_src_for(self, width, ext='jpeg'):
+        """
+        URL of the smallest variant at least ``width`` pixels wide, or of
+        the original when there is none.
+        """
+        for variant_width, name in self._img_variants(ext):
+            if variant_width >= width:
+                return image_url(name)
+        return self.img_src
+
+
+    def img_srcset(self, ext='jpeg'):
+        return ', '.join('{} {}w'.format(image_url(name), width)
+                         for width, name in self._img_variants(ext))
 
 
     def update_img(self, filename):
-        if filename != self.img_filename:
-            self.delete_img()
+        # the old file goes when its last reference does, see StoredImage
         self.img_filename = filename
 
 
+    @staticmethod
+    def build_ingredients(lines):
+        """
+        Turn (amount, units, name) tuples into RecipeIngredient rows that
+        point at canonical ingredients, fetched and created in bulk.
+        """
+        lines = list(lines)
+        ingredients = Ingredient.get_or_create(name for _, _, name in lines)
+        return [RecipeIngredient(amount=amount, units=units,
+                                 ingredient=ingredients.get(
+                                     Ingredient.normalize(name)))
+                for amount, units, name in lines]
+
+
+    def update_lines(self, ingredients, steps):
+        """
+        Edit the recipe's lines in place: ``ingredients`` are (id, (amount,
+        units, name)) pairs and ``steps`` (id, body) pairs in their new
+        order, with an id of None for lines added since the form was
+        rendered.
+
+        Only the lines that changed are written, in one executemany per
+        kind of statement, see diff_lines. Returns whether anything did.
+        """
+        ingredients, steps = list(ingredients), list(steps)
+        canonical = Ingredient.get_or_create(
+            name for _, (_, _, name) in ingredients)
+
+        def ingredient_id(name):
+            ingredient = canonical.get(Ingredient.normalize(name))
+            return ingredient.id if ingredient is not None else None
+
+        changed = sync_lines(
+            RecipeIngredient.__table__, ('amount', 'units', 'ingredient_id'),
+            self.id, [(line_id, (amount, units, ingredient_id(name)))
+                      for line_id, (amount, units, name) in ingredients])
+        changed = sync_lines(RecipeStep.__table__, ('body',), self.id,
+                             [(step_id, (body,))
+                              for step_id, body in steps]) or changed
+        if changed:
+            # the lines bypassed the ORM, this UPDATE makes the recipe
+            # page, its fragments and its search document follow
+            self.updated_at = datetime.utcnow()
+        return changed
+
+
+    @staticmethod
+    def time_columns(prep_time, cook_time):
+        """The seconds columns for the given intervals, as a dict."""
+        prep, cook = duration_seconds(prep_time), duration_seconds(cook_time)
+        total = None
+        if prep is not None or cook is not None:
+            total = (prep or 0) + (cook or 0)
+        return {'prep_seconds': prep, 'cook_seconds': cook,
+                'total_seconds': total}
+
+
+    @staticmethod
+    def backfill_times(batch_size=1000):
+        """
+        Fill the seconds columns of recipes written before they existed,
+        or by hand, from their intervals. Recipes are read in batches of
+        ids and the ones out of step written back with one executemany
+        per batch, committing after each. Returns how many were.
+        """
+        recipes = Recipe.__table__
+        update = recipes.update()\
+            .where(recipes.c.id == bindparam('recipe_id'))\
+            .values(prep_seconds=bindparam('prep'),
+                    cook_seconds=bindparam('cook'),
+                    total_seconds=bindparam('total'))
+        last_id, changed = 0, 0
+        while True:
+            rows = db.session.execute(
+                select([recipes.c.id, recipes.c.prep_time,
+                        recipes.c.cook_time, recipes.c.prep_seconds,
+                        recipes.c.cook_seconds, recipes.c.total_seconds])
+                .where(recipes.c.id > last_id)
+                .order_by(recipes.c.id).limit(batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for recipe_id, prep_time, cook_time, prep, cook, total in rows:
+                columns = Recipe.time_columns(prep_time, cook_time)
+                if (prep, cook, total) != (columns['prep_seconds'],
+                                           columns['cook_seconds'],
+                                           columns['total_seconds']):
+                    updates.append({'recipe_id': recipe_id,
+                                    'prep': columns['prep_seconds'],
+                                    'cook': columns['cook_seconds'],
+                                    'total': columns['total_seconds']})
+            if updates:
+                db.session.execute(update, updates)
+            db.session.commit()
+            changed += len(updates)
+        return changed
+
+
     @classmethod
     def generate_fake(cls, count=100):
         fake = Faker()
-        user_count = User.query.count()
+        users = User.query.all()
         for i in range(count):
-            u = User.query.offset(randint(0, user_count-1)).first()
-            
-            ingredients = []
-            for j in range(randint(1, cls.INGREDIENT_LIMIT)):
-                ingredients.append(RecipeIngredient(
-                    amount=randint(1,10),
-                    units=choice(current_app.config['RECIPE_UNITS']),
-                    ingredient=Ingredient(name=fake.word())
-                ))
+            u = choice(users)
+
+            ingredients = cls.build_ingredients(
+                (randint(1, 10),
+                 choice(current_app.config['RECIPE_UNITS']),
+                 fake.word())
+                for j in range(randint(1, cls.INGREDIENT_LIMIT)))
 
             steps = []
             for k in range(randint(1, cls.STEP_LIMIT)):
@@ -125,19 +272,198 @@ class Recipe(db.Model):
                 img_filename=current_app.config['STOCKPOT_DEFAULT_IMG'],
                 description=fake.text()
             )
+            db.session.add(r)
+        db.session.commit()
+
+
+# active_history loads the old name, so StoredImage can release it
+@event.listens_for(Recipe.img_filename, 'set', active_history=True)
+def recipe_img_changed(target, value, oldvalue, initiator):
+    if value != oldvalue:
+        target.img_variants = None
+
 
+def duration_seconds(interval):
+    return int(round(interval.total_seconds())) if interval is not None \
+        else None
 
-# clean up function for Recipe instance before deletion
-@event.listens_for(Recipe, 'before_delete')
-def recipe_before_delete(mapper, connection, target):
-    target.delete_img()
+
+@event.listens_for(Recipe.prep_time, 'set')
+def recipe_prep_time_changed(target, value, oldvalue, initiator):
+    for name, seconds in Recipe.time_columns(
+            value, target.cook_time).items():
+        setattr(target, name, seconds)
+
+
+@event.listens_for(Recipe.cook_time, 'set')
+def recipe_cook_time_changed(target, value, oldvalue, initiator):
+    for name, seconds in Recipe.time_columns(
+            target.prep_time, value).items():
+        setattr(target, name, seconds)
+
+
+class StoredImage(db.Model):
+    """
+    How many recipes use each uploaded image, see app/storage.py.
+
+    Identical uploads are stored once under their content hash, so a file
+    can only be removed when its count drops to zero. The default image
+    is shared by design and never counted.
+    """
+    __tablename__ = 'images'
+    # session.info key of the files released by a transaction
+    RELEASED_KEY = 'stockpot.img_released'
+    filename = db.Column(db.String(256), primary_key=True)
+    refcount = db.Column(db.Integer, nullable=False, default=0,
+                         server_default='0')
+
+
+    @staticmethod
+    def retain(connection, filename):
+        if not StoredImage._counted(filename):
+            return
+        images = StoredImage.__table__
+        bump = images.update().where(images.c.filename == filename) \
+            .values(refcount=images.c.refcount + 1)
+        if connection.execute(bump).rowcount == 0:
+            # OR IGNORE: another request may be counting the same file
+            connection.execute(images.insert().prefix_with(
+                'OR IGNORE', dialect='sqlite').values(
+                    filename=filename, refcount=0))
+            connection.execute(bump)
+
+
+    @staticmethod
+    def release(connection, filename):
+        """
+        Drop one reference, returning True for the last one. The files
+        are removed after commit by image_sweeper, see app/images.py.
+        """
+        if not StoredImage._counted(filename):
+            return False
+        images = StoredImage.__table__
+        connection.execute(images.update()
+                           .where(images.c.filename == filename)
+                           .values(refcount=images.c.refcount - 1))
+        result = connection.execute(images.delete().where(and_(
+            images.c.filename == filename, images.c.refcount <= 0)))
+        return result.rowcount > 0
+
+
+    @staticmethod
+    def _counted(filename):
+        return filename is not None and \
+            filename != current_app.config['STOCKPOT_DEFAULT_IMG']
+
+
+def release_img(connection, target, filename):
+    if StoredImage.release(connection, filename):
+        object_session(target).info.setdefault(
+            StoredImage.RELEASED_KEY, set()).add(filename)
+
+
+@event.listens_for(Recipe, 'before_update')
+def recipe_before_update(mapper, connection, target):
+    # also called when only the steps or ingredients were replaced
+    if object_session(target).is_modified(target):
+        target.updated_at = datetime.utcnow()
+
+
+@event.listens_for(Recipe, 'after_update')
+def recipe_img_after_update(mapper, connection, target):
+    history = get_history(target, 'img_filename')
+    if history.has_changes():
+        for filename in history.added:
+            StoredImage.retain(connection, filename)
+        for filename in history.deleted:
+            release_img(connection, target, filename)
+
+
+def diff_lines(stored, submitted):
+    """
+    Plan the statements turning the ``stored`` lines of a recipe, (id,
+    values) pairs in id order, into the ``submitted`` ones, (id or None,
+    values) pairs in their new order.
+
+    Lines are listed by id, so the kept rows must stay in increasing id
+    order. Submitted ids found in increasing order anchor their line to
+    its row; every other line takes the next row not claimed by a later
+    anchor, or is inserted after the existing ones. When a new line does
+    not fit between two anchors, the anchors after it are given up and
+    the rows from there on are rewritten.
+
+    Returns (updates, inserts, deletes): (id, values) pairs of rows whose
+    values change, values of new rows, ids of rows to delete.
+    """
+    index = dict((line_id, k) for k, (line_id, _) in enumerate(stored))
+    targets, last = [], -1
+    for line_id, _ in submitted:
+        k = index.get(line_id)
+        if k is not None and k > last:
+            targets.append(k)
+            last = k
+        else:
+            targets.append(None)
+    free = 0
+    for i, target in enumerate(targets):
+        if target is not None:
+            free = target + 1
+            continue
+        bound = next((t for t in targets[i + 1:] if t is not None),
+                     len(stored))
+        if free >= bound:
+            targets[i + 1:] = [None] * (len(targets) - i - 1)
+            bound = len(stored)
+        if free < bound:
+            targets[i] = free
+            free += 1
+    updates, inserts = [], []
+    for (_, values), target in zip(submitted, targets):
+        if target is None:
+            inserts.append(values)
+        elif stored[target][1] != tuple(values):
+            updates.append((stored[target][0], tuple(values)))
+    kept = set(target for target in targets if target is not None)
+    deletes = [line_id for k, (line_id, _) in enumerate(stored)
+               if k not in kept]
+    return updates, inserts, deletes
+
+
+def sync_lines(table, columns, recipe_id, submitted):
+    """
+    Apply diff_lines to the rows of ``table`` belonging to ``recipe_id``
+    with Core statements in the session's transaction, returning whether
+    any row changed.
+    """
+    query = select([table.c.id] + [table.c[name] for name in columns])\
+        .where(table.c.recipe_id == recipe_id).order_by(table.c.id)
+    stored = [(row[0], tuple(row[1:]))
+              for row in db.session.execute(query)]
+    updates, inserts, deletes = diff_lines(stored, submitted)
+    if updates:
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('line_id'))
+            .values(dict((name, bindparam('new_' + name))
+                         for name in columns)),
+            [dict([('line_id', line_id)] +
+                  [('new_' + name, value)
+                   for name, value in zip(columns, values)])
+             for line_id, values in updates])
+    if inserts:
+        db.session.execute(table.insert(), [
+            dict(zip(columns, values), recipe_id=recipe_id)
+            for values in inserts])
+    if deletes:
+        db.session.execute(table.delete().where(table.c.id.in_(deletes)))
+    return bool(updates or inserts or deletes)
 
 
 class RecipeStep(db.Model):
     __tablename__ = 'recipesteps'
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
-    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'))
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'),
+                          index=True)
 
 
 class RecipeIngredient(db.Model):
@@ -147,15 +473,112 @@ class RecipeIngredient(db.Model):
     units = db.Column(db.String(64))
     ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'))
     recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'))
+    # posting lists for pantry search: recipe ids per ingredient, read
+    # straight out of the index without touching the table, and the other
+    # way round for a recipe's lines and its search document
+    __table_args__ = (
+        db.Index('ix_recipeingredients_ingredient_recipe',
+                 'ingredient_id', 'recipe_id'),
+        db.Index('ix_recipeingredients_recipe_ingredient',
+                 'recipe_id', 'ingredient_id'),
+    )
 
 
 class Ingredient(db.Model):
+    """
+    Canonical ingredient, shared by every recipe line that uses it.
+
+    ``key`` is the normalized name and carries the unique index, ``name``
+    keeps the spelling the ingredient was first created with.
+    """
     __tablename__ = 'ingredients'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64))
+    key = db.Column(db.String(64), unique=True, index=True)
     recipe_ingredients = db.relationship('RecipeIngredient', backref='ingredient', lazy='dynamic')
 
 
+    @staticmethod
+    def normalize(name):
+        return ' '.join((name or '').lower().split())
+
+
+    @staticmethod
+    def on_changed_name(target, value, oldvalue, initiator):
+        target.key = Ingredient.normalize(value) or None
+
+
+    @classmethod
+    def get_or_create(cls, names):
+        """
+        Map the normalized form of each of ``names`` to its Ingredient.
+
+        One SELECT finds the existing rows, the missing ones are written
+        with a single multi-row INSERT and read back, however many names
+        are passed in.
+        """
+        spellings = OrderedDict()
+        for name in names:
+            key = cls.normalize(name)
+            if key:
+                spellings.setdefault(key, name.strip())
+        if not spellings:
+            return {}
+        found = dict((i.key, i) for i in
+                     cls.query.filter(cls.key.in_(list(spellings))))
+        missing = [{'name': name, 'key': key}
+                   for key, name in spellings.items() if key not in found]
+        if missing:
+            # OR IGNORE: a concurrent request may have created some of
+            # them since the SELECT, the unique index keeps one copy
+            db.session.execute(
+                cls.__table__.insert().prefix_with('OR IGNORE',
+                                                   dialect='sqlite'),
+                missing)
+            found.update((i.key, i) for i in cls.query.filter(
+                cls.key.in_([row['key'] for row in missing])))
+        return found
+
+
+    @staticmethod
+    def merge_duplicates():
+        """
+        Collapse ingredients whose names normalize to the same key into
+        the oldest of them, repointing recipe lines at the survivor.
+        """
+        canonical = {}
+        merges, keys = [], []
+        rows = db.session.query(Ingredient.id, Ingredient.name)\
+            .order_by(Ingredient.id).all()
+        for ingredient_id, name in rows:
+            key = Ingredient.normalize(name) or None
+            if key is not None and key in canonical:
+                merges.append({'old': ingredient_id, 'new': canonical[key]})
+            else:
+                canonical[key] = ingredient_id
+                keys.append({'ingredient': ingredient_id, 'normalized': key})
+
+        lines, ingredients = RecipeIngredient.__table__, Ingredient.__table__
+        if merges:
+            db.session.execute(
+                lines.update()
+                .where(lines.c.ingredient_id == bindparam('old'))
+                .values(ingredient_id=bindparam('new')), merges)
+            db.session.execute(
+                ingredients.delete()
+                .where(ingredients.c.id == bindparam('old')), merges)
+        if keys:
+            db.session.execute(
+                ingredients.update()
+                .where(ingredients.c.id == bindparam('ingredient'))
+                .values(key=bindparam('normalized')), keys)
+        db.session.commit()
+        return len(merges)
+
+
+db.event.listen(Ingredient.name, 'set', Ingredient.on_changed_name)
+
+
 class Follow(db.Model):
     __tablename__ = 'follows'
     follower_id = db.Column(db.Integer, db.ForeignKey('users.id'), 
@@ -163,7 +586,251 @@ class Follow(db.Model):
     followed_id = db.Column(db.Integer, db.ForeignKey('users.id'),
                            primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # the primary key finds who a user follows, these page through
+    # followers and followed users in (timestamp, id) order
+    __table_args__ = (
+        db.Index('ix_follows_followed_timestamp', 'followed_id', 'timestamp'),
+        db.Index('ix_follows_follower_timestamp', 'follower_id', 'timestamp'),
+    )
+
+
+class FollowGraph(object):
+    """
+    In-process cache of the follow graph.
+
+    Keeps the set of followed ids per follower in a bounded LRU, so
+    membership checks like User.is_following are answered from memory.
+    Entries are dropped by the Follow mapper events below, in this process
+    only, so follow and unfollow go to the database instead.
+    """
+    def __init__(self, maxsize=10000, ttl=None):
+        self.cache = LRUCache(maxsize, ttl)
+
+
+    def init_app(self, app):
+        self.cache = LRUCache(app.config['STOCKPOT_FOLLOW_CACHE_SIZE'],
+                              app.config['STOCKPOT_FOLLOW_CACHE_TTL'])
+
+
+    def followed_ids(self, user_id):
+        ids = self.cache.get(user_id)
+        if ids is None:
+            ids = frozenset(followed_id for (followed_id,) in
+                            db.session.query(Follow.followed_id)
+                            .filter(Follow.follower_id == user_id))
+            self.cache.set(user_id, ids)
+        return ids
+
+
+    def invalidate(self, session, user_id):
+        invalidate_after_commit(session, self.cache, user_id)
+
+
+follow_graph = FollowGraph()
+
+
+class TimelineEntry(db.Model):
+    """
+    Materialized followed feed, one row per (follower, recipe).
+
+    Rows are pushed when a recipe is created (fan-out-on-write) and
+    backfilled or pruned when a follow is added or removed, so reading
+    a followed feed is a range scan over (user_id, timestamp, recipe_id).
+    Authors with more than STOCKPOT_TIMELINE_FANOUT_LIMIT followers are
+    skipped here and merged in at read time, see queries.followed_feed.
+    """
+    __tablename__ = 'timelines'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+                        primary_key=True)
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'),
+                          primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    timestamp = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index('ix_timelines_user_timestamp',
+                 'user_id', 'timestamp', 'recipe_id'),
+        db.Index('ix_timelines_user_author', 'user_id', 'author_id'),
+    )
+
+
+    @staticmethod
+    def popular_authors():
+        """Select the ids of authors that are too popular to fan out."""
+        return select([User.id]).where(User.followers_count >
+            current_app.config['STOCKPOT_TIMELINE_FANOUT_LIMIT'])
+
+
+    @staticmethod
+    def is_popular(connection, author_id):
+        followers = connection.execute(
+            select([User.followers_count]).where(User.id == author_id)
+        ).scalar()
+        return (followers or 0) > \
+            current_app.config['STOCKPOT_TIMELINE_FANOUT_LIMIT']
+
+
+    @staticmethod
+    def fan_out(connection, recipe):
+        """Push a freshly inserted recipe onto its author's followers."""
+        if recipe.author_id is None or \
+           TimelineEntry.is_popular(connection, recipe.author_id):
+            return
+        followers = select([
+            Follow.follower_id,
+            literal(recipe.id, db.Integer),
+            literal(recipe.author_id, db.Integer),
+            literal(recipe.timestamp, db.DateTime)
+        ]).where(Follow.followed_id == recipe.author_id)
+        connection.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'recipe_id', 'author_id', 'timestamp'], followers))
+
+
+    @staticmethod
+    def backfill(connection, follower_id, followed_id):
+        """Copy an author's recipes onto a new follower's timeline."""
+        if TimelineEntry.is_popular(connection, followed_id):
+            return
+        already = exists().where(and_(
+            TimelineEntry.user_id == follower_id,
+            TimelineEntry.recipe_id == Recipe.id))
+        recipes = select([
+            literal(follower_id, db.Integer),
+            Recipe.id,
+            Recipe.author_id,
+            Recipe.timestamp
+        ]).where(Recipe.author_id == followed_id).where(~already)
+        connection.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'recipe_id', 'author_id', 'timestamp'], recipes))
+
+
+    @staticmethod
+    def rebalance(connection, author_id, delta):
+        """
+        Called once a follow moved ``author_id``'s follower count by
+        ``delta``. Crossing over the fan-out limit, the author's rows
+        leave every timeline since reads now merge them in; dropping back
+        under it, every follower gets them copied in again.
+        """
+        limit = current_app.config['STOCKPOT_TIMELINE_FANOUT_LIMIT']
+        followers = connection.execute(
+            select([User.followers_count]).where(User.id == author_id)
+        ).scalar() or 0
+        timelines = TimelineEntry.__table__
+        if delta > 0 and followers == limit + 1:
+            connection.execute(timelines.delete().where(
+                timelines.c.author_id == author_id))
+        elif delta < 0 and followers == limit:
+            already = exists().where(and_(
+                TimelineEntry.user_id == Follow.follower_id,
+                TimelineEntry.recipe_id == Recipe.id))
+            entries = select([
+                Follow.follower_id,
+                Recipe.id,
+                Recipe.author_id,
+                Recipe.timestamp
+            ]).select_from(Follow.__table__.join(
+                Recipe.__table__, Follow.followed_id == Recipe.author_id)
+            ).where(Recipe.author_id == author_id).where(~already)
+            connection.execute(timelines.insert().from_select(
+                ['user_id', 'recipe_id', 'author_id', 'timestamp'], entries))
+
+
+    @staticmethod
+    def prune(connection, follower_id, followed_id):
+        connection.execute(TimelineEntry.__table__.delete().where(and_(
+            TimelineEntry.user_id == follower_id,
+            TimelineEntry.author_id == followed_id)))
+
+
+    @staticmethod
+    def rebuild():
+        """Recompute every timeline from the follows and recipes tables."""
+        entries = select([
+            Follow.follower_id,
+            Recipe.id,
+            Recipe.author_id,
+            Recipe.timestamp
+        ]).select_from(Follow.__table__.join(
+            Recipe.__table__, Follow.followed_id == Recipe.author_id)
+        ).where(~Recipe.author_id.in_(TimelineEntry.popular_authors()))
+        db.session.execute(TimelineEntry.__table__.delete())
+        db.session.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'recipe_id', 'author_id', 'timestamp'], entries))
+        db.session.commit()
+
 
+def bump_counter(connection, table, column, row_id, delta):
+    """Add ``delta`` to a denormalized counter column of a single row."""
+    if row_id is None:
+        return
+    connection.execute(table.update().where(table.c.id == row_id)
+                       .values({column: table.c[column] + delta}))
+
+
+def recount():
+    """Recompute every denormalized counter with one UPDATE per table."""
+    users, recipes = User.__table__, Recipe.__table__
+    follows, comments = Follow.__table__, Comment.__table__
+    count = db.func.count
+    db.session.execute(users.update().values(
+        followers_count=select([count()]).where(
+            follows.c.followed_id == users.c.id).as_scalar(),
+        followed_count=select([count()]).where(
+            follows.c.follower_id == users.c.id).as_scalar(),
+        recipes_count=select([count()]).where(
+            recipes.c.author_id == users.c.id).as_scalar()))
+    db.session.execute(recipes.update().values(
+        comments_count=select([count()]).where(
+            comments.c.recipe_id == recipes.c.id).as_scalar()))
+    images = StoredImage.__table__
+    db.session.execute(images.delete())
+    db.session.execute(images.insert().from_select(
+        ['filename', 'refcount'],
+        select([recipes.c.img_filename, count()])
+        .where(and_(recipes.c.img_filename.isnot(None),
+                    recipes.c.img_filename !=
+                    current_app.config['STOCKPOT_DEFAULT_IMG']))
+        .group_by(recipes.c.img_filename)))
+    db.session.commit()
+
+
+@event.listens_for(Recipe, 'after_insert')
+def recipe_after_insert(mapper, connection, target):
+    bump_counter(connection, User.__table__, 'recipes_count',
+                 target.author_id, 1)
+    StoredImage.retain(connection, target.img_filename)
+    TimelineEntry.fan_out(connection, target)
+
+
+@event.listens_for(Recipe, 'after_delete')
+def recipe_after_delete(mapper, connection, target):
+    bump_counter(connection, User.__table__, 'recipes_count',
+                 target.author_id, -1)
+    release_img(connection, target, target.img_filename)
+    connection.execute(TimelineEntry.__table__.delete().where(
+        TimelineEntry.recipe_id == target.id))
+
+
+@event.listens_for(Follow, 'after_insert')
+def follow_after_insert(mapper, connection, target):
+    follow_graph.invalidate(object_session(target), target.follower_id)
+    bump_counter(connection, User.__table__, 'followers_count',
+                 target.followed_id, 1)
+    bump_counter(connection, User.__table__, 'followed_count',
+                 target.follower_id, 1)
+    TimelineEntry.rebalance(connection, target.followed_id, 1)
+    TimelineEntry.backfill(connection, target.follower_id, target.followed_id)
+
+
+@event.listens_for(Follow, 'after_delete')
+def follow_after_delete(mapper, connection, target):
+    follow_graph.invalidate(object_session(target), target.follower_id)
+    bump_counter(connection, User.__table__, 'followers_count',
+                 target.followed_id, -1)
+    bump_counter(connection, User.__table__, 'followed_count',
+                 target.follower_id, -1)
+    TimelineEntry.prune(connection, target.follower_id, target.followed_id)
+    TimelineEntry.rebalance(connection, target.followed_id, -1)
 
 
 class User(UserMixin, db.Model):
@@ -179,7 +846,13 @@ class User(UserMixin, db.Model):
     about_me = db.Column(db.Text())
     member_since = db.Column(db.DateTime(), default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
-    avatar_hash = db.Column(db.String(32))
+    avatar_hash = db.Column(db.String(32), index=True)
+    # moved by every UPDATE, counters and last_seen included, see
+    # Recipe.updated_at
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
+    # what recipe listings show of their authors, see recipe_listing
+    LISTED_COLUMNS = ('username', 'email', 'avatar_hash')
     recipes = db.relationship('Recipe', backref='author', lazy='dynamic')
     followed = db.relationship('Follow',
                                foreign_keys=[Follow.follower_id],
@@ -192,6 +865,14 @@ class User(UserMixin, db.Model):
                                 lazy='dynamic',
                                 cascade='all, delete-orphan')
     comments = db.relationship('Comment', backref='author', lazy='dynamic')
+    # denormalized counts, kept up to date by mapper events on Follow,
+    # Recipe and Comment; `flask recount` rebuilds them
+    followers_count = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0', index=True)
+    followed_count = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
+    recipes_count = db.Column(db.Integer, nullable=False, default=0,
+                              server_default='0')
 
 
     def __init__(self, **kwargs):
@@ -223,10 +904,8 @@ class User(UserMixin, db.Model):
 
     @property
     def followed_recipes(self):
-        # join recipe rows with follow table by matching followed_id to author_id
-        # then select the rows where the follower is the user instance
-        return Recipe.query.join(Follow, Follow.followed_id == Recipe.author_id)\
-                .filter(Follow.follower_id == self.id)
+        from .queries import followed_feed
+        return followed_feed(self)[0]
 
 
     def verify_password(self, password):
@@ -238,6 +917,24 @@ class User(UserMixin, db.Model):
         return s.dumps({'confirm': self.id})
 
 
+    def generate_auth_token(self, expiration):
+        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
+        return s.dumps({'id': self.id}).decode('ascii')
+
+
+    @staticmethod
+    def verify_auth_token(token):
+        s = Serializer(current_app.config['SECRET_KEY'])
+        try:
+            data = s.loads(token)
+        except BadSignature:
+            return None
+        if 'id' not in data:
+            # e.g. a confirmation token, signed with the same key
+            return None
+        return user_cache.get(data['id'])
+
+
     def confirm(self, token):
         s = Serializer(current_app.config['SECRET_KEY'])
         try:
@@ -261,8 +958,7 @@ class User(UserMixin, db.Model):
 
 
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
+        last_seen_buffer.touch(self)
 
 
     def gravatar(self, size=100, default='identicon', rating='g'):
@@ -270,50 +966,98 @@ class User(UserMixin, db.Model):
             url = 'https://secure.gravatar.com/avatar'
         else:
             url = 'http://www.gravatar.com/avatar'
-        hashed = self.avatar_hash or hashlib.md5(self.email.encode('utf-8')).hexdigest()
         return '{url}/{hashed}?s={size}&d={default}&r={rating}'.format(
-            url=url, hashed=hashed, size=size, default=default, rating=rating)
+            url=url, hashed=self.email_hash, size=size, default=default,
+            rating=rating)
+
+
+    def avatar(self, size=100):
+        """URL of the avatar served by this app, see app/avatars.py."""
+        if not avatar_store.enabled:
+            return self.gravatar(size)
+        return url_for('main.avatar', digest=self.email_hash,
+                       size=nearest_size(size))
+
+
+    @staticmethod
+    def has_avatar(digest):
+        """Whether ``digest`` is the avatar_hash of some user."""
+        return db.session.query(
+            User.query.filter_by(avatar_hash=digest).exists()).scalar()
+
+
+    @property
+    def email_hash(self):
+        return self.avatar_hash or \
+            hashlib.md5(self.email.encode('utf-8')).hexdigest()
 
 
     def follow(self, user):
-        if not self.is_following(user):
-            f = Follow(follower=self, followed=user)
-            db.session.add(f)
+        """Follow ``user``, returns whether a Follow was added."""
+        if self.follow_to(user) is not None:
+            return False
+        db.session.add(Follow(follower=self, followed=user))
+        return True
 
 
     def unfollow(self, user):
-        f = self.followed.filter_by(followed_id=user.id).first()
-        if f:
-            db.session.delete(f)
+        """Stop following ``user``, returns whether a Follow was removed."""
+        f = self.follow_to(user)
+        if f is None:
+            return False
+        db.session.delete(f)
+        return True
+
+
+    def follow_to(self, user):
+        """
+        This user's Follow of ``user``, if any, read from the database.
+        Writes check here rather than the follow graph, another process
+        may have changed the follow since it was cached.
+        """
+        if self.id is None or user.id is None:
+            return next((f for f in self.followed if f.followed is user),
+                        None)
+        return self.followed.filter_by(followed_id=user.id).first()
 
 
     def is_following(self, user):
-        return self.followed.filter_by(
-            followed_id=user.id).first() is not None
+        if self.id is None or user.id is None:
+            # nothing has been flushed yet, only pending follows can match
+            return any(f.followed is user for f in self.followed)
+        return user.id in follow_graph.followed_ids(self.id)
 
 
     def is_followed_by(self, user):
-        return self.followers.filter_by(
-            follower_id=user.id).first() is not None
+        return user.is_following(self)
 
 
     @staticmethod
     def add_self_follows():
-        for user in User.query.all():
-            if not user.is_following(user):
-                user.follow(user)
-                db.session.add(user)
-                db.session.commit()
+        self_follow = exists().where(and_(Follow.follower_id == User.id,
+                                          Follow.followed_id == User.id))
+        for user in User.query.filter(~self_follow).all():
+            user.follow(user)
+        db.session.commit()
 
 
     @staticmethod
     def generate_fake(count=100):
         fake = Faker()
+        emails, usernames = set(), set()
+        for email, username in db.session.query(User.email, User.username):
+            emails.add(email)
+            usernames.add(username)
 
         for i in range(count):
+            email, username = fake.email(), fake.user_name()
+            if email in emails or username in usernames:
+                continue
+            emails.add(email)
+            usernames.add(username)
             u = User(
-                email=fake.email(),
-                username=fake.user_name(),
+                email=email,
+                username=username,
                 password=fake.word(),
                 confirmed=True,
                 name=fake.name(),
@@ -322,10 +1066,7 @@ class User(UserMixin, db.Model):
                 member_since=fake.date_time_this_century(
                     before_now=True,after_now=False, tzinfo=None))
             db.session.add(u)
-            try:
-                db.session.commit()
-            except:
-                db.session.rollback()
+        db.session.commit()
 
 
 
@@ -338,14 +1079,138 @@ class AnonymousUser(AnonymousUserMixin):
         return False
 
 
+class UserCache(object):
+    """
+    Short lived snapshots of the users behind recent requests.
+
+    A hit rebuilds the User and its Role from plain column values and
+    merges them into the session without a query, so current_user and its
+    permissions cost nothing on most requests. The denormalized counters
+    are updated behind the ORM's back and are left out of the snapshot;
+    they load lazily if a page reads them. Entries are dropped by the
+    User and Role mapper events below.
+    """
+    VOLATILE = ('followers_count', 'followed_count', 'recipes_count',
+                'updated_at')
+
+    def __init__(self, maxsize=10000, ttl=30):
+        self.cache = LRUCache(maxsize, ttl)
+
+
+    def init_app(self, app):
+        self.cache = LRUCache(app.config['STOCKPOT_USER_CACHE_SIZE'],
+                              app.config['STOCKPOT_USER_CACHE_TTL'])
+
+
+    def get(self, user_id):
+        snapshot = self.cache.get(user_id)
+        if snapshot is not None:
+            return self.restore(*snapshot)
+        user = User.query.options(joinedload(User.role)).get(user_id)
+        if user is not None:
+            self.cache.set(user_id, self.snapshot(user))
+        return user
+
+
+    def snapshot(self, user):
+        role = None
+        if user.role is not None:
+            role = self._columns(user.role)
+        return self._columns(user, self.VOLATILE), role
+
+
+    def restore(self, user_values, role_values):
+        user = self._rebuild(User, user_values)
+        role = None
+        if role_values is not None:
+            role = self._rebuild(Role, role_values)
+        set_committed_value(user, 'role', role)
+        return db.session.merge(user, load=False)
+
+
+    def invalidate(self, session, user_id=None):
+        """Drop ``user_id``, or every snapshot when it is None."""
+        invalidate_after_commit(session, self.cache, user_id)
+
+
+    @staticmethod
+    def _columns(obj, exclude=()):
+        return dict((prop.key, getattr(obj, prop.key))
+                    for prop in obj.__mapper__.column_attrs
+                    if prop.key not in exclude)
+
+
+    @staticmethod
+    def _rebuild(cls, values):
+        obj = cls.__mapper__.class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(obj, key, value)
+        make_transient_to_detached(obj)
+        return obj
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, target):
+    user_cache.invalidate(object_session(target), target.id)
+
+
+@event.listens_for(User, 'after_update')
+def user_listing_changed(mapper, connection, target):
+    # listings only track Recipe.updated_at, last_seen and the counters
+    # move the user's updated_at far too often to be part of it; recipe
+    # pages show their commenters too
+    if any(get_history(target, name).has_changes()
+           for name in User.LISTED_COLUMNS):
+        recipes, comments = Recipe.__table__, Comment.__table__
+        commented = select([comments.c.recipe_id]).where(
+            comments.c.author_id == target.id)
+        connection.execute(recipes.update().where(or_(
+            recipes.c.author_id == target.id,
+            recipes.c.id.in_(commented))).values(
+                updated_at=datetime.utcnow()))
+
+
+@event.listens_for(Role, 'after_update')
+@event.listens_for(Role, 'after_delete')
+def role_changed(mapper, connection, target):
+    user_cache.invalidate(object_session(target))
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 
 login_manager.anonymous_user = AnonymousUser
 
 
+class OutboxMessage(db.Model):
+    """
+    An email waiting for the mail queue, see app/email.py.
+
+    Rows are deleted once the message is sent. Failed deliveries are
+    retried with exponential backoff; after STOCKPOT_MAIL_MAX_ATTEMPTS the
+    row is left in place with its last error for somebody to look at.
+    """
+    __tablename__ = 'outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(128))
+    recipient = db.Column(db.String(128))
+    subject = db.Column(db.String(256))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0,
+                         server_default='0')
+    next_attempt_at = db.Column(db.DateTime, index=True,
+                                default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+
+
 class Comment(db.Model):
     __tablename__ = 'comments'
     id = db.Column(db.Integer, primary_key=True)
@@ -355,13 +1220,89 @@ class Comment(db.Model):
     disabled = db.Column(db.Boolean)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'))
+    # a recipe's comments in (timestamp, id) order
+    __table_args__ = (
+        db.Index('ix_comments_recipe_timestamp', 'recipe_id', 'timestamp'),
+    )
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags = allowed_tags, strip=True))
+        target.body_html = comment_renderer.render(value)
+
+
+    @staticmethod
+    def rerender(batch_size=1000, processes=None):
+        """
+        Render every body_html again, e.g. after the allowed tags changed.
+
+        Comments are read in batches of ids and rendered by a process pool
+        while the next batch is read; the ones whose HTML changed are
+        written back with one executemany per batch, and their recipes'
+        updated_at moved so pages revalidate. Returns how many.
+        """
+        comments = Comment.__table__
+        update = comments.update()\
+            .where(comments.c.id == bindparam('comment_id'))\
+            .values(body_html=bindparam('html'))
+        chunksize = max(1, batch_size // (4 * (processes or cpu_count())))
+        pool = Pool(processes)
+        try:
+            last_id, pending, changed = 0, None, 0
+            while True:
+                rows = [tuple(row) for row in db.session.execute(
+                    select([comments.c.id, comments.c.body,
+                            comments.c.body_html])
+                    .where(comments.c.id > last_id)
+                    .order_by(comments.c.id).limit(batch_size))]
+                job = None
+                if rows:
+                    last_id = rows[-1][0]
+                    job = pool.map_async(rerender_comment, rows, chunksize)
+                if pending is not None:
+                    updates = [{'comment_id': comment_id, 'html': html}
+                               for comment_id, html in filter(None,
+                                                              pending.get())]
+                    if updates:
+                        db.session.execute(update, updates)
+                        # the recipe pages showing them are new too
+                        recipes = Recipe.__table__
+                        db.session.execute(recipes.update().where(
+                            recipes.c.id.in_(
+                                select([comments.c.recipe_id]).where(
+                                    comments.c.id.in_(
+                                        [u['comment_id'] for u in updates])))
+                        ).values(updated_at=datetime.utcnow()))
+                        db.session.commit()
+                    changed += len(updates)
+                if job is None:
+                    return changed
+                pending = job
+        finally:
+            pool.close()
+            pool.join()
 
 
 db.event.listen(Comment.body, 'set', Comment.on_changed_body)
+
+
+@event.listens_for(Comment, 'after_insert')
+def comment_after_insert(mapper, connection, target):
+    bump_counter(connection, Recipe.__table__, 'comments_count',
+                 target.recipe_id, 1)
+
+
+@event.listens_for(Comment, 'after_update')
+def comment_after_update(mapper, connection, target):
+    # the recipe page shows its comments, e.g. moderated ones
+    if target.recipe_id is None:
+        return
+    recipes = Recipe.__table__
+    connection.execute(recipes.update().where(
+        recipes.c.id == target.recipe_id).values(
+            updated_at=datetime.utcnow()))
+
+
+@event.listens_for(Comment, 'after_delete')
+def comment_after_delete(mapper, connection, target):
+    bump_counter(connection, Recipe.__table__, 'comments_count',
+                 target.recipe_id, -1)
@@ -0,0 +1,156 @@
+"""
+Keyset (cursor) pagination.
+
+Flask-SQLAlchemy's paginate() issues an OFFSET scan plus a COUNT(*) for
+every page. KeysetPagination instead seeks past the key of the last row
+it handed out, e.g. ``(timestamp, id)``, so a deep page costs the same as
+the first one and nothing ever needs counting.
+"""
+import base64
+import json
+from datetime import datetime
+from flask import request
+from sqlalchemy import and_, or_
+
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(values):
+    """Pack a row key into an opaque, url safe token."""
+    packed = [('d:' + value.strftime(DATETIME_FORMAT))
+              if isinstance(value, datetime) else value
+              for value in values]
+    token = base64.urlsafe_b64encode(
+        json.dumps(packed, separators=(',', ':')).encode('utf-8'))
+    return token.decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, columns=None):
+    """
+    Inverse of encode_cursor, returns None for anything malformed. Given
+    the ``columns`` the cursor is for, a key that does not fit them, e.g.
+    the wrong number of values or a null, is malformed too.
+    """
+    try:
+        token = token.encode('ascii')
+        token += b'=' * (-len(token) % 4)
+        packed = json.loads(base64.urlsafe_b64decode(token).decode('utf-8'))
+        values = []
+        for value in packed:
+            if isinstance(value, str) and value.startswith('d:'):
+                value = datetime.strptime(value[2:], DATETIME_FORMAT)
+            values.append(value)
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    if columns is not None and (
+            len(values) != len(columns) or
+            not all(_fits(c, v) for c, v in zip(columns, values))):
+        return None
+    return tuple(values)
+
+
+def _fits(column, value):
+    # bool is an int to Python, never to a key column
+    if value is None or isinstance(value, bool):
+        return False
+    try:
+        expected = column.type.python_type
+    except NotImplementedError:
+        # untyped expressions, e.g. the bm25 rank of a search
+        return isinstance(value, (int, float, str))
+    if expected is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, expected)
+
+
+def _seek(columns, values, descending):
+    # (c1, c2) < (v1, v2) spelled as c1 <= v1 AND (c1 < v1 OR c2 < v2) so
+    # the leading column can still be answered with an index range scan
+    column, value = columns[0], values[0]
+    if descending:
+        strict, loose = column < value, column <= value
+    else:
+        strict, loose = column > value, column >= value
+    if len(columns) == 1:
+        return strict
+    return and_(loose, or_(strict, _seek(columns[1:], values[1:], descending)))
+
+
+def seek(query, columns, cursor=None, descending=True):
+    """Order ``query`` by ``columns`` starting just past ``cursor``."""
+    if cursor is not None:
+        query = query.filter(_seek(columns, cursor, descending))
+    return query.order_by(*[column.desc() if descending else column.asc()
+                            for column in columns])
+
+
+class KeysetPagination(object):
+    """
+    A single page of ``query`` ordered by ``columns``.
+
+    ``after`` and ``before`` are cursors produced by a previous page's
+    next_cursor/prev_cursor, ``last`` jumps straight to the final page.
+    ``key`` maps a result item to its values for ``columns`` and defaults
+    to reading the attributes of the same name off the item.
+    """
+
+    def __init__(self, query, columns, per_page, after=None, before=None,
+                 last=False, descending=True, key=None, total=None):
+        self.columns = columns
+        self.per_page = per_page
+        self.descending = descending
+        self.total = total
+        self._key = key or (lambda item: tuple(
+            getattr(item, column.key) for column in columns))
+
+        after = decode_cursor(after, columns) if after else None
+        before = decode_cursor(before, columns) if before else None
+        # walk the index backwards when paging towards the start
+        backwards = before is not None or (last and after is None)
+        cursor = before if backwards else after
+        order_desc = descending != backwards
+
+        items = seek(query, columns, cursor, order_desc)\
+            .limit(per_page + 1).all()
+        more = len(items) > per_page
+        items = items[:per_page]
+
+        if backwards:
+            items.reverse()
+            self.has_prev = more
+            self.has_next = cursor is not None
+        else:
+            self.has_prev = cursor is not None
+            self.has_next = more
+        self.items = items
+        self.args = {}
+        if cursor is not None:
+            self.args = {'before' if backwards else 'after':
+                         encode_cursor(cursor)}
+        elif backwards:
+            self.args = {'last': 1}
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return encode_cursor(self._key(self.items[0]))
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return encode_cursor(self._key(self.items[-1]))
+
+
+def paginate(query, columns, per_page, **kwargs):
+    """Build a KeysetPagination from the cursor arguments of the request.
+
+    ``page=-1`` is kept as an alias for ``last=1`` so old links that jump
+    to the end of a listing keep working.
+    """
+    last = request.args.get('last', 0, type=int) == 1 or \
+        request.args.get('page', 0, type=int) == -1
+    return KeysetPagination(query, columns, per_page,
+                            after=request.args.get('after'),
+                            before=request.args.get('before'),
+                            last=last, **kwargs)
@@ -0,0 +1,165 @@
+"""
+Query builders shared by the views.
+
+Listing pages render a grid of ``_recipe_thumbnail.html`` cards, so their
+queries only load the columns a card needs and bring each author back in
+the same round trip instead of lazy loading it once per card.
+"""
+from collections import namedtuple
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload, load_only
+from . import db
+from .models import (Recipe, User, Follow, TimelineEntry, RecipeIngredient,
+                     Ingredient, RecipeStep)
+
+
+# columns read by _recipe_thumbnail.html, everything else (description,
+# prep/cook times) stays deferred until somebody actually touches it
+RECIPE_LISTING_COLUMNS = ('id', 'title', 'timestamp', 'img_filename',
+                          'img_variants', 'author_id')
+# User.avatar falls back to the email when avatar_hash is missing
+AUTHOR_LISTING_COLUMNS = ('id',) + User.LISTED_COLUMNS
+
+
+def recipe_listing(query=None):
+    """Narrow a recipe query down to what a thumbnail grid renders."""
+    if query is None:
+        query = Recipe.query
+    return query.options(
+        load_only(*RECIPE_LISTING_COLUMNS),
+        joinedload(Recipe.author).load_only(*AUTHOR_LISTING_COLUMNS))
+
+
+def within_time(query, min_seconds=None, max_seconds=None):
+    """
+    Narrow a recipe query to the ones taking from ``min_seconds`` to
+    ``max_seconds`` in total, either end left open when None. A range
+    over ix_recipes_total_seconds; recipes without times never match.
+    """
+    if min_seconds is not None:
+        query = query.filter(Recipe.total_seconds >= min_seconds)
+    if max_seconds is not None:
+        query = query.filter(Recipe.total_seconds <= max_seconds)
+    return query
+
+
+def recipe_key(recipe):
+    """Cursor key of a recipe in any of the feeds below."""
+    return (recipe.timestamp, recipe.id)
+
+
+def followed_feed(user):
+    """
+    Recipes by the users ``user`` follows, newest first.
+
+    Returns the query together with the columns to paginate it on. When
+    every followed author is fanned out the feed is a range read over the
+    user's timeline; popular authors are merged in from the recipes table.
+    Both variants share recipe_key so cursors stay valid between them.
+    """
+    popular = db.session.query(Follow.followed_id).filter(
+        Follow.follower_id == user.id,
+        Follow.followed_id.in_(TimelineEntry.popular_authors())).all()
+    if not popular:
+        query = Recipe.query.join(
+            TimelineEntry, TimelineEntry.recipe_id == Recipe.id
+        ).filter(TimelineEntry.user_id == user.id)
+        return (recipe_listing(query),
+                (TimelineEntry.timestamp, TimelineEntry.recipe_id))
+    timeline = db.session.query(TimelineEntry.recipe_id).filter(
+        TimelineEntry.user_id == user.id)
+    query = Recipe.query.filter(or_(
+        Recipe.id.in_(timeline.subquery()),
+        Recipe.author_id.in_([author_id for (author_id,) in popular])))
+    return recipe_listing(query), (Recipe.timestamp, Recipe.id)
+
+
+def pantry_key(item):
+    recipe, matches = item
+    return (matches, recipe.id)
+
+
+def pantry_search(names):
+    """
+    Recipes using any of the ingredients in ``names``, as (recipe, matches)
+    rows ranked by how many of them each recipe uses.
+
+    The counts come from the (ingredient_id, recipe_id) index on
+    recipeingredients, which acts as an inverted index from ingredient to
+    recipes. Returns the query and the columns to paginate it on.
+    """
+    keys = set(Ingredient.normalize(name) for name in names) - set([''])
+    # resolved up front: with a literal id list the planner can tell how
+    # selective the lookup is, with a subquery it may rather walk the
+    # whole (recipe_id, ingredient_id) index to skip sorting the groups
+    ingredient_ids = [ingredient_id for (ingredient_id,) in
+                      db.session.query(Ingredient.id)
+                      .filter(Ingredient.key.in_(list(keys)))]
+    matches = db.session.query(
+        RecipeIngredient.recipe_id.label('recipe_id'),
+        db.func.count(db.distinct(RecipeIngredient.ingredient_id))
+        .label('matches')
+    ).filter(RecipeIngredient.ingredient_id.in_(ingredient_ids))\
+        .group_by(RecipeIngredient.recipe_id).subquery()
+    query = recipe_listing(
+        Recipe.query.join(matches, matches.c.recipe_id == Recipe.id)
+    ).add_columns(matches.c.matches)
+    return query, (matches.c.matches, Recipe.id)
+
+
+def ingredient_lines(recipe_ids):
+    """
+    (recipe_id, amount, units, name) rows of the recipes in ``recipe_ids``,
+    in the order the lines were written, with the canonical names joined
+    in instead of loaded one Ingredient at a time. Lines without an
+    ingredient, e.g. a blank name, are kept with an empty one.
+    """
+    return db.session.query(RecipeIngredient.recipe_id,
+                            RecipeIngredient.amount, RecipeIngredient.units,
+                            db.func.coalesce(Ingredient.name, '')
+                            .label('name'))\
+        .outerjoin(Ingredient,
+                   Ingredient.id == RecipeIngredient.ingredient_id)\
+        .filter(RecipeIngredient.recipe_id.in_(list(recipe_ids)))\
+        .order_by(RecipeIngredient.recipe_id, RecipeIngredient.id)
+
+
+def step_bodies(recipe_ids):
+    """(recipe_id, body) rows of the recipes in ``recipe_ids``, in order."""
+    return db.session.query(RecipeStep.recipe_id, RecipeStep.body)\
+        .filter(RecipeStep.recipe_id.in_(list(recipe_ids)))\
+        .order_by(RecipeStep.recipe_id, RecipeStep.id)
+
+
+IngredientLine = namedtuple('IngredientLine', 'amount units name')
+
+
+class RecipeDetail(namedtuple('RecipeDetail', 'recipe ingredients steps')):
+    """
+    What _recipe.html renders of a recipe: the recipe with its author,
+    its ingredient lines as IngredientLine tuples and its steps as
+    strings. Other attributes are read from the recipe.
+
+    The recipe's own ``ingredients`` and ``steps`` are dynamic queries,
+    iterating them from the template took a query per line to get at the
+    ingredient names; load() takes two whatever the size of the recipe.
+    """
+    __slots__ = ()
+
+
+    @classmethod
+    def load(cls, recipe):
+        """
+        The detail of ``recipe``, which should be queried with
+        joinedload(Recipe.author) to keep the author out of the count.
+        """
+        ingredients = tuple(IngredientLine(amount, units, name)
+                            for _, amount, units, name in
+                            ingredient_lines([recipe.id]))
+        steps = tuple(body for _, body in step_bodies([recipe.id]))
+        return cls(recipe, ingredients, steps)
+
+
+    def __getattr__(self, name):
+        return getattr(self.recipe, name)
+
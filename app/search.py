@@ -0,0 +1,145 @@
+"""
+Full-text recipe search backed by an SQLite FTS5 table.
+
+recipe_search holds one document per recipe, keyed by rowid = recipes.id,
+with its title, description, step bodies and ingredient names. Mapper
+events record which recipes a flush touched and the session's after_flush
+hook rewrites their documents on the same connection, so the index
+commits or rolls back together with the rows it was built from.
+"""
+import re
+from sqlalchemy import event, DDL, select, text, literal_column, false
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.sql import table, column
+from . import db
+from .models import Recipe, RecipeStep, RecipeIngredient, Ingredient
+from .queries import recipe_listing
+
+
+search_index = table('recipe_search', column('rowid'), column('title'),
+                     column('description'), column('steps'),
+                     column('ingredients'))
+
+# bm25 column weights: title, description, steps, ingredients
+RANK = literal_column('bm25(recipe_search, 10.0, 2.0, 1.0, 4.0)')
+TOKEN_REGEX = re.compile(r'\w+', re.UNICODE)
+_DIRTY_KEY = 'stockpot.search_dirty'
+
+
+event.listen(db.metadata, 'after_create', DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS recipe_search USING fts5("
+    "title, description, steps, ingredients, "
+    "tokenize='porter unicode61')").execute_if(dialect='sqlite'))
+event.listen(db.metadata, 'before_drop', DDL(
+    'DROP TABLE IF EXISTS recipe_search').execute_if(dialect='sqlite'))
+
+
+def documents(recipe_ids=None):
+    """Select (id, title, description, steps, ingredients) documents."""
+    steps = select([db.func.group_concat(RecipeStep.body, ' ')])\
+        .where(RecipeStep.recipe_id == Recipe.id).as_scalar()
+    ingredients = select([db.func.group_concat(Ingredient.name, ' ')])\
+        .select_from(RecipeIngredient.__table__.join(Ingredient.__table__))\
+        .where(RecipeIngredient.recipe_id == Recipe.id).as_scalar()
+    query = select([Recipe.id, Recipe.title, Recipe.description,
+                    steps, ingredients])
+    if recipe_ids is not None:
+        query = query.where(Recipe.id.in_(recipe_ids))
+    return query
+
+
+def reindex(connection, recipe_ids):
+    """Rewrite the documents of ``recipe_ids``, dropping deleted recipes."""
+    recipe_ids = list(recipe_ids)
+    connection.execute(search_index.delete().where(
+        search_index.c.rowid.in_(recipe_ids)))
+    connection.execute(search_index.insert().from_select(
+        ['rowid', 'title', 'description', 'steps', 'ingredients'],
+        documents(recipe_ids)))
+
+
+def rebuild(batch_size=1000):
+    """Reindex every recipe, committing after each batch of ids."""
+    db.session.execute(search_index.delete())
+    last_id = 0
+    while True:
+        ids = [recipe_id for (recipe_id,) in db.session.query(Recipe.id)
+               .filter(Recipe.id > last_id).order_by(Recipe.id)
+               .limit(batch_size)]
+        if not ids:
+            break
+        db.session.execute(search_index.insert().from_select(
+            ['rowid', 'title', 'description', 'steps', 'ingredients'],
+            documents(ids)))
+        db.session.commit()
+        last_id = ids[-1]
+    # merge the b-tree segments the batches left behind
+    db.session.execute(text(
+        "INSERT INTO recipe_search(recipe_search) VALUES('optimize')"))
+    db.session.commit()
+
+
+def match_expression(terms):
+    """Turn free text into an FTS5 query matching every word as a prefix."""
+    return ' '.join('"{}"*'.format(token)
+                    for token in TOKEN_REGEX.findall(terms))
+
+
+def search(terms):
+    """
+    Recipes matching ``terms`` as (recipe, rank) rows, best match first.
+
+    Returns the query along with the columns to paginate it on in
+    ascending order, bm25 scores being lower for better matches. Terms
+    without a single word match nothing, FTS5 rejects an empty MATCH.
+    """
+    expression = match_expression(terms)
+    condition = text('recipe_search MATCH :match')\
+        .bindparams(match=expression) if expression else false()
+    hits = select([search_index.c.rowid.label('recipe_id'),
+                   RANK.label('rank')])\
+        .select_from(search_index).where(condition).alias('hits')
+    query = recipe_listing(Recipe.query.join(
+        hits, hits.c.recipe_id == Recipe.id)).add_columns(hits.c.rank)
+    return query, (hits.c.rank, Recipe.id)
+
+
+def search_key(item):
+    recipe, rank = item
+    return (rank, recipe.id)
+
+
+def _mark(target, *recipe_ids):
+    session = object_session(target)
+    if session is not None:
+        dirty = session.info.setdefault(_DIRTY_KEY, set())
+        dirty.update(recipe_id for recipe_id in recipe_ids
+                     if recipe_id is not None)
+
+
+@event.listens_for(Recipe, 'after_insert')
+@event.listens_for(Recipe, 'after_update')
+@event.listens_for(Recipe, 'after_delete')
+def _recipe_changed(mapper, connection, target):
+    _mark(target, target.id)
+
+
+@event.listens_for(RecipeStep, 'after_insert')
+@event.listens_for(RecipeStep, 'after_update')
+@event.listens_for(RecipeStep, 'after_delete')
+@event.listens_for(RecipeIngredient, 'after_insert')
+@event.listens_for(RecipeIngredient, 'after_update')
+@event.listens_for(RecipeIngredient, 'after_delete')
+def _line_changed(mapper, connection, target):
+    # a line moved off a recipe leaves that recipe's document stale too
+    _mark(target, target.recipe_id, *get_history(target, 'recipe_id').deleted)
+
+
+@event.listens_for(Session, 'after_flush')
+def _reindex_dirty(session, flush_context):
+    dirty = session.info.pop(_DIRTY_KEY, None)
+    if dirty:
+        connection = session.connection()
+        if connection.dialect.name == 'sqlite':
+            reindex(connection, dirty)
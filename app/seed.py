@@ -0,0 +1,286 @@
+"""
+Bulk synthetic data for load testing.
+
+Seeder streams users, follows, recipes with their ingredient lines and
+steps, and comments into the database as batched executemany INSERTs,
+without going through the ORM or its mapper events. Ids are assigned up
+front so child rows never need to be read back, every random choice comes
+from a single random.Random(seed) and timestamps are laid out from a fixed
+start date, so the same arguments always produce the same data. The
+counters and search documents the mapper events would have maintained are
+written alongside the rows, and the timelines are rebuilt at the end.
+"""
+import hashlib
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import select, bindparam
+from werkzeug.security import generate_password_hash
+from flask import current_app
+from . import db
+from .models import (User, Role, Follow, Recipe, RecipeStep,
+                     RecipeIngredient, Ingredient, Comment, TimelineEntry)
+from .search import search_index
+
+
+WORDS = (
+    'bake', 'baste', 'blanch', 'blend', 'boil', 'braise', 'broil', 'brown',
+    'caramelize', 'chill', 'chop', 'coat', 'combine', 'cool', 'cover',
+    'crisp', 'crush', 'cube', 'dice', 'drain', 'drizzle', 'dust', 'fold',
+    'fry', 'garnish', 'glaze', 'grate', 'grill', 'knead', 'layer', 'marinate',
+    'mash', 'melt', 'mince', 'mix', 'peel', 'poach', 'pour', 'preheat',
+    'reduce', 'rest', 'roast', 'roll', 'saute', 'season', 'sear', 'serve',
+    'shred', 'sift', 'simmer', 'skim', 'slice', 'soak', 'spread', 'sprinkle',
+    'steam', 'stir', 'strain', 'stuff', 'toast', 'toss', 'whisk', 'the',
+    'a', 'with', 'until', 'golden', 'tender', 'smooth', 'bowl', 'pan',
+    'skillet', 'oven', 'pot', 'heat', 'minutes', 'gently', 'evenly', 'over',
+    'into', 'and', 'then', 'fresh', 'warm', 'hot', 'cold', 'crispy', 'rich',
+    'spicy', 'sweet', 'savory', 'quick', 'easy', 'classic', 'homemade',
+    'delicious', 'perfect', 'favorite', 'weeknight', 'family', 'sauce',
+    'soup', 'stew', 'salad', 'pie', 'bread', 'cake', 'curry', 'pasta')
+FOODS = (
+    'apple', 'bacon', 'basil', 'bean', 'beef', 'broccoli', 'butter',
+    'cabbage', 'carrot', 'celery', 'cheddar', 'chicken', 'chickpea', 'chili',
+    'chocolate', 'cilantro', 'cinnamon', 'coconut', 'corn', 'cream',
+    'cucumber', 'cumin', 'egg', 'eggplant', 'flour', 'garlic', 'ginger',
+    'honey', 'kale', 'leek', 'lemon', 'lentil', 'lime', 'milk', 'mint',
+    'mushroom', 'mustard', 'noodle', 'oat', 'olive', 'onion', 'orange',
+    'oregano', 'paprika', 'parsley', 'pea', 'pepper', 'pork', 'potato',
+    'rice', 'salmon', 'salt', 'shrimp', 'spinach', 'sugar', 'thyme', 'tofu',
+    'tomato', 'vinegar', 'yogurt')
+VARIETIES = ('', 'fresh', 'dried', 'ground', 'smoked', 'red', 'green',
+             'wild', 'roasted')
+CITIES = ('Portland', 'Austin', 'Chicago', 'Boston', 'Denver', 'Seattle',
+          'Atlanta', 'Detroit', 'Oakland', 'Memphis')
+PASSWORD = 'password'
+
+
+class Seeder(object):
+    """
+    Generates ``users`` users following ``follows`` others each, about
+    ``recipes`` recipes and ``comments`` comments, writing ``batch_size``
+    parent rows (and their children) per transaction.
+    """
+    def __init__(self, users=1000, follows=20, recipes=10000, comments=50000,
+                 batch_size=5000, seed=0, start=datetime(2015, 1, 1),
+                 days=730):
+        self.users = users
+        self.follows = min(follows, users - 1)
+        self.recipes = recipes
+        self.comments = comments
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.start = start
+        self.span = timedelta(days=days).total_seconds()
+        self.search = db.engine.dialect.name == 'sqlite'
+        self.pool = [self.random.choice(WORDS) for _ in range(1 << 16)]
+
+
+    def run(self, log=lambda message: None):
+        self.first_user = self._next_id(User)
+        self.followers = [0] * self.users
+        self.followed = [0] * self.users
+        self.authored = [0] * self.users
+        log('Seeding {} users and their follows...'.format(self.users))
+        self._batches(self.user_rows(), User.__table__)
+        self._batches(self.follow_rows(), Follow.__table__)
+        log('Seeding ingredients...')
+        self.ingredients = self.ingredient_rows()
+        log('Seeding {} recipes and about {} comments...'.format(
+            self.recipes, self.comments))
+        self._batches(self.recipe_rows(), Recipe.__table__)
+        log('Writing counters...')
+        self.write_counters()
+        log('Rebuilding timelines...')
+        TimelineEntry.rebuild()
+
+
+    def user_rows(self):
+        rng = self.random
+        users = User.__table__
+        password_hash = generate_password_hash(PASSWORD)
+        role = Role.query.filter_by(default=True).first()
+        for i in range(self.users):
+            user_id = self.first_user + i
+            email = 'cook{}@example.com'.format(user_id)
+            joined = self._moment(i, self.users)
+            yield users, {
+                'id': user_id,
+                'email': email,
+                'username': 'cook{}'.format(user_id),
+                'role_id': role.id if role else None,
+                'password_hash': password_hash,
+                'confirmed': True,
+                'name': '{} {}'.format(rng.choice(FOODS).title(),
+                                       rng.choice(WORDS).title()),
+                'location': rng.choice(CITIES),
+                'about_me': self.sentence(),
+                'member_since': joined,
+                'last_seen': joined + timedelta(days=rng.randint(0, 365)),
+                'avatar_hash': hashlib.md5(email.encode('utf-8')).hexdigest()}
+
+
+    def follow_rows(self):
+        follows = Follow.__table__
+        for i in range(self.users):
+            # everybody follows themselves, see User.add_self_follows
+            followed = set([i])
+            while len(followed) <= self.follows:
+                followed.add(self._popular(self.users))
+            self.followed[i] += len(followed)
+            for j in sorted(followed):
+                self.followers[j] += 1
+                yield follows, {
+                    'follower_id': self.first_user + i,
+                    'followed_id': self.first_user + j,
+                    'timestamp': self._moment(i, self.users)}
+
+
+    def ingredient_rows(self):
+        names = [' '.join(filter(None, (variety, food)))
+                 for food in FOODS for variety in VARIETIES]
+        ingredients = sorted((i.id, i.name) for i in
+                             Ingredient.get_or_create(names).values())
+        db.session.commit()
+        return ingredients
+
+
+    def recipe_rows(self):
+        rng = self.random
+        recipes = Recipe.__table__
+        lines, steps = RecipeIngredient.__table__, RecipeStep.__table__
+        comments = Comment.__table__
+        next_line = self._next_id(RecipeIngredient)
+        next_step = self._next_id(RecipeStep)
+        next_comment = self._next_id(Comment)
+        first_recipe = self._next_id(Recipe)
+        default_img = current_app.config['STOCKPOT_DEFAULT_IMG']
+        units = current_app.config['RECIPE_UNITS']
+        mean_comments = float(self.comments) / max(self.recipes, 1)
+        for i in range(self.recipes):
+            recipe_id = first_recipe + i
+            author = rng.randrange(self.users)
+            self.authored[author] += 1
+            timestamp = self._moment(i, self.recipes)
+            title = self.sentence(2, 5).rstrip('.').title()[:64]
+            description = self.sentence(8, 30)
+            used = rng.sample(self.ingredients,
+                              rng.randint(1, Recipe.INGREDIENT_LIMIT))
+            bodies = [self.sentence(6, 20)
+                      for _ in range(rng.randint(1, Recipe.STEP_LIMIT))]
+            count = int(rng.expovariate(1 / mean_comments) + 0.5) \
+                if mean_comments else 0
+            prep_time = timedelta(minutes=5 * rng.randint(1, 12))
+            cook_time = timedelta(minutes=5 * rng.randint(0, 36))
+            row = {
+                'id': recipe_id,
+                'title': title,
+                'timestamp': timestamp,
+                'img_filename': default_img,
+                'author_id': self.first_user + author,
+                'prep_time': prep_time,
+                'cook_time': cook_time,
+                'description': description,
+                'comments_count': count}
+            row.update(Recipe.time_columns(prep_time, cook_time))
+            yield recipes, row
+            for ingredient_id, _ in used:
+                yield lines, {
+                    'id': next_line,
+                    'amount': rng.randint(1, 8) / 2.0,
+                    'units': rng.choice(units),
+                    'ingredient_id': ingredient_id,
+                    'recipe_id': recipe_id}
+                next_line += 1
+            for body in bodies:
+                yield steps, {'id': next_step, 'body': body,
+                              'recipe_id': recipe_id}
+                next_step += 1
+            for _ in range(count):
+                body = self.sentence(3, 40)
+                yield comments, {
+                    'id': next_comment,
+                    'body': body,
+                    # plain words render to themselves, see app/markup.py
+                    'body_html': body,
+                    'timestamp': timestamp + timedelta(
+                        seconds=rng.randint(60, 30 * 86400)),
+                    'disabled': rng.random() < 0.01,
+                    'author_id': self.first_user + rng.randrange(self.users),
+                    'recipe_id': recipe_id}
+                next_comment += 1
+            if self.search:
+                yield search_index, {
+                    'rowid': recipe_id,
+                    'title': title,
+                    'description': description,
+                    'steps': ' '.join(bodies),
+                    'ingredients': ' '.join(name for _, name in used)}
+
+
+    def write_counters(self):
+        users = User.__table__
+        rows = [{'user_id': self.first_user + i,
+                 'followers': self.followers[i],
+                 'followed': self.followed[i],
+                 'recipes': self.authored[i]} for i in range(self.users)]
+        statement = users.update().where(users.c.id == bindparam('user_id'))\
+            .values(followers_count=bindparam('followers'),
+                    followed_count=bindparam('followed'),
+                    recipes_count=bindparam('recipes'))
+        for start in range(0, len(rows), self.batch_size):
+            with db.engine.begin() as connection:
+                connection.execute(statement,
+                                   rows[start:start + self.batch_size])
+
+
+    def sentence(self, low=4, high=16):
+        # slices of a fixed pool of random words, two draws per sentence
+        size = self.random.randint(low, high)
+        offset = self.random.randrange(len(self.pool) - size)
+        return ' '.join(self.pool[offset:offset + size]).capitalize() + '.'
+
+
+    def _popular(self, n):
+        # a power law skew gives a handful of users most of the followers
+        return int(n * self.random.random() ** 3)
+
+
+    def _moment(self, i, n):
+        """Spread ``n`` rows evenly over the seeded period, in id order."""
+        return self.start + timedelta(seconds=self.span * i / max(n, 1))
+
+
+    @staticmethod
+    def _next_id(model):
+        table = model.__table__
+        return (db.session.scalar(select([db.func.max(table.c.id)])) or 0) + 1
+
+
+    def _batches(self, rows, parent):
+        """
+        Insert a stream of (table, row) pairs, committing every
+        batch_size rows of ``parent`` along with their children.
+        """
+        pending = {}
+        parents = 0
+        for table, row in rows:
+            pending.setdefault(table, []).append(row)
+            if table is parent:
+                parents += 1
+                if parents % self.batch_size == 0:
+                    self._flush(pending)
+        self._flush(pending)
+
+
+    def _flush(self, pending):
+        # parents first so the foreign keys of their children resolve
+        with db.engine.begin() as connection:
+            for table in sorted(pending, key=_INSERT_ORDER.index):
+                if pending[table]:
+                    connection.execute(table.insert(), pending[table])
+                    del pending[table][:]
+
+
+_INSERT_ORDER = [User.__table__, Follow.__table__, Recipe.__table__,
+                 RecipeIngredient.__table__, RecipeStep.__table__,
+                 Comment.__table__, search_index]
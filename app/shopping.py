@@ -0,0 +1,83 @@
+"""
+Shopping lists: the ingredients of a set of recipes added up.
+
+One grouped query over recipeingredients does the work. Each line is
+converted to teaspoons in SQL, with a CASE over its units, so lines in
+cups, tablespoons and teaspoons of the same canonical ingredient sum into
+a single row. Units without a conversion are summed on their own. Python
+only picks the unit each total reads best in, once per ingredient.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import case, literal, select
+from . import db
+from .models import Recipe, RecipeIngredient, Ingredient, Follow
+
+
+# teaspoons in each of the volume units of RECIPE_UNITS
+TEASPOONS = {'tsp': 1, 'tbsp': 3, 'cup': 48}
+# a total is shown in the largest unit it makes at least this many
+# teaspoons of, e.g. 1/4 cup rather than 4 tbsp
+DISPLAY_UNITS = (('cup', 12), ('tbsp', 3), ('tsp', 0))
+
+ShoppingItem = namedtuple('ShoppingItem', 'name amount units recipes')
+
+
+def followed_recipes(user, days=7):
+    """
+    Ids of the recipes by the users ``user`` follows, themselves
+    included, from the last ``days`` days, as a subquery for
+    shopping_list. Walks ix_recipes_author_timestamp once per author.
+    """
+    since = datetime.utcnow() - timedelta(days=days)
+    followed = db.session.query(Follow.followed_id).filter(
+        Follow.follower_id == user.id)
+    return db.session.query(Recipe.id).filter(
+        Recipe.author_id.in_(followed.subquery()),
+        Recipe.timestamp >= since).subquery()
+
+
+def totals(recipe_ids):
+    """
+    The grouped query: (ingredient_id, name, units, amount, recipes)
+    rows, ``amount`` in teaspoons when ``units`` is 'tsp'. ``recipe_ids``
+    is a list of ids or a subquery selecting them.
+    """
+    lines = RecipeIngredient.__table__
+    ingredients = Ingredient.__table__
+    converted = case([(lines.c.units == units, lines.c.amount * tsp)
+                      for units, tsp in TEASPOONS.items()],
+                     else_=lines.c.amount)
+    family = case([(lines.c.units.in_(list(TEASPOONS)), literal('tsp'))],
+                  else_=lines.c.units)
+    return select([
+        ingredients.c.id, ingredients.c.name, family.label('units'),
+        db.func.sum(converted).label('amount'),
+        db.func.count(db.distinct(lines.c.recipe_id)).label('recipes')
+    ]).select_from(lines.join(ingredients))\
+        .where(lines.c.recipe_id.in_(recipe_ids))\
+        .group_by(ingredients.c.id, ingredients.c.name, ingredients.c.key,
+                  family)\
+        .order_by(ingredients.c.key, family)
+
+
+def readable(amount, units):
+    """A total in teaspoons as (amount, units) in the unit it reads best."""
+    if units != 'tsp':
+        return amount, units
+    for name, threshold in DISPLAY_UNITS:
+        if amount >= threshold:
+            return amount / TEASPOONS[name], name
+    return amount, units
+
+
+def shopping_list(recipe_ids):
+    """ShoppingItems for the recipes in ``recipe_ids``, A to Z."""
+    if isinstance(recipe_ids, (list, tuple, set)) and not recipe_ids:
+        return []
+    items = []
+    for _, name, units, amount, recipes in db.session.execute(
+            totals(recipe_ids)):
+        amount, units = readable(amount or 0, units)
+        items.append(ShoppingItem(name, round(amount, 2), units, recipes))
+    return items
@@ -19,8 +19,9 @@ $(function(){
             }
             // reset input elements
             if($(elt).is('input')){
-                // csrf token have type hidden and we don't want to reset them
-                if(elt.type !== 'hidden'){
+                // csrf token have type hidden and we don't want to reset
+                // them, the row ids are cleared so the copy is a new line
+                if(elt.type !== 'hidden' || /line_id$/.test(elt.name)){
                     $(elt).val('');
                 }
             }
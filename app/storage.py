@@ -0,0 +1,88 @@
+"""
+Content addressed storage for recipe images.
+
+store_upload hashes an upload while copying it to disk and files it under
+its SHA-256, so the same photo uploaded twice is stored once. How many
+recipes use each file is counted in the images table (StoredImage); the
+file and its resized variants are removed after the transaction that
+drops the last reference commits, by image_sweeper in app/images.py. A
+name never changes content, so those URLs are served with far-future,
+immutable cache headers by main.image.
+"""
+import glob
+import hashlib
+import os
+import re
+import tempfile
+from flask import url_for
+from flask_uploads import UploadNotAllowed, extension
+from . import recipe_imgs
+
+
+CHUNK_SIZE = 64 * 1024
+VARIANT_FOLDER = 'variants'
+# 'ab/ab12...ef.jpg' and its variants 'variants/ab/ab12...ef.320w.jpeg'
+ADDRESS_REGEX = re.compile(
+    r'^(?:{}/)?[0-9a-f]{{2}}/[0-9a-f]{{64}}\.'.format(VARIANT_FOLDER))
+
+
+def store_upload(storage, upload_set=recipe_imgs):
+    """Save a FileStorage under the hash of its content, return its name."""
+    ext = extension(storage.filename).lower()
+    if not upload_set.extension_allowed(ext):
+        raise UploadNotAllowed()
+    destination = upload_set.config.destination
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+    digest = hashlib.sha256()
+    fd, partial = tempfile.mkstemp(suffix='.part', dir=destination)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+        address = digest.hexdigest()
+        name = '{}/{}.{}'.format(address[:2], address, ext)
+        path = upload_set.path(name)
+        if os.path.exists(path):
+            os.remove(partial)
+            # fresh again, the sweeper leaves young files alone
+            os.utime(path, None)
+        else:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            os.rename(partial, path)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return name
+
+
+def is_content_addressed(filename):
+    return filename is not None and ADDRESS_REGEX.match(filename) is not None
+
+
+def image_url(filename):
+    if is_content_addressed(filename):
+        return url_for('main.image', filename=filename)
+    return recipe_imgs.url(filename)
+
+
+def variant_name(filename, width, ext):
+    stem = os.path.splitext(filename)[0]
+    return '{}/{}.{}w.{}'.format(VARIANT_FOLDER, stem, width, ext)
+
+
+def remove_image_files(filename):
+    """Delete an upload and every resized variant made from it."""
+    path = recipe_imgs.path(filename)
+    stem = os.path.splitext(filename)[0]
+    variants = glob.glob(recipe_imgs.path('{}/{}.*w.*'.format(
+        VARIANT_FOLDER, glob.escape(stem))))
+    for path in [path] + variants:
+        if os.path.exists(path):
+            os.remove(path)
@@ -4,6 +4,7 @@ Creates an instance of the stockpot app for use by the flask cli tool.
 """
 
 import os
+import click
 from app import create_app
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
@@ -16,3 +17,137 @@ def test():
     tests = unittest.TestLoader().discover('tests')
     unittest.TextTestRunner(verbosity=2).run(tests)
 
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Recompute every followed-feed timeline from scratch."""
+    from app.models import TimelineEntry
+    TimelineEntry.rebuild()
+
+
+@app.cli.command()
+def recount():
+    """Recompute the follower, recipe and comment counters."""
+    from app import models
+    models.recount()
+
+
+@app.cli.command('dedupe-ingredients')
+def dedupe_ingredients():
+    """Merge ingredients whose names only differ in case or spacing."""
+    from app.models import Ingredient
+    merged = Ingredient.merge_duplicates()
+    click.echo('Merged {} duplicate ingredients.'.format(merged))
+
+
+@app.cli.command('backfill-times')
+@click.option('--batch-size', default=1000,
+              help='Recipes read and written per transaction.')
+def backfill_times(batch_size):
+    """Fill the prep, cook and total seconds of every recipe."""
+    from app.models import Recipe
+    changed = Recipe.backfill_times(batch_size)
+    click.echo('Updated {} recipes.'.format(changed))
+
+
+@app.cli.command()
+@click.option('--batch-size', default=1000,
+              help='Recipes indexed per transaction.')
+def reindex(batch_size):
+    """Rebuild the full-text recipe search index."""
+    from app import search
+    search.rebuild(batch_size)
+
+
+@app.cli.command()
+@click.option('--users', default=1000, help='Users to create.')
+@click.option('--follows', default=20, help='Users each new user follows.')
+@click.option('--recipes', default=10000, help='Recipes to create.')
+@click.option('--comments', default=50000,
+              help='Comments to create, spread unevenly over the recipes.')
+@click.option('--batch-size', default=5000,
+              help='Users or recipes written per transaction.')
+@click.option('--seed', default=0, help='Random seed, same seed same data.')
+def seed(users, follows, recipes, comments, batch_size, seed):
+    """Fill the database with synthetic data for load testing."""
+    import time
+    from app.models import Role
+    from app.seed import Seeder, PASSWORD
+    started = time.time()
+    Role.insert_roles()
+    Seeder(users, follows, recipes, comments, batch_size, seed).run(click.echo)
+    click.echo('Done in {:.1f}s, every user\'s password is "{}".'.format(
+        time.time() - started, PASSWORD))
+
+
+@app.cli.command()
+def explain():
+    """Print the query plans of the main views and flag full scans."""
+    from app.explain import view_plans
+    scans = 0
+    for name, plan in view_plans():
+        click.echo(name)
+        for line, full_scan in plan:
+            click.echo('  {} {}'.format('!' if full_scan else ' ', line))
+            scans += full_scan
+    if scans:
+        raise click.ClickException(
+            '{} full table scans, marked with !'.format(scans))
+
+
+@app.cli.command('rerender-comments')
+@click.option('--batch-size', default=1000,
+              help='Comments read and written per round trip.')
+@click.option('--processes', default=None, type=int,
+              help='Rendering processes, one per CPU by default.')
+def rerender_comments(batch_size, processes):
+    """Render the HTML of every comment again."""
+    from app.models import Comment
+    from app.fragments import fragment_cache
+    changed = Comment.rerender(batch_size, processes)
+    if changed:
+        # written without the ORM, no change events retire the fragments;
+        # this reaches a shared backend, per process ones expire by TTL
+        fragment_cache.clear()
+    click.echo('Updated {} comments.'.format(changed))
+
+
+@app.cli.command()
+@click.option('--deliver', is_flag=True,
+              help='Send the messages that are due right away.')
+def outbox(deliver):
+    """Show how many emails are waiting to be sent."""
+    from app.email import mail_queue
+    if deliver:
+        while mail_queue.deliver():
+            pass
+    click.echo('{} messages waiting.'.format(mail_queue.depth()))
+
+
+@app.cli.command('image-variants')
+@click.option('--all', 'everything', is_flag=True,
+              help='Revisit every image, e.g. after changing the widths.')
+def image_variants(everything):
+    """Generate the missing resized copies of recipe images."""
+    from app import db
+    from app.models import Recipe
+    from app.images import image_pipeline
+    if everything:
+        Recipe.query.update({Recipe.img_variants: None})
+        db.session.commit()
+    count = image_pipeline.backfill()
+    click.echo('Processed {} images.'.format(count))
+
+
+@app.cli.command('sweep-images')
+@click.option('--dry-run', is_flag=True,
+              help='List the unreferenced files without deleting them.')
+def sweep_images(dry_run):
+    """Delete uploaded image files no recipe refers to."""
+    from app.images import image_sweeper
+    names = image_sweeper.sweep(dry_run=dry_run)
+    for name in names:
+        click.echo(name)
+    click.echo('{} {} files.'.format(
+        'Found' if dry_run else 'Removed', len(names)))
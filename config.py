@@ -19,6 +19,64 @@ class Config:
     STOCKPOT_RECIPES_PER_PAGE = 24
     STOCKPOT_FOLLOWERS_PER_PAGE = 24
     STOCKPOT_COMMENTS_PER_PAGE = 24
+    # authors with more followers than this are not fanned out to timelines,
+    # their recipes are merged into followed feeds at read time instead
+    STOCKPOT_TIMELINE_FANOUT_LIMIT = 1000
+    # followed id sets kept in memory for User.is_following, per process
+    STOCKPOT_FOLLOW_CACHE_SIZE = 10000
+    STOCKPOT_FOLLOW_CACHE_TTL = 300
+    # User.last_seen is updated at most once per granularity (seconds) and
+    # written in batches, whichever of the interval or size is hit first
+    STOCKPOT_LAST_SEEN_GRANULARITY = 60
+    STOCKPOT_LAST_SEEN_FLUSH_INTERVAL = 10
+    STOCKPOT_LAST_SEEN_FLUSH_SIZE = 500
+    # snapshots of logged in users and their roles for the user loader
+    STOCKPOT_USER_CACHE_SIZE = 10000
+    STOCKPOT_USER_CACHE_TTL = 30
+    # rendered Markdown kept per process, keyed by the source text
+    STOCKPOT_MARKUP_CACHE_SIZE = 4096
+    # outbox delivery: worker threads per process, messages per SMTP
+    # connection, and retries doubling from the delay (seconds)
+    STOCKPOT_MAIL_WORKERS = 2
+    STOCKPOT_MAIL_BATCH_SIZE = 50
+    STOCKPOT_MAIL_MAX_ATTEMPTS = 8
+    STOCKPOT_MAIL_RETRY_DELAY = 30
+    STOCKPOT_MAIL_POLL_INTERVAL = 60
+    # widths (px) of the resized recipe images, made by a thread pool
+    STOCKPOT_IMG_WIDTHS = (320, 640, 1280)
+    STOCKPOT_IMG_WORKERS = 2
+    # files no recipe uses: swept every interval (seconds, 0 = only on
+    # demand) once older than the grace period, a batch at a time with a
+    # pause in between to go easy on the disk
+    STOCKPOT_IMG_SWEEP_INTERVAL = 6 * 60 * 60
+    STOCKPOT_IMG_SWEEP_GRACE = 60 * 60
+    STOCKPOT_IMG_SWEEP_BATCH_SIZE = 100
+    STOCKPOT_IMG_SWEEP_PAUSE = 0.5
+    # files released by a commit younger than this (seconds) are left to
+    # the sweep, an upload of the same bytes may be about to reuse them
+    STOCKPOT_IMG_REMOVE_MIN_AGE = 5 * 60
+    # rendered template fragments: 'memory' is per process and bounded by
+    # the TTL (seconds), 'filesystem' is shared by the workers of a host
+    STOCKPOT_FRAGMENT_CACHE = 'memory'
+    STOCKPOT_FRAGMENT_CACHE_SIZE = 10000
+    STOCKPOT_FRAGMENT_CACHE_TTL = 300
+    STOCKPOT_FRAGMENT_CACHE_DIR = os.path.join(basedir, 'tmp', 'fragments')
+    # avatars: 'identicon' draws them here, 'gravatar' fetches them (with
+    # a timeout in seconds) and keeps them for MAX_AGE seconds
+    STOCKPOT_AVATAR_MODE = 'identicon'
+    STOCKPOT_AVATAR_DIR = os.path.join(basedir, 'tmp', 'avatars')
+    STOCKPOT_AVATAR_MAX_AGE = 24 * 60 * 60
+    STOCKPOT_AVATAR_FETCH_TIMEOUT = 2
+    # JSON API: items per page by default and at most, ids per batched
+    # GET, and how long tokens last (seconds)
+    STOCKPOT_API_PER_PAGE = 50
+    STOCKPOT_API_MAX_PER_PAGE = 500
+    STOCKPOT_API_MAX_IDS = 100
+    STOCKPOT_API_TOKEN_EXPIRATION = 3600
+    # recipes one shopping list adds up at most, see app/shopping.py
+    STOCKPOT_SHOPPING_MAX_RECIPES = 500
+    # ingredients one pantry search looks for at most
+    STOCKPOT_PANTRY_MAX_INGREDIENTS = 50
 
     @staticmethod
     def init_app(app):
@@ -34,6 +92,11 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False
+    STOCKPOT_LAST_SEEN_FLUSH_SIZE = 1
+    STOCKPOT_MAIL_WORKERS = 0
+    STOCKPOT_IMG_WORKERS = 0
+    STOCKPOT_IMG_SWEEP_INTERVAL = 0
+    STOCKPOT_IMG_REMOVE_MIN_AGE = 0
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
 
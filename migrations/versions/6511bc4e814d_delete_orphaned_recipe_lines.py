@@ -0,0 +1,29 @@
+"""delete orphaned recipe lines
+
+Revision ID: 6511bc4e814d
+Revises: c85338cd9028
+Create Date: 2026-10-17 12:01:50.850141
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6511bc4e814d'
+down_revision = 'c85338cd9028'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # edits used to replace a recipe's lines, leaving the old rows behind
+    # with no recipe; update_lines edits in place and the relationships
+    # now cascade, so these are the last of them
+    op.execute('DELETE FROM recipeingredients WHERE recipe_id IS NULL')
+    op.execute('DELETE FROM recipesteps WHERE recipe_id IS NULL')
+
+
+def downgrade():
+    # the rows were unreachable, there is nothing to restore
+    pass
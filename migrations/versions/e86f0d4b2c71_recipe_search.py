@@ -0,0 +1,43 @@
+"""recipe search
+
+Revision ID: e86f0d4b2c71
+Revises: 5a7e2c93f1d8
+Create Date: 2026-10-17 11:31:03.264480
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e86f0d4b2c71'
+down_revision = '5a7e2c93f1d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # full-text index, see app/search.py; search needs SQLite FTS5
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS recipe_search USING fts5("
+               "title, description, steps, ingredients, "
+               "tokenize='porter unicode61')")
+    # index the existing recipes, as flask reindex does
+    op.execute(
+        'INSERT INTO recipe_search '
+        '(rowid, title, description, steps, ingredients) '
+        'SELECT recipes.id, recipes.title, recipes.description, '
+        "(SELECT group_concat(recipesteps.body, ' ') FROM recipesteps "
+        'WHERE recipesteps.recipe_id = recipes.id), '
+        "(SELECT group_concat(ingredients.name, ' ') "
+        'FROM recipeingredients JOIN ingredients '
+        'ON ingredients.id = recipeingredients.ingredient_id '
+        'WHERE recipeingredients.recipe_id = recipes.id) '
+        'FROM recipes')
+    op.execute("INSERT INTO recipe_search(recipe_search) VALUES('optimize')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS recipe_search')
@@ -0,0 +1,137 @@
+import json
+import unittest
+from base64 import b64encode
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role, Recipe, RecipeStep, Comment
+from app.pagination import encode_cursor
+
+
+class APITestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+        self.john = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        self.susan = User(email='susan@example.com', username='susan',
+                          password='dog', confirmed=True)
+        now = datetime.utcnow()
+        self.recipes = [
+            Recipe(title='r{}'.format(i), author=self.john,
+                   img_filename='stockpot.jpeg',
+                   timestamp=now - timedelta(minutes=i),
+                   ingredients=Recipe.build_ingredients(
+                       [(i, 'cup', 'carrots'), (1, 'tsp', 'salt')]),
+                   steps=[RecipeStep(body='boil {}'.format(i))])
+            for i in range(5)]
+        db.session.add_all([self.susan] + self.recipes)
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def token(self, email, password):
+        credentials = b64encode('{}:{}'.format(email, password).encode())
+        response = self.client.post('/api/v1/tokens', headers={
+            'Authorization': 'Basic ' + credentials.decode()})
+        return response
+
+
+    def get(self, url, token=None, status=200):
+        headers = {'Authorization': 'Bearer ' + token} if token else {}
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, status)
+        return json.loads(response.get_data(as_text=True))
+
+
+    def test_token(self):
+        self.assertEqual(self.token('john@example.com', 'dog').status_code,
+                         401)
+        response = self.token('john@example.com', 'cat')
+        token = json.loads(response.get_data(as_text=True))['token']
+        self.get('/api/v1/feed', status=401)
+        self.get('/api/v1/feed', token='garbage', status=401)
+        feed = self.get('/api/v1/feed', token=token)
+        self.assertEqual(len(feed['items']), 5)
+        # confirmation tokens are signed with the same key
+        self.get('/api/v1/feed', status=401,
+                 token=self.john.generate_confirmation_token().decode())
+
+
+    def test_batch_and_fields(self):
+        ids = [self.recipes[3].id, self.recipes[0].id, 999]
+        data = self.get('/api/v1/recipes?ids={}'.format(
+            ','.join(map(str, ids))))
+        self.assertEqual([r['id'] for r in data['items']], ids[:2])
+        self.assertNotIn('next', data)
+
+        data = self.get('/api/v1/recipes?ids={}&fields=title,ingredients,'
+                        'steps'.format(self.recipes[1].id))
+        self.assertEqual(data['items'], [{
+            'title': 'r1', 'steps': ['boil 1'],
+            'ingredients': [
+                {'amount': 1, 'units': 'cup', 'name': 'carrots'},
+                {'amount': 1, 'units': 'tsp', 'name': 'salt'}]}])
+
+        self.get('/api/v1/recipes?ids=1&fields=secret', status=400)
+        self.get('/api/v1/recipes?ids=1,x', status=400)
+        users = self.get('/api/v1/users?ids={}&fields=username'.format(
+            self.susan.id))
+        self.assertEqual(users['items'], [{'username': 'susan'}])
+        self.get('/api/v1/users/999', status=404)
+
+
+    def test_cursor_paging(self):
+        seen, url = [], '/api/v1/users/{}/recipes?limit=2&fields=id'.format(
+            self.john.id)
+        while url:
+            data = self.get(url)
+            seen.extend(r['id'] for r in data['items'])
+            url = data.get('next_url')
+        self.assertEqual(seen, [r.id for r in self.recipes])
+        self.get('/api/v1/recipes?after=bogus', status=400)
+        self.get('/api/v1/recipes?after=' + encode_cursor([None, None]),
+                 status=400)
+
+
+    def test_follow_and_comment(self):
+        token = json.loads(self.token('susan@example.com', 'dog')
+                           .get_data(as_text=True))['token']
+        headers = {'Authorization': 'Bearer ' + token}
+        url = '/api/v1/users/{}/follow'.format(self.john.id)
+        self.assertEqual(self.client.put(url).status_code, 401)
+        self.assertEqual(self.client.put(url, headers=headers).status_code,
+                         204)
+        followers = self.get('/api/v1/users/{}/followers'.format(
+            self.john.id))
+        self.assertEqual([f['follower_id'] for f in followers['items']],
+                         [self.susan.id])
+        self.assertEqual(self.get('/api/v1/users/{}?fields=followers_count'
+                                  .format(self.john.id)),
+                         {'followers_count': 1})
+        self.assertEqual(self.client.delete(url, headers=headers)
+                         .status_code, 204)
+        self.assertEqual(self.get('/api/v1/users/{}/followers'.format(
+            self.john.id))['items'], [])
+
+        recipe = self.recipes[0]
+        response = self.client.post(
+            '/api/v1/recipes/{}/comments'.format(recipe.id), headers=headers,
+            data=json.dumps({'body': '*tasty*'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        comment = json.loads(response.get_data(as_text=True))
+        self.assertEqual(comment['body_html'], '<em>tasty</em>')
+        Comment.query.get(comment['id']).disabled = True
+        db.session.commit()
+        comments = self.get('/api/v1/recipes/{}/comments'.format(recipe.id))
+        self.assertEqual(len(comments['items']), 1)
+        self.assertIsNone(comments['items'][0]['body_html'])
@@ -0,0 +1,161 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import url_for
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Role, Recipe, Comment
+from app.activity import last_seen_buffer
+
+
+class ConditionalGetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+        self.author = User(email='john@example.com', username='john',
+                           password='cat', confirmed=True)
+        self.recipe = Recipe(title='soup', author=self.author,
+                             img_filename='stockpot.jpeg')
+        db.session.add(self.recipe)
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def url(self, endpoint, **values):
+        with self.app.test_request_context():
+            return url_for(endpoint, **values)
+
+
+    def revisit(self, url, response):
+        return self.client.get(url, headers={
+            'If-None-Match': response.headers['ETag']})
+
+
+    def test_show_recipe(self):
+        url = self.url('main.show_recipe', id=self.recipe.id)
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('no-cache', first.headers['Cache-Control'])
+
+        # the test shares the session of the requests, start cold
+        db.session.expunge_all()
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            again = self.revisit(url, first)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.get_data(), b'')
+        self.assertEqual(len(statements), 1)
+
+        by_date = self.client.get(url, headers={
+            'If-Modified-Since': first.headers['Last-Modified']})
+        self.assertEqual(by_date.status_code, 304)
+
+        comment = Comment(body='good', recipe=self.recipe, author=self.author)
+        db.session.add(comment)
+        db.session.commit()
+        commented = self.revisit(url, first)
+        self.assertEqual(commented.status_code, 200)
+        self.assertEqual(self.revisit(url, commented).status_code, 304)
+        comment.disabled = True
+        db.session.commit()
+        self.assertEqual(self.revisit(url, commented).status_code, 200)
+
+
+    def test_user_page(self):
+        url = self.url('main.user', username='john')
+        first = self.client.get(url)
+        self.assertEqual(self.revisit(url, first).status_code, 304)
+        self.recipe.title = 'stew'
+        db.session.commit()
+        second = self.revisit(url, first)
+        self.assertEqual(second.status_code, 200)
+        self.assertIn('stew', second.get_data(as_text=True))
+        self.author.about_me = 'cooks'
+        db.session.commit()
+        self.assertEqual(self.revisit(url, second).status_code, 200)
+
+
+    def test_index_depends_on_viewer(self):
+        url = self.url('main.index')
+        first = self.client.get(url)
+        self.assertEqual(self.revisit(url, first).status_code, 304)
+        self.client.post(self.url('auth.login'), data={
+            'email': 'john@example.com', 'password': 'cat'})
+        self.assertEqual(self.revisit(url, first).status_code, 200)
+        db.session.add(Recipe(title='stew', author=self.author,
+                              img_filename='stockpot.jpeg'))
+        db.session.commit()
+        self.client.get(self.url('auth.logout'))
+        self.assertEqual(self.revisit(url, first).status_code, 200)
+
+
+    def test_index_follows_deletes_and_authors(self):
+        url = self.url('main.index')
+        stew = Recipe(title='stew', author=self.author,
+                      img_filename='stockpot.jpeg')
+        db.session.add(stew)
+        db.session.commit()
+        first = self.client.get(url)
+        self.assertNotIn('Last-Modified', first.headers)
+        db.session.delete(stew)
+        db.session.commit()
+        deleted = self.revisit(url, first)
+        self.assertEqual(deleted.status_code, 200)
+        self.assertEqual(self.revisit(url, deleted).status_code, 304)
+        # last_seen alone moves nothing
+        self.author.last_seen = self.author.last_seen.replace(year=2000)
+        db.session.commit()
+        self.assertEqual(self.revisit(url, deleted).status_code, 304)
+        self.author.username = 'johnny'
+        db.session.commit()
+        renamed = self.revisit(url, deleted)
+        self.assertEqual(renamed.status_code, 200)
+        self.assertIn('johnny', renamed.get_data(as_text=True))
+
+
+    def test_followed_feed_ignores_last_seen(self):
+        url = self.url('main.index')
+        self.client.post(self.url('auth.login'), data={
+            'email': 'john@example.com', 'password': 'cat'})
+        self.client.get(self.url('main.show_followed'))
+        first = self.client.get(url)
+        last_seen_buffer.touch(self.author, datetime.utcnow() +
+                               timedelta(hours=1))
+        last_seen_buffer.flush()
+        # the next request reads the user afresh
+        db.session.expire_all()
+        self.assertEqual(self.revisit(url, first).status_code, 304)
+        susan = User(email='susan@example.com', username='susan',
+                     password='dog', confirmed=True)
+        db.session.add(susan)
+        self.author.follow(susan)
+        db.session.commit()
+        self.assertEqual(self.revisit(url, first).status_code, 200)
+
+
+    def test_show_recipe_follows_commenters(self):
+        susan = User(email='susan@example.com', username='susan',
+                     password='dog', confirmed=True)
+        db.session.add(Comment(body='good', recipe=self.recipe,
+                               author=susan))
+        db.session.commit()
+        url = self.url('main.show_recipe', id=self.recipe.id)
+        first = self.client.get(url)
+        self.assertEqual(self.revisit(url, first).status_code, 304)
+        susan.username = 'suzy'
+        db.session.commit()
+        renamed = self.revisit(url, first)
+        self.assertEqual(renamed.status_code, 200)
+        self.assertIn('suzy', renamed.get_data(as_text=True))
@@ -0,0 +1,146 @@
+import socket
+import socketserver
+import threading
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db, mail
+from app.models import OutboxMessage
+from app.email import send_email, mail_queue
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of SMTP for smtplib to hand over messages."""
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost')
+        while True:
+            line = self.rfile.readline().decode('utf-8').strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'DATA':
+                self.reply('354 go ahead')
+                while self.rfile.readline().rstrip(b'\r\n') != b'.':
+                    pass
+                self.server.messages += 1
+            self.reply('250 ok')
+
+
+    def reply(self, line):
+        self.wfile.write(line.encode('utf-8') + b'\r\n')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.TCPServer.__init__(self, ('localhost', 0), SMTPHandler)
+        self.connections = self.messages = 0
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class EmailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+        db.create_all()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+        self.app_context.pop()
+
+
+    def queue(self, count):
+        for i in range(count):
+            send_email('cook{}@example.com'.format(i), 'Confirm Your Account',
+                       'auth/email/confirm', user=None, token='token')
+        db.session.commit()
+
+
+    def smtp(self, port):
+        state = self.app.extensions['mail']
+        state.suppress, state.server, state.port = False, 'localhost', port
+
+
+    def test_send_email_is_queued(self):
+        self.queue(3)
+        self.assertEqual(mail_queue.depth(), 3)
+        with mail.record_messages() as outbox:
+            self.assertEqual(mail_queue.deliver(), 3)
+        self.assertEqual(mail_queue.depth(), 0)
+        self.assertEqual([m.recipients for m in outbox],
+                         [['cook0@example.com'], ['cook1@example.com'],
+                          ['cook2@example.com']])
+        self.assertTrue(outbox[0].subject.startswith('[Stockpot]'))
+
+
+    def test_batch_shares_a_connection(self):
+        server = SMTPServer()
+        try:
+            self.smtp(server.server_address[1])
+            self.queue(5)
+            mail_queue.batch_size = 3
+            self.assertEqual(mail_queue.deliver(), 3)
+            self.assertEqual(mail_queue.deliver(), 2)
+            self.assertEqual(mail_queue.deliver(), 0)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(server.messages, 5)
+        self.assertEqual(server.connections, 2)
+
+
+    def test_failed_delivery_backs_off(self):
+        # a port nothing listens on
+        sock = socket.socket()
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.smtp(port)
+        self.queue(1)
+        now = datetime.utcnow()
+        self.assertEqual(mail_queue.deliver(now), 1)
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.attempts, 1)
+        self.assertIsNotNone(message.last_error)
+        retry_at = message.next_attempt_at
+        self.assertEqual(retry_at, now + timedelta(
+            seconds=self.app.config['STOCKPOT_MAIL_RETRY_DELAY']))
+        # not due yet, then a second failure doubles the delay
+        self.assertEqual(mail_queue.deliver(now), 0)
+        self.assertEqual(mail_queue.deliver(retry_at), 1)
+        db.session.expire_all()
+        self.assertEqual(message.next_attempt_at - retry_at, 2 * (
+            retry_at - now))
+        self.assertEqual(mail_queue.depth(), 1)
+
+
+    def test_send_email_leaves_the_commit_to_the_caller(self):
+        send_email('cook@example.com', 'Confirm Your Account',
+                   'auth/email/confirm', user=None, token='token')
+        db.session.rollback()
+        self.assertEqual(OutboxMessage.query.count(), 0)
+
+
+    def test_bad_message_fails_alone(self):
+        self.queue(2)
+        bad = OutboxMessage.query.order_by(OutboxMessage.id).first()
+        bad.subject = 'Confirm\r\nBcc: everyone@example.com'
+        db.session.commit()
+        with mail.record_messages() as outbox:
+            self.assertEqual(mail_queue.deliver(), 2)
+        self.assertEqual(len(outbox), 1)
+        db.session.expire_all()
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.id, bad.id)
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('BadHeaderError', message.last_error)
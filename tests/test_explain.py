@@ -0,0 +1,29 @@
+import unittest
+from app import create_app, db
+from app.models import Role
+from app.seed import Seeder
+from app.explain import view_plans
+
+
+class ExplainTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        Seeder(users=20, follows=3, recipes=50, comments=200).run()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def test_view_queries_use_indexes(self):
+        plans = dict(view_plans())
+        self.assertIn('show_recipe (comments)', plans)
+        scans = [(name, line) for name, plan in plans.items()
+                 for line, full_scan in plan if full_scan]
+        self.assertEqual(scans, [])
@@ -0,0 +1,166 @@
+import unittest
+from app import create_app, db
+from app.models import (User, Role, Recipe, Comment, Follow, TimelineEntry,
+                        follow_graph, recount)
+from app.queries import followed_feed
+
+
+class FollowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.alice = User(email='alice@example.com', username='alice',
+                          password='cat')
+        self.bob = User(email='bob@example.com', username='bob',
+                        password='dog')
+        db.session.add_all([self.alice, self.bob])
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def post(self, author, title):
+        recipe = Recipe(title=title, author=author)
+        db.session.add(recipe)
+        db.session.commit()
+        return recipe
+
+
+    def feed(self, user):
+        query, columns = followed_feed(user)
+        return [r.title for r in query.order_by(
+            *[column.desc() for column in columns])]
+
+
+    def test_follow_graph_cache(self):
+        self.assertFalse(self.alice.is_following(self.bob))
+        self.assertIn(self.alice.id, follow_graph.cache)
+
+        self.alice.follow(self.bob)
+        db.session.commit()
+        self.assertTrue(self.alice.is_following(self.bob))
+        self.assertTrue(self.bob.is_followed_by(self.alice))
+
+        self.alice.unfollow(self.bob)
+        db.session.rollback()
+        self.assertTrue(self.alice.is_following(self.bob))
+
+        self.alice.unfollow(self.bob)
+        db.session.commit()
+        self.assertFalse(self.alice.is_following(self.bob))
+
+
+    def test_writes_ignore_a_stale_cache(self):
+        # another process followed, this one still caches no follows
+        self.assertFalse(self.alice.is_following(self.bob))
+        db.session.add(Follow(follower=self.alice, followed=self.bob))
+        db.session.commit()
+        follow_graph.cache.set(self.alice.id, frozenset())
+        self.assertFalse(self.alice.follow(self.bob))
+        db.session.commit()
+        self.assertTrue(self.alice.unfollow(self.bob))
+        db.session.commit()
+        self.assertEqual(self.alice.followed.filter_by(
+            followed_id=self.bob.id).count(), 0)
+
+
+    def test_self_follow_before_flush(self):
+        u = User(email='carol@example.com', password='cat')
+        self.assertTrue(u.is_following(u))
+        db.session.add(u)
+        db.session.commit()
+        self.assertTrue(u.is_following(u))
+
+
+    def test_timeline_fan_out_backfill_and_prune(self):
+        self.post(self.bob, 'soup')
+        self.assertEqual(self.feed(self.alice), [])
+
+        self.alice.follow(self.bob)
+        db.session.commit()
+        self.assertEqual(self.feed(self.alice), ['soup'])
+
+        self.post(self.bob, 'stew')
+        self.post(self.alice, 'salad')
+        self.assertEqual(self.feed(self.alice), ['salad', 'stew', 'soup'])
+
+        self.alice.unfollow(self.bob)
+        db.session.commit()
+        self.assertEqual(self.feed(self.alice), ['salad'])
+
+
+    def test_popular_authors_are_pulled(self):
+        self.app.config['STOCKPOT_TIMELINE_FANOUT_LIMIT'] = 1
+        self.alice.follow(self.bob)
+        db.session.commit()
+        self.post(self.bob, 'soup')
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.alice.id).count(), 0)
+        self.assertEqual(self.feed(self.alice), ['soup'])
+
+
+    def test_crossing_the_fan_out_limit(self):
+        # bob's self follow counts, alice makes him popular
+        self.app.config['STOCKPOT_TIMELINE_FANOUT_LIMIT'] = 2
+        carol = User(email='carol@example.com', username='carol',
+                     password='cat')
+        db.session.add(carol)
+        carol.follow(self.bob)
+        db.session.commit()
+        self.post(self.bob, 'soup')
+        entries = TimelineEntry.query.filter_by(author_id=self.bob.id)
+        self.assertEqual(entries.count(), 2)
+
+        self.alice.follow(self.bob)
+        db.session.commit()
+        self.assertEqual(entries.count(), 0)
+        self.assertEqual(self.feed(carol), ['soup'])
+        self.assertEqual(self.feed(self.alice), ['soup'])
+
+        self.alice.unfollow(self.bob)
+        db.session.commit()
+        self.assertEqual(sorted(e.user_id for e in entries),
+                         sorted([self.bob.id, carol.id]))
+        self.assertEqual(self.feed(carol), ['soup'])
+        self.assertEqual(self.feed(self.alice), [])
+
+
+    def test_rebuild(self):
+        self.alice.follow(self.bob)
+        db.session.commit()
+        self.post(self.bob, 'soup')
+        TimelineEntry.query.delete()
+        db.session.commit()
+        TimelineEntry.rebuild()
+        self.assertEqual(self.feed(self.alice), ['soup'])
+        self.assertEqual(self.feed(self.bob), ['soup'])
+
+
+    def test_counters(self):
+        self.alice.follow(self.bob)
+        recipe = self.post(self.bob, 'soup')
+        db.session.add(Comment(body='yum', recipe=recipe, author=self.alice))
+        db.session.commit()
+        self.assertEqual(self.bob.followers_count, 2)
+        self.assertEqual(self.alice.followed_count, 2)
+        self.assertEqual(self.bob.recipes_count, 1)
+        self.assertEqual(recipe.comments_count, 1)
+
+        self.alice.unfollow(self.bob)
+        db.session.delete(recipe.comments.first())
+        db.session.commit()
+        self.assertEqual(self.bob.followers_count, 1)
+        self.assertEqual(recipe.comments_count, 0)
+
+        db.session.execute(User.__table__.update().values(followers_count=7))
+        db.session.commit()
+        recount()
+        self.assertEqual(self.bob.followers_count, 1)
+        self.assertEqual(self.alice.followed_count, 1)
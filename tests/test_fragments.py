@@ -0,0 +1,73 @@
+import shutil
+import tempfile
+import unittest
+from app import create_app, db
+from app.models import User, Recipe
+from app.fragments import FileBackend, fragment_cache
+
+
+class FragmentCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+        db.create_all()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+        self.app_context.pop()
+
+
+    def test_cache_tag(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        r = Recipe(title='soup', author=u)
+        db.session.add(r)
+        db.session.commit()
+        renders = []
+        template = self.app.jinja_env.from_string(
+            "{% cache 'card', recipe, ('users', recipe.author_id) %}"
+            "{{ count() }}<b>{{ recipe.title }}</b> by {{ recipe.author.username }}"
+            "{% endcache %} {{ viewer }}")
+
+        def render(viewer):
+            return template.render(recipe=r, viewer=viewer,
+                                   count=lambda: renders.append(1) or '')
+
+        self.assertEqual(render('a'), '<b>soup</b> by john a')
+        self.assertEqual(render('b'), '<b>soup</b> by john b')
+        self.assertEqual(len(renders), 1)
+        r.title = 'stew'
+        db.session.commit()
+        self.assertEqual(render('a'), '<b>stew</b> by john a')
+        u.username = 'jack'
+        db.session.commit()
+        self.assertEqual(render('a'), '<b>stew</b> by jack a')
+        self.assertEqual(len(renders), 3)
+        # a rolled back change leaves a fresh version, not a stale one
+        r.title = 'broth'
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(render('a'), '<b>stew</b> by jack a')
+
+
+    def test_file_backend(self):
+        directory = tempfile.mkdtemp()
+        try:
+            backend = FileBackend(directory, maxsize=2)
+            backend.set('a', 'caf\xe9')
+            self.assertEqual(FileBackend(directory).get('a'), 'caf\xe9')
+            backend.pop('a')
+            self.assertIsNone(backend.get('a'))
+            for key in 'bcde':
+                backend.set(key, key)
+            backend.prune()
+            self.assertEqual(len([k for k in 'bcde' if backend.get(k)]), 2)
+            backend.clear()
+            self.assertIsNone(backend.get('e'))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,56 @@
+import unittest
+from datetime import datetime
+from app import create_app, db
+from app.models import Comment, Recipe
+from app.markup import Renderer, COMMENT_TAGS
+
+
+class MarkupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def test_render(self):
+        renderer = Renderer(COMMENT_TAGS)
+        html = renderer.render('*so* good <script>x</script> http://a.org')
+        self.assertEqual(html, '<em>so</em> good x <a href="http://a.org" '
+                               'rel="nofollow">http://a.org</a>')
+        self.assertEqual(len(renderer.cache), 1)
+        self.assertEqual(renderer.render('*so* good <script>x</script> '
+                                         'http://a.org'), html)
+        self.assertEqual(len(renderer.cache), 1)
+        self.assertIsNone(renderer.render(None))
+
+
+    def test_rerender(self):
+        long_ago = datetime(2016, 1, 1)
+        stale_recipe = Recipe(title='soup', updated_at=long_ago)
+        fresh_recipe = Recipe(title='stew', updated_at=long_ago)
+        comments = [Comment(body='**{}**'.format(i),
+                            recipe=stale_recipe if i < 3 else fresh_recipe)
+                    for i in range(5)]
+        db.session.add_all(comments)
+        db.session.commit()
+        db.session.execute(Recipe.__table__.update().values(
+            updated_at=long_ago))
+        db.session.commit()
+        self.assertEqual(comments[0].body_html, '<strong>0</strong>')
+        stale = Comment.__table__.update().where(Comment.id <= comments[2].id)
+        db.session.execute(stale.values(body_html='<b>old</b>'))
+        db.session.commit()
+        self.assertEqual(Comment.rerender(batch_size=2, processes=2), 3)
+        db.session.expire_all()
+        self.assertEqual([c.body_html for c in comments],
+                         ['<strong>{}</strong>'.format(i) for i in range(5)])
+        self.assertGreater(stale_recipe.updated_at, long_ago)
+        self.assertEqual(fresh_recipe.updated_at, long_ago)
+        self.assertEqual(Comment.rerender(batch_size=2, processes=2), 0)
@@ -0,0 +1,86 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Recipe
+from app.pagination import KeysetPagination, encode_cursor, decode_cursor
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        # pairs of recipes share a timestamp so the id tie breaker matters
+        start = datetime(2016, 1, 1)
+        for i in range(10):
+            db.session.add(Recipe(title=str(i),
+                                  timestamp=start + timedelta(minutes=i // 2)))
+        db.session.commit()
+        self.columns = (Recipe.timestamp, Recipe.id)
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def page(self, **kwargs):
+        return KeysetPagination(Recipe.query, self.columns, 4, **kwargs)
+
+
+    def titles(self, pagination):
+        return [r.title for r in pagination.items]
+
+
+    def test_cursor_round_trip(self):
+        key = (datetime(2016, 1, 1, 12, 30, 5, 123), 42)
+        self.assertEqual(decode_cursor(encode_cursor(key)), key)
+        self.assertIsNone(decode_cursor('not a cursor'))
+
+
+    def test_walk_forwards_and_back(self):
+        first = self.page()
+        self.assertEqual(self.titles(first), ['9', '8', '7', '6'])
+        self.assertFalse(first.has_prev)
+        self.assertTrue(first.has_next)
+
+        second = self.page(after=first.next_cursor)
+        self.assertEqual(self.titles(second), ['5', '4', '3', '2'])
+        self.assertTrue(second.has_prev)
+
+        third = self.page(after=second.next_cursor)
+        self.assertEqual(self.titles(third), ['1', '0'])
+        self.assertFalse(third.has_next)
+
+        back = self.page(before=third.prev_cursor)
+        self.assertEqual(self.titles(back), ['5', '4', '3', '2'])
+        back = self.page(before=back.prev_cursor)
+        self.assertEqual(self.titles(back), ['9', '8', '7', '6'])
+        self.assertFalse(back.has_prev)
+
+
+    def test_last_page(self):
+        last = self.page(last=True, descending=False)
+        self.assertEqual(self.titles(last), ['6', '7', '8', '9'])
+        self.assertTrue(last.has_prev)
+        self.assertFalse(last.has_next)
+        prev = self.page(before=last.prev_cursor, descending=False)
+        self.assertEqual(self.titles(prev), ['2', '3', '4', '5'])
+
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        pagination = self.page(after='garbage')
+        self.assertEqual(self.titles(pagination), ['9', '8', '7', '6'])
+
+
+    def test_cursor_must_fit_the_columns(self):
+        good = encode_cursor((datetime(2016, 1, 1), 3))
+        self.assertIsNotNone(decode_cursor(good, self.columns))
+        for key in ([None, None], [1, 2], ['x', 3], [datetime(2016, 1, 1)],
+                    [datetime(2016, 1, 1), True]):
+            cursor = encode_cursor(key)
+            self.assertIsNone(decode_cursor(cursor, self.columns))
+            pagination = self.page(after=cursor)
+            self.assertEqual(self.titles(pagination), ['9', '8', '7', '6'])
@@ -0,0 +1,388 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from io import BytesIO
+from flask_uploads import UploadConfiguration
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
+from werkzeug.datastructures import FileStorage
+from app import create_app, db
+from app.models import (Recipe, RecipeIngredient, RecipeStep, Ingredient,
+                        StoredImage, User, diff_lines)
+from app.storage import store_upload
+from app.queries import pantry_search, RecipeDetail, within_time
+from app.images import Image, image_sweeper
+
+
+class RecipeModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def test_ingredient_normalize(self):
+        self.assertEqual(Ingredient.normalize('  Green   Onions '),
+                         'green onions')
+        self.assertEqual(Ingredient(name='Carrots').key, 'carrots')
+
+
+    def test_ingredients_are_shared(self):
+        first = Recipe(title='soup', ingredients=Recipe.build_ingredients(
+            [(1, 'cup', 'Carrots'), (2, 'tsp', 'salt')]))
+        db.session.add(first)
+        db.session.commit()
+        second = Recipe(title='stew', ingredients=Recipe.build_ingredients(
+            [(3, 'cup', 'carrots '), (1, 'tbsp', 'Pepper')]))
+        db.session.add(second)
+        db.session.commit()
+        self.assertEqual(Ingredient.query.count(), 3)
+        carrots = Ingredient.query.filter_by(key='carrots').one()
+        self.assertEqual(carrots.name, 'Carrots')
+        self.assertEqual(carrots.recipe_ingredients.count(), 2)
+
+
+    def test_recipe_detail(self):
+        recipe = Recipe(
+            title='soup', prep_time=timedelta(minutes=5),
+            author=User(email='john@example.com', username='john'),
+            ingredients=Recipe.build_ingredients(
+                [(i, 'cup', 'ingredient {}'.format(i)) for i in range(8)]),
+            steps=[RecipeStep(body='step {}'.format(i)) for i in range(8)])
+        recipe.ingredients.append(RecipeIngredient(amount=1, units='pinch'))
+        db.session.add(recipe)
+        db.session.commit()
+        recipe_id = recipe.id
+        db.session.expunge_all()
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            detail = RecipeDetail.load(Recipe.query.options(
+                joinedload(Recipe.author)).get(recipe_id))
+            names = [line.name for line in detail.ingredients]
+            self.assertEqual(detail.author.username, 'john')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(names, ['ingredient {}'.format(i)
+                                 for i in range(8)] + [''])
+        self.assertEqual(detail.steps[0], 'step 0')
+        self.assertEqual(detail.title, 'soup')
+        self.assertEqual(detail.prep_time, timedelta(minutes=5))
+        with self.assertRaises(AttributeError):
+            detail.title = 'stew'
+
+
+    def test_update_lines(self):
+        recipe = Recipe(title='soup', ingredients=Recipe.build_ingredients(
+            [(1, 'cup', 'carrots'), (2, 'tsp', 'salt'), (1, 'cup', 'peas')]),
+            steps=[RecipeStep(body='chop'), RecipeStep(body='boil')])
+        db.session.add(recipe)
+        db.session.commit()
+        carrots, salt, peas = recipe.ingredients.order_by(
+            RecipeIngredient.id).all()
+        chop, boil = recipe.steps.order_by(RecipeStep.id).all()
+        line_ids = [carrots.id, salt.id, peas.id]
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            changed = recipe.update_lines(
+                [(carrots.id, (1, 'cup', 'carrots')),
+                 (peas.id, (3, 'cup', 'peas')),
+                 (None, (1, 'tbsp', 'Pepper'))],
+                [(chop.id, 'chop'), (boil.id, 'boil')])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        db.session.commit()
+        self.assertTrue(changed)
+        writes = [s.split()[0] for s in statements
+                  if s.split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
+        # the pepper ingredient, then one statement per kind of change
+        self.assertEqual(writes, ['INSERT', 'UPDATE', 'INSERT', 'DELETE'])
+
+        lines = recipe.ingredients.order_by(RecipeIngredient.id).all()
+        self.assertEqual([(l.amount, l.ingredient.name) for l in lines],
+                         [(1, 'carrots'), (3, 'peas'), (1, 'Pepper')])
+        self.assertEqual([l.id for l in lines[:2]], [line_ids[0], line_ids[2]])
+        self.assertEqual(RecipeIngredient.query.count(), 3)
+        self.assertFalse(recipe.update_lines(
+            [(l.id, (l.amount, l.units, l.ingredient.name)) for l in lines],
+            [(chop.id, 'chop'), (boil.id, 'boil')]))
+
+        db.session.delete(recipe)
+        db.session.commit()
+        self.assertEqual(RecipeIngredient.query.count(), 0)
+        self.assertEqual(RecipeStep.query.count(), 0)
+
+
+    def test_diff_lines(self):
+        stored = [(1, ('a',)), (2, ('b',)), (3, ('c',))]
+        # appended lines are inserted after the existing rows
+        self.assertEqual(diff_lines(stored, [(1, ('a',)), (3, ('c',)),
+                                             (None, ('d',))]),
+                         ([], [('d',)], [2]))
+        # a new line between two kept ones takes the row removed there
+        self.assertEqual(diff_lines(stored, [(1, ('a',)), (None, ('x',)),
+                                             (3, ('c',))]),
+                         ([(2, ('x',))], [], []))
+        # with no row left before the next anchor, the rest is rewritten
+        self.assertEqual(diff_lines(stored, [(None, ('x',)), (1, ('a',)),
+                                             (2, ('b',)), (3, ('c',))]),
+                         ([(1, ('x',)), (2, ('a',)), (3, ('b',))],
+                          [('c',)], []))
+        # ids out of order or unknown are new lines
+        self.assertEqual(diff_lines(stored, [(3, ('c',)), (1, ('a',)),
+                                             (9, ('z',))]),
+                         ([], [('a',), ('z',)], [1, 2]))
+
+
+    def test_time_columns(self):
+        quick = Recipe(title='salad', prep_time=timedelta(minutes=10))
+        slow = Recipe(title='stew', prep_time=timedelta(minutes=20),
+                      cook_time=timedelta(hours=2))
+        untimed = Recipe(title='toast')
+        db.session.add_all([quick, slow, untimed])
+        db.session.commit()
+        self.assertEqual((quick.prep_seconds, quick.cook_seconds,
+                          quick.total_seconds), (600, None, 600))
+        self.assertEqual(slow.total_seconds, 8400)
+        self.assertIsNone(untimed.total_seconds)
+        slow.cook_time = timedelta(minutes=5)
+        db.session.commit()
+        self.assertEqual(slow.total_seconds, 1500)
+
+        def titles(*bounds):
+            return sorted(r.title for r in within_time(Recipe.query, *bounds))
+        self.assertEqual(titles(None, 30 * 60), ['salad', 'stew'])
+        self.assertEqual(titles(15 * 60, 30 * 60), ['stew'])
+        self.assertEqual(titles(), ['salad', 'stew', 'toast'])
+
+        # rows written before the columns existed
+        db.session.execute(Recipe.__table__.update().values(
+            prep_seconds=None, cook_seconds=None, total_seconds=None))
+        db.session.commit()
+        self.assertEqual(Recipe.backfill_times(batch_size=2), 2)
+        self.assertEqual(titles(None, 30 * 60), ['salad', 'stew'])
+        self.assertEqual(Recipe.backfill_times(), 0)
+
+
+    def test_parse_duration(self):
+        # app.main reads the config while its forms are defined
+        from app.main.fields import parse_duration
+        self.assertEqual(parse_duration('0d 1h 30m 0s'),
+                         timedelta(hours=1, minutes=30))
+        self.assertEqual(parse_duration(' 45m '), timedelta(minutes=45))
+        self.assertEqual(parse_duration('1.5 hours'),
+                         timedelta(hours=1, minutes=30))
+        self.assertEqual(parse_duration('2 hrs 5 mins'),
+                         timedelta(hours=2, minutes=5))
+        self.assertEqual(parse_duration(''), timedelta())
+        self.assertIsNone(parse_duration('1.2.3h'))
+        self.assertIsNone(parse_duration('soon'))
+        self.assertIsNone(parse_duration('99999999999d'))
+        self.assertIsNone(parse_duration('9' * 400 + ' hours'))
+
+
+    def test_merge_duplicates(self):
+        # rows written before ingredients were deduplicated have no key
+        db.session.execute(Ingredient.__table__.insert(), [
+            {'id': 1, 'name': 'Carrots'},
+            {'id': 2, 'name': 'carrots'},
+            {'id': 3, 'name': 'Salt'}])
+        db.session.execute(RecipeIngredient.__table__.insert(), [
+            {'ingredient_id': 1}, {'ingredient_id': 2}, {'ingredient_id': 3}])
+        db.session.commit()
+        self.assertEqual(Ingredient.merge_duplicates(), 1)
+        self.assertEqual(
+            [(i.id, i.key) for i in Ingredient.query.order_by(Ingredient.id)],
+            [(1, 'carrots'), (3, 'salt')])
+        self.assertEqual(
+            sorted(l.ingredient_id for l in RecipeIngredient.query), [1, 1, 3])
+
+
+    def test_pantry_search(self):
+        for title, names in [('soup', ['carrots', 'onion', 'salt']),
+                             ('salad', ['Carrots']),
+                             ('cake', ['flour', 'sugar'])]:
+            db.session.add(Recipe(title=title, ingredients=Recipe.build_ingredients(
+                [(1, 'cup', name) for name in names])))
+        db.session.commit()
+        query, columns = pantry_search(['Onion', 'carrots ', 'pepper'])
+        ranked = query.order_by(*[column.desc() for column in columns]).all()
+        self.assertEqual([(recipe.title, matches) for recipe, matches in ranked],
+                         [('soup', 2), ('salad', 1)])
+
+
+    def test_pantry_caps_ingredients(self):
+        # a long enough list would exceed what SQLite binds per statement
+        names = ','.join('ingredient {}'.format(i) for i in range(1000))
+        bound = []
+        listener = lambda *args: bound.append(len(args[3]))
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = self.app.test_client().get(
+                '/recipes/pantry', query_string={'ingredients': names})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            max(bound), self.app.config['STOCKPOT_PANTRY_MAX_INGREDIENTS'])
+
+
+    @unittest.skipIf(Image is None, 'Pillow is not installed')
+    def test_image_variants(self):
+        uploads = tempfile.mkdtemp()
+        self.app.upload_set_config['recipeimgs'] = \
+            UploadConfiguration(uploads)
+        try:
+            Image.new('RGB', (800, 600), 'red').save(
+                os.path.join(uploads, 'big.jpg'))
+            Image.new('RGB', (200, 150), 'red').save(
+                os.path.join(uploads, 'small.jpg'))
+            r = Recipe(title='soup', img_filename='big.jpg')
+            db.session.add(r)
+            db.session.commit()
+            with self.app.test_request_context():
+                self.assertTrue(r.img_src_for(300).endswith(
+                    'variants/big.320w.jpeg'))
+                self.assertTrue(r.img_src_for(400).endswith(
+                    'variants/big.640w.jpeg'))
+                self.assertEqual(r.img_src_for(1000), r.img_src)
+                self.assertIn('640w', r.img_srcset())
+            with Image.open(os.path.join(
+                    uploads, 'variants/big.320w.jpeg')) as variant:
+                self.assertEqual(variant.size, (320, 240))
+            r.img_filename = 'small.jpg'
+            self.assertIsNone(r.img_variants)
+            db.session.commit()
+            self.assertEqual(r.img_variants, '{}')
+        finally:
+            shutil.rmtree(uploads)
+
+
+    def test_content_addressed_uploads(self):
+        uploads = tempfile.mkdtemp()
+        self.app.upload_set_config['recipeimgs'] = \
+            UploadConfiguration(uploads)
+        try:
+            names = [store_upload(FileStorage(BytesIO(b'same photo'),
+                                              filename=filename))
+                     for filename in ('a.jpg', 'B.JPG')]
+            self.assertEqual(names[0], names[1])
+            self.assertRegex(names[0], r'^[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+            self.assertEqual(os.listdir(os.path.dirname(
+                os.path.join(uploads, names[0]))), [names[0][3:]])
+            first = Recipe(title='soup', img_filename=names[0])
+            second = Recipe(title='stew', img_filename=names[1])
+            db.session.add_all([first, second])
+            db.session.commit()
+            self.assertEqual(StoredImage.query.get(names[0]).refcount, 2)
+
+            with self.app.test_request_context():
+                url = first.img_src
+            with self.app.test_client() as client:
+                response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('immutable', response.headers['Cache-Control'])
+                response.close()
+
+            db.session.delete(first)
+            db.session.commit()
+            self.assertTrue(os.path.exists(os.path.join(uploads, names[0])))
+            second.update_img(self.app.config['STOCKPOT_DEFAULT_IMG'])
+            db.session.commit()
+            self.assertFalse(os.path.exists(os.path.join(uploads, names[0])))
+            self.assertIsNone(StoredImage.query.get(names[0]))
+        finally:
+            shutil.rmtree(uploads)
+
+
+    def test_images_are_removed_after_commit(self):
+        uploads = tempfile.mkdtemp()
+        self.app.upload_set_config['recipeimgs'] = \
+            UploadConfiguration(uploads)
+        try:
+            name = store_upload(FileStorage(BytesIO(b'photo'),
+                                            filename='a.jpg'))
+            path = os.path.join(uploads, name)
+            r = Recipe(title='soup', img_filename=name)
+            db.session.add(r)
+            db.session.commit()
+            db.session.delete(r)
+            db.session.flush()
+            self.assertTrue(os.path.exists(path))
+            db.session.rollback()
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(StoredImage.query.get(name).refcount, 1)
+            db.session.delete(r)
+            db.session.commit()
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(uploads)
+
+
+    def test_sweep_orphaned_images(self):
+        uploads = tempfile.mkdtemp()
+        self.app.upload_set_config['recipeimgs'] = \
+            UploadConfiguration(uploads)
+        try:
+            used, orphan, young = [
+                store_upload(FileStorage(BytesIO(data), filename='a.jpg'))
+                for data in (b'used', b'orphan', b'young')]
+            db.session.add(Recipe(title='soup', img_filename=used))
+            db.session.commit()
+            # files the app did not write are never candidates
+            for name in ('.gitignore', 'legacy.jpg'):
+                open(os.path.join(uploads, name), 'w').close()
+            for stem in (used, orphan):
+                os.makedirs(os.path.join(uploads, 'variants', stem[:2]))
+                open(os.path.join(uploads, 'variants', os.path.splitext(
+                    stem)[0] + '.320w.jpeg'), 'w').close()
+            old = time.time() - self.app.config['STOCKPOT_IMG_SWEEP_GRACE']
+            for folder, _, files in os.walk(uploads):
+                for f in files:
+                    if not f.startswith(young[3:]):
+                        os.utime(os.path.join(folder, f), (old - 1, old - 1))
+            expected = [orphan,
+                        'variants/' + os.path.splitext(orphan)[0] +
+                        '.320w.jpeg']
+            self.assertEqual(image_sweeper.sweep(dry_run=True), expected)
+            image_sweeper.batch_size, image_sweeper.pause = 1, 0
+            self.assertEqual(image_sweeper.sweep(), expected)
+            self.assertEqual(image_sweeper.sweep(), [])
+            for name in (used, young, '.gitignore', 'legacy.jpg'):
+                self.assertTrue(os.path.exists(os.path.join(uploads, name)))
+        finally:
+            shutil.rmtree(uploads)
+
+
+    def test_recently_touched_images_are_kept(self):
+        uploads = tempfile.mkdtemp()
+        self.app.upload_set_config['recipeimgs'] = \
+            UploadConfiguration(uploads)
+        try:
+            name = store_upload(FileStorage(BytesIO(b'photo'),
+                                            filename='a.jpg'))
+            path = os.path.join(uploads, name)
+            image_sweeper.min_age = 60
+            # e.g. reused by an upload whose recipe is not committed yet
+            self.assertEqual(image_sweeper.remove([name]), [])
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(image_sweeper.remove(
+                [name], now=time.time() + 61), [name])
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(uploads)
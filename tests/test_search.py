@@ -0,0 +1,71 @@
+import unittest
+from app import create_app, db
+from app.models import Recipe, RecipeStep
+from app.search import search, search_key, rebuild, search_index, match_expression
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        img = self.app.config['STOCKPOT_DEFAULT_IMG']
+        self.soup = Recipe(
+            title='Carrot soup', img_filename=img, description='A warming winter soup',
+            steps=[RecipeStep(body='Simmer the carrots')],
+            ingredients=Recipe.build_ingredients([(2, 'cup', 'carrots')]))
+        self.cake = Recipe(
+            title='Carrot cake', img_filename=img, description='Sweet',
+            steps=[RecipeStep(body='Bake for an hour')],
+            ingredients=Recipe.build_ingredients([(1, 'cup', 'flour')]))
+        db.session.add_all([self.soup, self.cake])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def titles(self, terms):
+        query, columns = search(terms)
+        return [recipe.title for recipe, rank in
+                query.order_by(*[column.asc() for column in columns])]
+
+
+    def test_match_expression(self):
+        self.assertEqual(match_expression('carrot "soup'),
+                         '"carrot"* "soup"*')
+
+
+    def test_no_words(self):
+        self.assertEqual(match_expression('???'), '')
+        self.assertEqual(self.titles('???'), [])
+        response = self.app.test_client().get('/search?q=%3F%3F%3F')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('No recipes matched', response.get_data(as_text=True))
+
+
+    def test_ranking_and_prefixes(self):
+        self.assertEqual(self.titles('carr'), ['Carrot soup', 'Carrot cake'])
+        self.assertEqual(self.titles('carrot bake'), ['Carrot cake'])
+        self.assertEqual(self.titles('flour'), ['Carrot cake'])
+        self.assertEqual(self.titles('pie'), [])
+
+
+    def test_index_follows_changes(self):
+        self.cake.title = 'Chocolate cake'
+        self.cake.steps.append(RecipeStep(body='Frost it'))
+        db.session.delete(self.soup)
+        db.session.commit()
+        self.assertEqual(self.titles('carrot'), [])
+        self.assertEqual(self.titles('frost chocolate'), ['Chocolate cake'])
+
+
+    def test_rebuild(self):
+        db.session.execute(search_index.delete())
+        db.session.commit()
+        self.assertEqual(self.titles('soup'), [])
+        rebuild(batch_size=1)
+        self.assertEqual(self.titles('soup'), ['Carrot soup'])
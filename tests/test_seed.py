@@ -0,0 +1,60 @@
+import unittest
+from app import create_app, db
+from app.models import User, Role, Follow, Recipe, Comment, TimelineEntry
+from app.seed import Seeder
+from app.search import search
+
+
+class SeedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def seed(self, **kwargs):
+        Seeder(users=20, follows=3, recipes=50, comments=200, batch_size=7,
+               **kwargs).run()
+
+
+    def snapshot(self):
+        return [(r.title, r.author_id, r.comments_count)
+                for r in Recipe.query.order_by(Recipe.id)]
+
+
+    def test_seed_is_consistent(self):
+        self.seed()
+        self.assertEqual(User.query.count(), 20)
+        self.assertEqual(Follow.query.count(), 20 * 4)
+        self.assertEqual(Recipe.query.count(), 50)
+        self.assertTrue(Comment.query.count() > 0)
+        u = User.query.first()
+        self.assertTrue(u.verify_password('password'))
+        self.assertTrue(u.is_following(u))
+        self.assertEqual(u.followed_count, u.followed.count())
+        self.assertEqual(u.followers_count, u.followers.count())
+        self.assertEqual(u.recipes_count, u.recipes.count())
+        r = Recipe.query.first()
+        self.assertEqual(r.comments_count, r.comments.count())
+        self.assertTrue(r.ingredients.count() > 0)
+        self.assertTrue(TimelineEntry.query.count() > 0)
+        word = r.title.split()[0]
+        self.assertIn(r, [hit for hit, _ in search(word)[0]])
+
+
+    def test_seed_is_reproducible(self):
+        self.seed(seed=42)
+        first = self.snapshot()
+        db.drop_all()
+        db.create_all()
+        Role.insert_roles()
+        self.seed(seed=42)
+        self.assertEqual(self.snapshot(), first)
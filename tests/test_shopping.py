@@ -0,0 +1,84 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role, Recipe
+from app.shopping import shopping_list, followed_recipes, readable
+
+
+class ShoppingListTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        img = self.app.config['STOCKPOT_DEFAULT_IMG']
+        self.john = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        self.susan = User(email='susan@example.com', username='susan',
+                          password='dog', confirmed=True)
+        self.soup = Recipe(
+            title='soup', img_filename=img, author=self.john,
+            ingredients=Recipe.build_ingredients(
+                [(1, 'cup', 'Carrots'), (2, 'tsp', 'salt'),
+                 (1, 'pinch', 'pepper')]))
+        self.stew = Recipe(
+            title='stew', img_filename=img, author=self.john,
+            ingredients=Recipe.build_ingredients(
+                [(4, 'tbsp', 'carrots'), (1, 'tbsp', 'Salt'),
+                 (2, 'pinch', 'pepper')]))
+        self.old = Recipe(
+            title='old', img_filename=img, author=self.john,
+            timestamp=datetime.utcnow() - timedelta(days=30),
+            ingredients=Recipe.build_ingredients([(1, 'cup', 'rice')]))
+        db.session.add_all([self.susan, self.soup, self.stew, self.old])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def test_readable(self):
+        self.assertEqual(readable(96, 'tsp'), (2, 'cup'))
+        self.assertEqual(readable(12, 'tsp'), (0.25, 'cup'))
+        self.assertEqual(readable(6, 'tsp'), (2, 'tbsp'))
+        self.assertEqual(readable(1, 'tsp'), (1, 'tsp'))
+        self.assertEqual(readable(3, 'pinch'), (3, 'pinch'))
+
+
+    def test_shopping_list(self):
+        items = shopping_list([self.soup.id, self.stew.id])
+        self.assertEqual([tuple(item) for item in items], [
+            # 1 cup and 4 tbsp, 2 tsp and 1 tbsp
+            ('Carrots', 1.25, 'cup', 2),
+            ('pepper', 3, 'pinch', 2),
+            ('salt', 1.67, 'tbsp', 2)])
+        self.assertEqual(shopping_list([]), [])
+
+
+    def test_followed_recipes(self):
+        self.susan.follow(self.john)
+        db.session.commit()
+        names = [item.name for item in
+                 shopping_list(followed_recipes(self.susan))]
+        self.assertEqual(names, ['Carrots', 'pepper', 'salt'])
+        names = [item.name for item in
+                 shopping_list(followed_recipes(self.susan, days=60))]
+        self.assertIn('rice', names)
+
+
+    def test_api(self):
+        client = self.app.test_client()
+        response = client.get('/api/v1/shopping-list?ids={},{}'.format(
+            self.soup.id, self.old.id))
+        self.assertEqual(response.status_code, 200)
+        items = json.loads(response.get_data(as_text=True))['items']
+        self.assertEqual(items[2], {'name': 'rice', 'amount': 1,
+                                     'units': 'cup', 'recipes': 1})
+        self.assertEqual(client.get(
+            '/api/v1/shopping-list?followed=1').status_code, 401)
+        self.assertEqual(client.get('/api/v1/shopping-list').status_code,
+                         400)
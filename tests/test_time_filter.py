@@ -0,0 +1,59 @@
+import unittest
+from datetime import timedelta
+from app import create_app, db
+from app.models import User, Role, Recipe
+
+
+class TimeFilterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        author = User(email='john@example.com', username='john',
+                      password='cat', confirmed=True)
+        img = self.app.config['STOCKPOT_DEFAULT_IMG']
+        db.session.add_all([
+            Recipe(title='Quick soup', img_filename=img, author=author,
+                   prep_time=timedelta(minutes=10),
+                   cook_time=timedelta(minutes=15)),
+            Recipe(title='Slow soup', img_filename=img, author=author,
+                   prep_time=timedelta(minutes=30),
+                   cook_time=timedelta(hours=3))])
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def titles(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        page = response.get_data(as_text=True)
+        return [title for title in ('Quick soup', 'Slow soup')
+                if title in page]
+
+
+    def test_index(self):
+        self.assertEqual(self.titles('/?max_time=30m'), ['Quick soup'])
+        self.assertEqual(self.titles('/?min_time=1h'), ['Slow soup'])
+        self.assertEqual(self.titles('/?min_time=1h&max_time=2h'), [])
+
+
+    def test_search(self):
+        self.assertEqual(self.titles('/search?q=soup&max_time=30m'),
+                         ['Quick soup'])
+        self.assertEqual(self.titles('/search?q=soup&min_time=2h'),
+                         ['Slow soup'])
+
+
+    def test_unreadable_times_are_ignored(self):
+        both = ['Quick soup', 'Slow soup']
+        self.assertEqual(self.titles('/?max_time=99999999999d'), both)
+        self.assertEqual(self.titles('/?min_time=soon'), both)
+        self.assertEqual(self.titles(
+            '/search?q=soup&max_time=99999999999d'), both)
@@ -1,7 +1,15 @@
 import unittest
+import os
+import shutil
+import tempfile
 import time
+from io import BytesIO
+from datetime import datetime, timedelta
 from app import create_app, db
-from app.models import User, Role, Permission, AnonymousUser
+from sqlalchemy import event
+from app.models import User, Role, Permission, AnonymousUser, load_user
+from app.activity import last_seen_buffer
+from app.avatars import avatar_store, Image
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -77,3 +85,141 @@ class UserModelTestCase(unittest.TestCase):
     def test_anonymous_user(self):
         u = AnonymousUser()
         self.assertFalse(u.can(Permission.FOLLOW))
+
+
+    def test_ping_is_buffered(self):
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        start = u.last_seen
+        last_seen_buffer.flush_size = 10
+        try:
+            later = start + timedelta(minutes=5)
+            u.ping()
+            self.assertEqual(len(last_seen_buffer), 0)
+            last_seen_buffer.touch(u, later)
+            last_seen_buffer.touch(u, later + timedelta(seconds=1))
+            self.assertEqual(len(last_seen_buffer), 1)
+            self.assertNotIn(u, db.session.dirty)
+            last_seen_buffer.flush()
+        finally:
+            last_seen_buffer.flush_size = 1
+        db.session.expire(u)
+        self.assertEqual(u.last_seen, later)
+
+
+    def test_last_seen_flushed_after_commits(self):
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        later = u.last_seen + timedelta(minutes=5)
+        last_seen_buffer.flush_size = 10
+        try:
+            last_seen_buffer.touch(u, later)
+            db.session.commit()
+            self.assertEqual(len(last_seen_buffer), 1)
+            # the interval passes with nobody else pinging; the flush
+            # waits until the session's own writes are committed
+            last_seen_buffer._last_flush -= last_seen_buffer.flush_interval
+            db.session.add(User(email='susan@example.com', password='dog'))
+            db.session.flush()
+            self.assertEqual(len(last_seen_buffer), 1)
+            db.session.commit()
+            self.assertEqual(len(last_seen_buffer), 0)
+        finally:
+            last_seen_buffer.flush_size = 1
+        db.session.expire(u)
+        self.assertEqual(u.last_seen, later)
+
+
+    def test_failed_last_seen_flush_is_kept(self):
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        later = u.last_seen + timedelta(minutes=5)
+        last_seen_buffer.flush_size = 10
+
+        def fail(pending):
+            raise OSError('database is locked')
+        last_seen_buffer._write = fail
+        try:
+            last_seen_buffer.touch(u, later)
+            last_seen_buffer._last_flush -= last_seen_buffer.flush_interval
+            db.session.commit()
+            self.assertEqual(len(last_seen_buffer), 1)
+        finally:
+            del last_seen_buffer._write
+            last_seen_buffer.flush_size = 1
+        last_seen_buffer.flush()
+        db.session.expire(u)
+        self.assertEqual(u.last_seen, later)
+
+
+    def test_user_loader_cache(self):
+        Role.insert_roles()
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        user_id = u.id
+        db.session.remove()
+        self.assertTrue(load_user(user_id).can(Permission.WRITE_RECIPES))
+        db.session.remove()
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            u = load_user(user_id)
+            self.assertEqual(u.email, 'john@example.com')
+            self.assertTrue(u.can(Permission.WRITE_RECIPES))
+            self.assertFalse(u.is_administrator())
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(statements, [])
+        self.assertNotIn(u, db.session.dirty)
+        u.role = Role.query.filter_by(name='Administrator').first()
+        db.session.commit()
+        db.session.remove()
+        self.assertTrue(load_user(user_id).is_administrator())
+
+
+    @unittest.skipIf(Image is None, 'Pillow is not installed')
+    def test_avatar(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        avatar_store.directory = tempfile.mkdtemp()
+        try:
+            with self.app.test_request_context():
+                url = u.avatar(size=48)
+                self.assertEqual(u.avatar(size=4096),
+                                 '/avatar/{}/256'.format(u.avatar_hash))
+            # rounded up to a size the pages use
+            self.assertEqual(url, '/avatar/{}/50'.format(u.avatar_hash))
+            client = self.app.test_client()
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'image/png')
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            with Image.open(BytesIO(response.get_data())) as picture:
+                self.assertEqual(picture.size, (50, 50))
+            response.close()
+            path = avatar_store.path(u.avatar_hash, 50)
+            self.assertTrue(os.path.exists(path))
+            for bad in ('/avatar/{}/48'.format(u.avatar_hash),
+                        '/avatar/{}/4096'.format(u.avatar_hash),
+                        '/avatar/nothex/50',
+                        '/avatar/{}/50'.format('0' * 32)):
+                self.assertEqual(client.get(bad).status_code, 404)
+            self.assertEqual(os.listdir(avatar_store.directory),
+                             [avatar_store.mode])
+
+            # Gravatar unreachable: the identicon, kept for a while only
+            avatar_store.mode = 'gravatar'
+            avatar_store._download = lambda digest, size: None
+            response = client.get(url)
+            self.assertNotIn('immutable', response.headers['Cache-Control'])
+            response.close()
+        finally:
+            avatar_store.__dict__.pop('_download', None)
+            avatar_store.mode = self.app.config['STOCKPOT_AVATAR_MODE']
+            shutil.rmtree(avatar_store.directory)